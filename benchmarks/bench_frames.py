@@ -0,0 +1,38 @@
+# coding utf-8
+"""
+Compare full json.loads against frames.decode on the recorded frames.
+
+python -m benchmarks.bench_frames
+"""
+
+import json
+import timeit
+
+from meduzach import frames
+from meduzach.meduzach import Meduzach
+from tests.data_example import examples
+
+
+def _route_all(decode):
+    m = Meduzach()
+    for raw in examples:
+        m.route_response(decode(m, raw))
+
+
+def main(number=200):
+    cases = [
+        ("json.loads", lambda: [json.loads(raw) for raw in examples]),
+        ("frames.decode", lambda: [frames.decode(raw) for raw in examples]),
+        ("route json.loads",
+         lambda: _route_all(lambda m, raw: json.loads(raw))),
+        ("route Meduzach.decode",
+         lambda: _route_all(lambda m, raw: m.decode(raw))),
+    ]
+    print("JSON backend: {}".format(frames.JSON_BACKEND))
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=number, repeat=5))
+        print("{:<24} {:8.1f} us/pass".format(name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
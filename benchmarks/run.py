@@ -0,0 +1,207 @@
+# coding utf-8
+"""
+Microbenchmarks of the ingestion and fan-out paths.
+
+Replays the recorded frames from tests/data_example.py and synthetic
+frames scaled by number of chats, messages per frame and subscribers
+per chat. Results are written as JSON, so runs on different commits
+can be compared:
+
+python -m benchmarks.run --output before.json
+python -m benchmarks.run --output after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+from meduzach import frames
+from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.meduzach import Meduzach
+from tests.data_example import examples
+from benchmarks import synthetic
+
+
+class NullBot():
+    def __init__(self):
+        self.sent = 0
+
+    def sendMessage(self, *args, **kwargs):
+        self.sent += 1
+
+
+def measure(func, number, repeat):
+    """
+    Time `number` calls of func, `repeat` times.
+    Returns per-call microseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter() - start) / number * 1e6)
+    return {"best_us": min(timings), "median_us": statistics.median(timings)}
+
+
+def _lobby_frames(chats):
+    # Two snapshots differing in every count, so neither
+    # the frame cache nor the lobby delta can skip the work.
+    first = {synthetic.FIRST_CHAT_ID + i: 10 + i for i in range(chats)}
+    second = {chat_id: count + 1 for chat_id, count in first.items()}
+    return synthetic.lobby_frame(first), synthetic.lobby_frame(second)
+
+
+def _listener(chats):
+    m = Meduzach()
+    m.slowmode = False
+    m._queue_chat_update = lambda chat_id: None
+    m.update_chats(json.loads(_lobby_frames(chats)[0]))
+    m.is_initialized = True
+    return m
+
+
+def bench_recorded_route():
+    def run():
+        m = Meduzach()
+        m._queue_chat_update = lambda chat_id: None
+        for raw in examples:
+            m.route_response(m.decode(raw))
+    return run
+
+
+def bench_route_lobby(chats):
+    m = _listener(chats)
+    raw_frames = itertools.cycle(_lobby_frames(chats))
+    return lambda: m.route_response(m.decode(next(raw_frames)))
+
+
+def bench_update_chats(chats):
+    m = _listener(chats)
+    parsed = itertools.cycle(
+        [frames.project(json.loads(raw)) for raw in _lobby_frames(chats)])
+    return lambda: m.update_chats(next(parsed))
+
+
+def bench_update_messages(messages):
+    m = _listener(1)
+    factory = synthetic.MessageFactory()
+    chat_id = synthetic.FIRST_CHAT_ID
+    parsed = itertools.cycle([
+        frames.project(json.loads(factory.new_msg(chat_id, messages)))
+        for _ in range(16)])
+    return lambda: m.update_messages(next(parsed))
+
+
+def _message_batches(messages, batches=64):
+    m = _listener(1)
+    factory = synthetic.MessageFactory()
+    chat_id = str(synthetic.FIRST_CHAT_ID)
+    updates = []
+    m.connect('chat_updated',
+              lambda sender, payload: updates.append(payload[1]))
+    for _ in range(batches):
+        m.update_messages(frames.project(json.loads(
+            factory.new_msg(chat_id, messages))))
+    return m, updates
+
+
+def bench_format_messages(messages):
+    m, updates = _message_batches(messages)
+    batches = itertools.cycle(updates)
+    return lambda: list(ChatbotLogic.format_messages(
+        next(batches), m.users))
+
+
+def bench_fanout(subscribers, messages):
+    m, updates = _message_batches(messages, batches=1024)
+    logic = ChatbotLogic(m, NullBot())
+    process_chat_update = logic._create_process_chat_update()
+    chat_id = str(synthetic.FIRST_CHAT_ID)
+    for reader_id in range(subscribers):
+        logic._sub(reader_id, chat_id, False)
+    payloads = itertools.cycle((chat_id, batch) for batch in updates)
+    return lambda: process_chat_update(m, next(payloads))
+
+
+def cases(args):
+    yield "recorded_route", {}, bench_recorded_route()
+    for chats in args.chats:
+        params = {"chats": chats}
+        yield "route_lobby", params, bench_route_lobby(chats)
+        yield "update_chats", params, bench_update_chats(chats)
+    for messages in args.messages:
+        params = {"messages": messages}
+        yield "update_messages", params, bench_update_messages(messages)
+        yield "format_messages", params, bench_format_messages(messages)
+    for subscribers in args.subscribers:
+        for messages in args.messages:
+            params = {"subscribers": subscribers, "messages": messages}
+            yield "fanout", params, bench_fanout(subscribers, messages)
+
+
+def _key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--chats", type=int, nargs="+",
+                        default=[10, 100, 1000])
+    parser.add_argument("--messages", type=int, nargs="+",
+                        default=[1, 10, 100])
+    parser.add_argument("--subscribers", type=int, nargs="+",
+                        default=[1, 100, 1000])
+    parser.add_argument("--number", type=int, default=50,
+                        help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="timings per case")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as infile:
+            previous = {_key(r): r for r in json.load(infile)["results"]}
+
+    results = []
+    for name, params, func in cases(args):
+        result = {"name": name, "params": params,
+                  "number": args.number, "repeat": args.repeat}
+        result.update(measure(func, args.number, args.repeat))
+        results.append(result)
+        line = "{:<16} {:<36} {:10.1f} us".format(
+            name, json.dumps(params, sort_keys=True), result["best_us"])
+        old = previous.get(_key(result))
+        if old is not None:
+            line += "  x{:.2f}".format(result["best_us"] / old["best_us"])
+        print(line)
+
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump({
+                "meta": {
+                    "commit": _commit(),
+                    "python": platform.python_version(),
+                    "json_backend": frames.JSON_BACKEND,
+                    "date": datetime.datetime.now().isoformat()},
+                "results": results}, outf, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+# coding utf-8
+"""
+Synthetic Phoenix frames shaped like the recorded ones
+in tests/data_example.py, scaled to any number of chats,
+messages and users.
+"""
+
+import json
+import random
+
+FIRST_CHAT_ID = 1000
+FIRST_MESSAGE_ID = 2000000
+FIRST_USER_ID = 60000
+START_TIME = 1467000000
+
+WORDS = ("сообщение", "пример", "текст", "чат", "новости", "meduza",
+         "*важно*", "_курсив_", "[ссылка]", "`код`", "и", "еще")
+
+
+def chat_key(chat_id):
+    return "news/2016/06/27/synthetic-chat-{}".format(chat_id)
+
+
+def user(user_id):
+    return {"picture_url": "example.jpg",
+            "name": "user {}".format(user_id),
+            "id": str(user_id), "banned": False, "admin": None}
+
+
+def chat(chat_id, messages_count, last_message_at):
+    return {"title": "Синтетический чат номер {}".format(chat_id),
+            "state": "active",
+            "second_title": "Подзаголовок",
+            "published_at": START_TIME,
+            "prefs": {"layout": "rich", "elements": {
+                "ads": {"show": True}, "reactions": {"show": True}}},
+            "messages_count": messages_count,
+            "last_message_at": last_message_at,
+            "key": chat_key(chat_id),
+            "image_url": "/image/example.jpg",
+            "id": str(chat_id),
+            "created_by_user_id": str(FIRST_USER_ID),
+            "active": True}
+
+
+def lobby_frame(chats, users=30):
+    """
+    current_chats push for a {chat_id: messages_count} mapping.
+    """
+    users_ids = [str(FIRST_USER_ID + i) for i in range(users)]
+    return json.dumps({
+        "topic": "topic:lobby", "ref": None, "event": "current_chats",
+        "payload": {
+            "users_ids": users_ids,
+            "users": {user_id: user(user_id) for user_id in users_ids},
+            "chats_ids": [str(chat_id) for chat_id in chats],
+            "chats": {
+                str(chat_id): chat(chat_id, count, START_TIME + count)
+                for chat_id, count in chats.items()}
+        }}, ensure_ascii=False)
+
+
+class MessageFactory():
+    """
+    Produces messages with increasing ids and timestamps.
+    """
+    def __init__(self, users=30, seed=0):
+        self.users = users
+        self._random = random.Random(seed)
+        self._next_id = FIRST_MESSAGE_ID
+        self._time = START_TIME
+
+    def message(self, chat_id, words=12):
+        msg_id = str(self._next_id)
+        self._next_id += 1
+        self._time += 1
+        user_id = str(FIRST_USER_ID + self._random.randrange(self.users))
+        reply = self._random.random() < 0.3
+        return msg_id, {
+            "user_id": user_id, "status": 0,
+            "reply_to_user_id": (
+                str(FIRST_USER_ID + self._random.randrange(self.users))
+                if reply else ""),
+            "message": " ".join(
+                self._random.choice(WORDS) for _ in range(words)),
+            "inserted_at": self._time, "id": msg_id,
+            "chat_key": chat_key(chat_id), "chat_id": str(chat_id),
+            "abuse_reporters": [], "abuse": False}
+
+    def chat_payload(self, chat_id, count):
+        messages = [self.message(chat_id) for _ in range(count)]
+        users_ids = sorted({m["user_id"] for _, m in messages} |
+                           {m["reply_to_user_id"] for _, m in messages
+                            if m["reply_to_user_id"]})
+        return {
+            "users_ids": users_ids,
+            "users": {user_id: user(user_id) for user_id in users_ids},
+            "messages_ids": [msg_id for msg_id, _ in messages],
+            "messages": dict(messages)}
+
+    def join_reply(self, chat_id, count, ref):
+        """
+        phx_reply to a chat topic join carrying `count` messages.
+        """
+        return json.dumps({
+            "topic": "topic:" + chat_key(chat_id), "ref": str(ref),
+            "event": "phx_reply",
+            "payload": {"status": "ok",
+                        "response": self.chat_payload(chat_id, count)}
+        }, ensure_ascii=False)
+
+    def new_msg(self, chat_id, count=1):
+        """
+        new_msg push with `count` messages.
+        """
+        return json.dumps({
+            "topic": "topic:" + chat_key(chat_id), "ref": None,
+            "event": "new_msg",
+            "payload": self.chat_payload(chat_id, count)
+        }, ensure_ascii=False)
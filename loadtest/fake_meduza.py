@@ -0,0 +1,272 @@
+# coding utf-8
+"""
+Local Phoenix-protocol websocket server imitating meduza.io chats.
+
+Implements just enough of RFC 6455 and of the Phoenix channel protocol
+for Meduzach: lobby snapshots, chat topic joins with history,
+heartbeats and new_msg pushes generated at a configurable rate.
+"""
+
+import asyncio
+import base64
+import collections
+import hashlib
+import itertools
+import json
+import random
+import struct
+import threading
+import time
+
+from benchmarks import synthetic
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_TEXT = 0x1
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+def accept_key(key):
+    digest = hashlib.sha1((key + WS_GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def encode_frame(data, opcode=OP_TEXT):
+    header = bytes([0x80 | opcode])
+    length = len(data)
+    if length < 126:
+        header += bytes([length])
+    elif length < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", length)
+    else:
+        header += bytes([127]) + struct.pack("!Q", length)
+    return header + data
+
+
+async def read_frame(reader):
+    """
+    Return (opcode, payload) of the next client frame.
+    """
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+class _Connection():
+    def __init__(self, writer):
+        self.writer = writer
+        self.topics = set()
+
+    def push(self, frame):
+        self.writer.write(encode_frame(json.dumps(
+            frame, ensure_ascii=False).encode()))
+
+
+class FakeMeduza():
+    """
+    Fake Meduza chat server.
+
+    `rate` new messages per second are spread randomly over `chats`
+    chats, `burst` messages per new_msg push. Every message text
+    starts with a marker "lt<seq>", and `generated` maps seq to
+    (time generated, chat id), to measure end-to-end latency.
+    """
+    def __init__(self, chats=10, rate=5.0, burst=1, history=20,
+                 users=30, host="127.0.0.1", port=0, seed=0):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.burst = burst
+        self.history = history
+        self.users = users
+        self.chat_ids = [
+            str(synthetic.FIRST_CHAT_ID + i) for i in range(chats)]
+        self.generated = {}
+        self.frames_sent = 0
+
+        self._random = random.Random(seed)
+        self._seq = itertools.count()
+        self._messages = {
+            chat_id: collections.deque(maxlen=history)
+            for chat_id in self.chat_ids}
+        self._counts = {chat_id: 0 for chat_id in self.chat_ids}
+        self._connections = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        for chat_id in self.chat_ids:
+            self._add_messages(chat_id, 1)
+
+    @property
+    def url(self):
+        return "ws://{}:{}/pond/socket/websocket?token=no_token&vsn=1.0.0".\
+            format(self.host, self.port)
+
+    def _add_messages(self, chat_id, count):
+        now = time.time()
+        messages = []
+        for _ in range(count):
+            seq = next(self._seq)
+            user_id = str(synthetic.FIRST_USER_ID +
+                          self._random.randrange(self.users))
+            msg_id = str(synthetic.FIRST_MESSAGE_ID + seq)
+            messages.append((msg_id, {
+                "user_id": user_id, "status": 0, "reply_to_user_id": "",
+                "message": "lt{} {}".format(seq, " ".join(
+                    self._random.choice(synthetic.WORDS)
+                    for _ in range(8))),
+                "inserted_at": int(now), "id": msg_id,
+                "chat_key": synthetic.chat_key(chat_id),
+                "chat_id": chat_id}))
+            self.generated[seq] = (now, chat_id)
+        self._messages[chat_id].extend(messages)
+        self._counts[chat_id] += count
+        return messages
+
+    def _chat_payload(self, messages):
+        users_ids = sorted({m["user_id"] for _, m in messages})
+        return {
+            "users_ids": users_ids,
+            "users": {u: synthetic.user(u) for u in users_ids},
+            "messages_ids": [msg_id for msg_id, _ in messages],
+            "messages": dict(messages)}
+
+    def _lobby_payload(self):
+        return {
+            "users_ids": [],
+            "users": {},
+            "chats_ids": self.chat_ids,
+            "chats": {
+                chat_id: synthetic.chat(
+                    int(chat_id), self._counts[chat_id],
+                    self._messages[chat_id][-1][1]["inserted_at"])
+                for chat_id in self.chat_ids}}
+
+    def _send(self, connection, frame):
+        connection.push(frame)
+        self.frames_sent += 1
+
+    def _handle(self, connection, request):
+        topic = request.get("topic")
+        event = request.get("event")
+        ref = request.get("ref")
+        reply = {"topic": topic, "ref": ref, "event": "phx_reply",
+                 "payload": {"status": "ok", "response": {}}}
+        if event == "heartbeat":
+            self._send(connection, reply)
+        elif event == "phx_leave":
+            connection.topics.discard(topic)
+            self._send(connection, reply)
+        elif event == "phx_join":
+            if topic in connection.topics:
+                # Phoenix closes the previous channel on a duplicate join.
+                self._send(connection, {"topic": topic, "ref": None,
+                                        "event": "phx_close", "payload": {}})
+            connection.topics.add(topic)
+            if topic == "topic:lobby":
+                self._send(connection, reply)
+                self._send(connection, {
+                    "topic": topic, "ref": None, "event": "current_chats",
+                    "payload": self._lobby_payload()})
+                return
+            chat_id = topic.rsplit("-", 1)[-1]
+            if chat_id in self._messages:
+                reply["payload"]["response"] = self._chat_payload(
+                    list(self._messages[chat_id]))
+            self._send(connection, reply)
+
+    async def _serve(self, reader, writer):
+        connection = _Connection(writer)
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            headers = dict(
+                line.split(": ", 1)
+                for line in request.decode().split("\r\n")[1:] if line)
+            key = {k.lower(): v for k, v in headers.items()}[
+                "sec-websocket-key"]
+            writer.write((
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                "Sec-WebSocket-Accept: {}\r\n\r\n").format(
+                    accept_key(key)).encode())
+            self._connections.add(connection)
+            while True:
+                opcode, payload = await read_frame(reader)
+                if opcode == OP_CLOSE:
+                    writer.write(encode_frame(payload[:2], OP_CLOSE))
+                    break
+                if opcode == OP_PING:
+                    writer.write(encode_frame(payload, OP_PONG))
+                elif opcode == OP_TEXT:
+                    self._handle(connection, json.loads(payload.decode()))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _generate(self):
+        if self.rate <= 0:
+            return
+        interval = self.burst / self.rate
+        while True:
+            await asyncio.sleep(interval)
+            chat_id = self._random.choice(self.chat_ids)
+            messages = self._add_messages(chat_id, self.burst)
+            topic = "topic:" + synthetic.chat_key(chat_id)
+            frame = {"topic": topic, "ref": None, "event": "new_msg",
+                     "payload": self._chat_payload(messages)}
+            for connection in list(self._connections):
+                if topic in connection.topics:
+                    self._send(connection, frame)
+
+    async def _start(self):
+        self._server = await asyncio.start_server(
+            self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        asyncio.ensure_future(self._generate())
+
+    def start(self):
+        """
+        Run the server on its own thread, return once it listens.
+        """
+        started = threading.Event()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(
+            target=_run, name="fake-meduza", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def _close(self):
+        self._server.close()
+        # Drop clients too, as a server going away would. Abort
+        # takes effect at once, the loop is stopped right after.
+        for connection in list(self._connections):
+            connection.writer.transport.abort()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
@@ -0,0 +1,166 @@
+# coding utf-8
+"""
+Stub of the Telegram Bot API for load tests.
+
+Serves getUpdates with queued synthetic commands, records every
+sendMessage call, and can add latency and 429 responses.
+"""
+
+import http.server
+import json
+import random
+import re
+import socketserver
+import threading
+import time
+
+MARKER_RE = re.compile(r'lt(\d+)')
+URL_RE = re.compile(r'^/bot[^/]*/(\w+)$')
+
+BOT_USER = {"id": 1, "first_name": "Meduzach", "username": "meduzachbot"}
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http.server.HTTPServer):
+    daemon_threads = True
+
+
+class FakeTelegram():
+    """
+    Fake Bot API server.
+
+    Every sendMessage waits `latency` seconds and fails with 429
+    with probability `error_rate`. Successful calls are kept in
+    `sent` as (time, chat_id, text).
+    """
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1,
+                 host="127.0.0.1", port=0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.sent = []
+        self.rejected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates = []
+        self._update_id = 0
+        self._new_updates = threading.Condition(self._lock)
+        self._server = _ThreadingHTTPServer(
+            (host, port), self._handler_class())
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """
+        Prefix for telegram.Bot(token, base_url).
+        """
+        return "http://{}:{}/bot".format(self.host, self.port)
+
+    def send_command(self, chat_id, text):
+        """
+        Queue a private message from chat_id for getUpdates.
+        """
+        with self._lock:
+            self._update_id += 1
+            self._updates.append({
+                "update_id": self._update_id,
+                "message": {
+                    "message_id": self._update_id,
+                    "from": {"id": chat_id, "first_name": str(chat_id)},
+                    "chat": {"id": chat_id, "type": "private"},
+                    "date": int(time.time()),
+                    "text": text}})
+            self._new_updates.notify_all()
+
+    def deliveries(self):
+        """
+        Return a list of (time, chat_id, marker) for every
+        message marker delivered.
+        """
+        with self._lock:
+            sent = list(self.sent)
+        return [(at, chat_id, int(marker))
+                for at, chat_id, text in sent
+                for marker in MARKER_RE.findall(text)]
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.time() + timeout
+        with self._lock:
+            self._updates = [
+                u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.time() < deadline:
+                self._new_updates.wait(deadline - time.time())
+            return list(self._updates[:int(params.get("limit") or 100)])
+
+    def _send_message(self, params):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if self._random.random() < self.error_rate:
+                self.rejected += 1
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": "Too Many Requests: retry after {}".format(
+                        self.retry_after),
+                    "parameters": {"retry_after": self.retry_after}}
+            self.sent.append((time.time(), int(params["chat_id"]),
+                              params.get("text", "")))
+            message_id = len(self.sent)
+        return 200, {"ok": True, "result": {
+            "message_id": message_id,
+            "from": BOT_USER,
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "date": int(time.time()),
+            "text": params.get("text", "")}}
+
+    def _call(self, method, params):
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(params)}
+        if method == "sendMessage":
+            return self._send_message(params)
+        return 200, {"ok": True, "result": True}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                match = URL_RE.match(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b"{}"
+                if match is None:
+                    self.send_error(404)
+                    return
+                status, result = stub._call(
+                    match.group(1), json.loads(body.decode() or "{}"))
+                data = json.dumps(result).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-telegram",
+            daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,165 @@
+# coding utf-8
+"""
+End-to-end load test of meduzach_telegram_bot against
+a local fake Meduza server and a stub Telegram Bot API.
+
+python -m loadtest.run --chats 20 --readers 200 --rate 10 --duration 60
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from loadtest.fake_meduza import FakeMeduza
+from loadtest.fake_telegram import FakeTelegram
+
+TOKEN = "123456:loadtest"
+FIRST_READER_ID = 100000
+SUBSCRIBED_TEXT = "Вы подписались"
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def subscribe_readers(telegram, chat_ids, readers, per_reader):
+    """
+    Send /<chat_id> commands, return {chat_id: set of reader ids}.
+    """
+    subscribers = {chat_id: set() for chat_id in chat_ids}
+    for i in range(readers):
+        reader_id = FIRST_READER_ID + i
+        for j in range(per_reader):
+            chat_id = chat_ids[(i + j) % len(chat_ids)]
+            subscribers[chat_id].add(reader_id)
+            telegram.send_command(reader_id, "/" + chat_id)
+    return subscribers
+
+
+def wait_subscribed(telegram, expected, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        confirmed = sum(1 for _, _, text in list(telegram.sent)
+                        if text.startswith(SUBSCRIBED_TEXT))
+        if confirmed >= expected:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def report(meduza, telegram, subscribers, start, end):
+    markers = {
+        seq: (generated_at, chat_id)
+        for seq, (generated_at, chat_id) in list(meduza.generated.items())
+        if start <= generated_at < end}
+    expected = sum(len(subscribers.get(chat_id, ()))
+                   for _, chat_id in markers.values())
+    first_delivery = {}
+    for delivered_at, reader_id, seq in telegram.deliveries():
+        if seq in markers and reader_id in subscribers.get(
+                markers[seq][1], ()):
+            key = (reader_id, seq)
+            if key not in first_delivery:
+                first_delivery[key] = delivered_at - markers[seq][0]
+    latencies = list(first_delivery.values())
+    calls = sum(1 for at, _, _ in list(telegram.sent) if start <= at < end)
+    duration = end - start
+    return {
+        "duration_s": duration,
+        "messages_generated": len(markers),
+        "deliveries_expected": expected,
+        "deliveries": len(latencies),
+        "delivery_ratio": len(latencies) / expected if expected else None,
+        "send_message_calls_per_s": calls / duration,
+        "deliveries_per_s": len(latencies) / duration,
+        "rejected_429": telegram.rejected,
+        "latency_s": {
+            "mean": statistics.mean(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": max(latencies) if latencies else None
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--readers", type=int, default=50)
+    parser.add_argument("--subscriptions", type=int, default=1,
+                        help="chats each reader subscribes to")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="new chat messages per second")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="messages per new_msg push")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="sendMessage latency, seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of sendMessage calls answered with 429")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--drain", type=float, default=10,
+                        help="seconds to wait for queued deliveries")
+    parser.add_argument("--no-slowmode", action="store_true",
+                        help="do not rate limit frames sent to Meduza")
+    parser.add_argument("--output", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    # The bot keeps its SQLite store and snapshot
+    # in the working directory.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="meduzach-loadtest-") as workdir:
+        os.chdir(workdir)
+        try:
+            result = run(args)
+        finally:
+            os.chdir(cwd)
+    result["params"] = vars(args)
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as outf:
+            json.dump(result, outf, indent=2)
+
+
+def run(args):
+    meduza = FakeMeduza(chats=args.chats, rate=args.rate,
+                        burst=args.burst).start()
+    telegram = FakeTelegram(latency=args.latency).start()
+
+    from meduzach import meduzach_telegram_bot as bot
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.listener.slowmode = not args.no_slowmode
+    updater = bot.main(token=TOKEN, meduza_addr=meduza.url,
+                       base_url=telegram.base_url, idle=False,
+                       metrics_port=None)
+    try:
+        subscribers = subscribe_readers(
+            telegram, meduza.chat_ids, args.readers, args.subscriptions)
+        if not wait_subscribed(telegram, args.readers * args.subscriptions,
+                               timeout=60 + args.readers):
+            print("Not every reader got subscribed", file=sys.stderr)
+        # Throttle only the measured phase, subscribing has no retries.
+        telegram.error_rate = args.error_rate
+
+        start = time.time()
+        time.sleep(args.duration)
+        end = time.time()
+        time.sleep(args.drain)
+        return report(meduza, telegram, subscribers, start, end)
+    finally:
+        # Stops the listener and delivery while the fake servers are
+        # still up, flushes the store and writes the final snapshot.
+        bot.shutdown(updater)
+        meduza.stop()
+        telegram.stop()
+
+if __name__ == '__main__':
+    main()
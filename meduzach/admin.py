@@ -0,0 +1,63 @@
+# coding utf-8
+
+import traceback
+
+from meduzach import profiling
+
+
+class AdminCommands():
+    """
+    Bot commands available only to `admin_ids`.
+
+    /profile_start, /profile_stop - sampling CPU profile of all threads
+    /memory - memory by structure and allocation site
+
+    Results are written to `directory`, the reply holds a summary.
+    """
+    def __init__(self, structures, admin_ids=(), directory=None):
+        self.structures = structures
+        self.admin_ids = set(admin_ids)
+        self.directory = directory or profiling.PROFILES_DIR
+        self.profiler = profiling.SamplingProfiler()
+
+    def is_admin(self, update):
+        return update.message.chat_id in self.admin_ids
+
+    def _admin_only(self, handler):
+        def _handler(bot, update):
+            if not self.is_admin(update):
+                print("{} is not an admin".format(update.message.chat_id))
+                return
+            try:
+                bot.sendMessage(update.message.chat_id, text=handler())
+            except:
+                traceback.print_exc()
+        return _handler
+
+    def _create_profile_start(self):
+        def profile_start():
+            if not self.profiler.start():
+                return "Профилировщик уже запущен."
+            return "Профилировщик запущен: /profile_stop"
+        return self._admin_only(profile_start)
+
+    def _create_profile_stop(self):
+        def profile_stop():
+            if not self.profiler.stop():
+                return "Профилировщик не запущен: /profile_start"
+            path = profiling.output_path("cpu", self.directory)
+            self.profiler.write(path)
+            top = "\n".join("{} {}".format(samples, name)
+                            for name, samples in self.profiler.top(10))
+            return "{}\n{}".format(path, top)
+        return self._admin_only(profile_stop)
+
+    def _create_memory(self):
+        def memory():
+            lines = profiling.memory_report(self.structures())
+            path = profiling.output_path("memory", self.directory)
+            with open(path, "w") as outf:
+                print("\n".join(lines), file=outf)
+            summary = lines[:lines.index("")] if "" in lines else lines
+            return "{}\n{}".format(path, "\n".join(summary))
+        return self._admin_only(memory)
@@ -0,0 +1,158 @@
+# coding utf-8
+
+import asyncio
+import datetime
+import json
+import traceback
+
+from meduzach.keepalive import KEEPALIVE_TICK
+from meduzach.meduzach import Meduzach
+
+SEND_INTERVAL = datetime.timedelta(seconds=1)
+
+
+class SendScheduler():
+    """
+    Spaces outgoing frames at least `interval` seconds apart.
+
+    Unlike `time.sleep` in `Meduzach.send`, waiting for a slot
+    only suspends the coroutine that wants to send,
+    so the reader and other tasks keep running.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_slot = 0
+
+    async def acquire(self):
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncMeduzach(Meduzach):
+    """
+    Meduzach running on an asyncio event loop.
+
+    Reading, heartbeats, lobby polls and topic joins are separate tasks.
+    Incoming frames go through the same `route_response`, so signals
+    are emitted exactly as in the blocking `Meduzach.run`.
+    """
+    def __init__(self):
+        super().__init__()
+        self.scheduler = SendScheduler(SEND_INTERVAL.total_seconds())
+        self._chats_to_be_updated_queue = None
+
+    def _queue_chat_update(self, chat_id):
+        self._chats_to_be_updated_queue.put_nowait(chat_id)
+
+    def _leave_chat(self, chat_id):
+        request = self._leave_request(chat_id)
+        if request is not None:
+            asyncio.ensure_future(self.send_async(request))
+
+    def _check_initialized(self):
+        if (not self.is_initialized and self.chats and
+                self._chats_to_be_updated_queue.empty() and
+                not self.channels.pending):
+            print("Chat list initialized!")
+            self.is_initialized = True
+
+    async def send_async(self, data, urgent=False):
+        """
+        Send a frame once the scheduler allows it.
+
+        Urgent frames (heartbeats) are not rate limited.
+        """
+        if self.slowmode and not urgent:
+            await self.scheduler.acquire()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._ws.send, json.dumps(data))
+
+    async def _reader(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            response = await loop.run_in_executor(None, self.receive)
+            self.route_response(response)
+            self._check_initialized()
+
+    async def _keepalive_loop(self):
+        while True:
+            if self.keepalive.dead():
+                raise ConnectionError("No heartbeat reply")
+            if self.keepalive.due():
+                await self.send_async(self._heartbeat_request(), urgent=True)
+            await asyncio.sleep(KEEPALIVE_TICK.total_seconds())
+
+    async def _lobby_loop(self):
+        while True:
+            self.lobby_poll.polled()
+            await self.send_async(self._topic_request("topic:lobby"))
+            self._expire_joins()
+            await asyncio.sleep(self.lobby_poll.interval)
+
+    async def _topic_loop(self):
+        while True:
+            # Joins are not awaited: replies and pushes are routed
+            # to their chats by the reader, so topics are joined
+            # as fast as the scheduler allows.
+            chat_id = await self._chats_to_be_updated_queue.get()
+            request = self._join_request(chat_id)
+            if request is not None:
+                await self.send_async(request)
+            self._check_initialized()
+
+    async def _session(self):
+        self._chats_to_be_updated.clear()
+        self._chats_to_be_updated_queue = asyncio.Queue()
+        self.channels.clear()
+        self.keepalive.reset()
+        tasks = [
+            asyncio.ensure_future(coro)
+            for coro in (self._reader(), self._keepalive_loop(),
+                         self._lobby_loop(), self._topic_loop())]
+        try:
+            done, _ = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Aborting the socket wakes up a reader stuck in recv.
+            self.close()
+
+    async def run_async(self, recover=True):
+        loop = asyncio.get_event_loop()
+        while not self._stopped:
+            try:
+                await loop.run_in_executor(None, self.connect_to_server)
+                if self._stopped:
+                    break
+                await self._session()
+            except Exception:
+                if self._stopped:
+                    break
+                if not recover:
+                    raise
+                traceback.print_exc()
+                self.close()
+                delay = self.reconnect_backoff.next()
+                print("Reconnecting in {:.1f} s...".format(delay))
+                await asyncio.sleep(delay)
+            finally:
+                self.close()  # It's okay to call it twice
+
+    def run(self, recover=True):
+        """
+        Run the event loop in the calling thread.
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run_async(recover))
+        finally:
+            loop.close()
@@ -0,0 +1,95 @@
+# coding utf-8
+
+import time
+
+
+class ChannelRegistry():
+    """
+    Book-keeping for chat topics joined on a single Phoenix socket.
+
+    Join replies are matched by (topic, ref), pushes by topic only.
+    """
+    def __init__(self):
+        self._topic_to_chat = {}
+        self._chat_to_topic = {}
+        self._pending = {}
+        self._joined = set()
+
+    @property
+    def pending(self):
+        """
+        Number of joins still waiting for a reply.
+        """
+        return len(self._pending)
+
+    def is_joined(self, chat_id):
+        return chat_id in self._joined
+
+    def is_joining(self, chat_id):
+        topic = self._chat_to_topic.get(chat_id)
+        return any(t == topic for t, _ in self._pending)
+
+    def topic(self, chat_id):
+        return self._chat_to_topic.get(chat_id)
+
+    def join(self, chat_id, topic, ref):
+        """
+        Remember an outgoing phx_join for chat.
+        """
+        self._topic_to_chat[topic] = chat_id
+        self._chat_to_topic[chat_id] = topic
+        self._pending[(topic, ref)] = (chat_id, time.monotonic())
+
+    def resolve(self, response):
+        """
+        Return (chat_id, is_join_reply) for a frame on a chat topic.
+
+        chat_id is None for topics we have not joined.
+        """
+        topic = response.get('topic')
+        if response.get('event') == 'phx_reply':
+            pending = self._pending.pop((topic, response.get('ref')), None)
+            if pending is not None:
+                chat_id = pending[0]
+                self._joined.add(chat_id)
+                return chat_id, True
+        return self._topic_to_chat.get(topic), False
+
+    def closed(self, topic):
+        """
+        Forget that we are joined to topic (phx_close / phx_error).
+        """
+        chat_id = self._topic_to_chat.get(topic)
+        if chat_id is not None:
+            self._joined.discard(chat_id)
+        return chat_id
+
+    def leave(self, chat_id):
+        """
+        Forget chat completely, return its topic or None.
+        """
+        topic = self._chat_to_topic.pop(chat_id, None)
+        self._joined.discard(chat_id)
+        if topic is not None:
+            self._topic_to_chat.pop(topic, None)
+            self._pending = {
+                key: value for key, value in self._pending.items()
+                if key[0] != topic}
+        return topic
+
+    def expire(self, timeout):
+        """
+        Drop joins that got no reply within timeout seconds.
+
+        Returns the list of affected chat ids.
+        """
+        deadline = time.monotonic() - timeout
+        expired = [key for key, (_, sent_at) in self._pending.items()
+                   if sent_at < deadline]
+        return [self._pending.pop(key)[0] for key in expired]
+
+    def clear(self):
+        self._topic_to_chat.clear()
+        self._chat_to_topic.clear()
+        self._pending.clear()
+        self._joined.clear()
@@ -0,0 +1,59 @@
+# coding utf-8
+
+import bisect
+import threading
+
+
+class ChatIndex():
+    """
+    Chats ordered by last_message_at, newest first.
+
+    Kept up to date by the listener as lobby snapshots change,
+    so readers never sort the whole chat list. `version` grows
+    with every change.
+    """
+    def __init__(self):
+        self._keys = []
+        self._key_of = {}
+        self._info = {}
+        self._lock = threading.Lock()
+        self.version = 0
+
+    @staticmethod
+    def _key(chat_id, chat_info):
+        return (-(chat_info.get('last_message_at') or 0), chat_id)
+
+    def update(self, chat_id, chat_info):
+        key = self._key(chat_id, chat_info)
+        with self._lock:
+            old_key = self._key_of.get(chat_id)
+            if old_key != key:
+                if old_key is not None:
+                    del self._keys[bisect.bisect_left(self._keys, old_key)]
+                bisect.insort(self._keys, key)
+                self._key_of[chat_id] = key
+            self._info[chat_id] = chat_info
+            self.version += 1
+
+    def remove(self, chat_id):
+        with self._lock:
+            key = self._key_of.pop(chat_id, None)
+            if key is None:
+                return
+            del self._keys[bisect.bisect_left(self._keys, key)]
+            del self._info[chat_id]
+            self.version += 1
+
+    def snapshot(self):
+        """
+        Return (version, [(chat_id, chat_info), ...]) newest first.
+        """
+        with self._lock:
+            return self.version, [
+                (chat_id, self._info[chat_id]) for _, chat_id in self._keys]
+
+    def __contains__(self, chat_id):
+        return chat_id in self._key_of
+
+    def __len__(self):
+        return len(self._keys)
@@ -1,7 +1,6 @@
 # coding utf-8
 import logging
 import collections
-import threading
 import re
 import traceback
 import datetime
@@ -9,128 +8,222 @@ import time
 
 import telegram
 from telegram.error import Unauthorized
-from meduzach.connections import Connector
+from meduzach.coalesce import Coalescer
+from meduzach.connections import Connector, QUEUED
+from meduzach.metrics import DELIVERY_LATENCY, FANOUT, SEND_ERRORS
+from meduzach.render import RenderCache, RenderedUpdate, ChatListCache
+from meduzach.subscriptions import SubscriptionRegistry
 
 
 MSG_LIMIT = 2048
 
+# Chat updates waiting for the fan-out thread
+UPDATE_QUEUE_SIZE = 10000
+
+# Messages sent on subscribe, the rest is behind /more
+CATCHUP_PAGE_SIZE = 50
+
+# Chats in /hot, also followed by /autohot readers
+HOT_COUNT = 10
+# Pseudo chat id keeping the /autohot choice in the store
+HOT_CHAT_ID = 'hot'
+# Prefix of pseudo chat ids keeping followed authors in the store
+FOLLOW_PREFIX = '@'
+
 SHORT_TITLE_LENGTH = 12
 CHATS_CACHE_EXPIRE_TIME = datetime.timedelta(seconds=10)
 
+MARKDOWN_ESCAPE = str.maketrans({
+    "\\": "\\\\",
+    "*": "\\*",
+    "_": "\\_",
+    "[": "\\[",
+    "`": "\\`"})
+
 TOGGLE_SUB_RE = re.compile('^/(\d+)$')
 
 
 class UserState():
-    def __init__(self):
+    def __init__(self, chats=None):
         self.latest = None
         self.unsub_time = collections.defaultdict(int)
-        self.chats = []
+        self.chats = set() if chats is None else chats
+        # (chat_id, position, end) of unsent catch-up
+        self.more = None
+
+
+class ReaderStates(dict):
+    """
+    reader_id -> UserState, created on first access.
+
+    UserState.chats is the registry's live set of the reader's chats.
+    """
+    def __init__(self, subscriptions):
+        super().__init__()
+        self.subscriptions = subscriptions
+
+    def __missing__(self, reader_id):
+        return self.setdefault(
+            reader_id, UserState(self.subscriptions.chats(reader_id)))
 
 
 class ChatbotLogic(Connector):
     HELP_TEXT = ("Список активных чатов: /chats\n"
                  "Чтобы подписаться или отписаться "
                  "от обновлений чата, "
-                 "нажмите на его номер в списке.\n\n"
+                 "нажмите на его номер в списке.\n"
+                 "Следующие сообщения чата после подписки: /more\n"
+                 "Самые активные чаты: /hot\n"
+                 "Подписываться на них автоматически: /autohot\n"
+                 "Следить за человеком во всех чатах: /follow Имя\n\n"
                  "Если что, пишите @upppi\n"
                  "https://github.com/uppi/meduzach")
 
-    def __init__(self, listener, bot):
-        listener.connect(
-            'chat_updated', self._create_process_chat_update())
+    MORE_TEXT = "Ещё {} сообщений: /more"
+    NO_MORE_TEXT = "Больше сообщений нет."
+    AUTOHOT_ON_TEXT = ("Вы будете автоматически подписываться "
+                       "на самые активные чаты: /hot\n"
+                       "Отключить: /autohot")
+    AUTOHOT_OFF_TEXT = "Автоматическая подписка на активные чаты отключена."
+    AUTOHOT_SUB_TEXT = "Активный чат /{} ({}), вы подписаны."
+    FOLLOW_USAGE_TEXT = ("Чтобы следить за человеком во всех чатах, "
+                         "напишите /follow и его имя.")
+
+    def __init__(self, listener, bot, store=None, coalesce_window=None):
+        """
+        With coalesce_window (timedelta) set, bursts of a chat's
+        updates are merged and sent in as few messages as fit.
+        """
         self.listener = listener
+        self.coalescer = None
+        self._update_source = listener
+        # Fan-out runs on its own thread, so slow sends only stall
+        # the listener's socket loop once UPDATE_QUEUE_SIZE updates
+        # pile up. Updates are not dropped, the time the listener
+        # waits is in meduzach_slot_blocked_seconds_total.
+        self._update_conn = listener.connect(
+            'chat_updated', self._create_process_chat_update(),
+            mode=QUEUED, maxsize=UPDATE_QUEUE_SIZE)
+        if coalesce_window is not None:
+            self.coalesce(coalesce_window)
         self.settings = {"track": True}
 
         self.meduzach_chats = {}
-        self.chats_to_readers = collections.defaultdict(list)
-        self.readers = collections.defaultdict(lambda: UserState())
-        self.lock = threading.RLock()
-        self.track_lock = threading.Lock()
+        self.subscriptions = SubscriptionRegistry()
+        self.readers = ReaderStates(self.subscriptions)
+        # Readers following hot chats, and hot chats seen last time
+        self.hot_readers = set()
+        self._hot_chats = set()
+        # Author user_id <-> readers following them
+        self.follows = SubscriptionRegistry()
+        self.store = store
+        listener.connect('chatlist_updated', self._chatlist_updated)
+        self.delivery = None
+        self.renderer = RenderCache(self._format, MSG_LIMIT)
+        self.catchup_page_size = CATCHUP_PAGE_SIZE
+        self.chat_list = ChatListCache(
+            listener.chat_index, CHATS_CACHE_EXPIRE_TIME.total_seconds())
 
         self.bot = bot
 
+    def coalesce(self, window):
+        """
+        Merge bursts of a chat's updates for up to `window`
+        (timedelta) before fan-out. Call before the listener starts.
+        """
+        if self.coalescer is not None:
+            # Reconnecting would leave the old coalescer subscribed.
+            self.coalescer.window = window.total_seconds()
+            return
+        self._update_source.disconnect(self._update_conn)
+        self.coalescer = Coalescer(self.listener, window).start()
+        self._update_source = self.coalescer
+        self._update_conn = self.coalescer.connect(
+            'chat_updated', self._create_process_chat_update(),
+            mode=QUEUED, maxsize=UPDATE_QUEUE_SIZE)
+
+    def stop(self, timeout=None):
+        """
+        Flush coalesced updates and wait for their fan-out.
+        """
+        if self.coalescer is not None:
+            self.coalescer.stop()
+        self._update_source.slot(self._update_conn).join(timeout)
+
     def _track(self, user, action, payload=None):
-        if not self.settings.get("track", False):
+        if not self.settings.get("track", False) or self.store is None:
             return
-        try:
-            if BOTAN_TOKEN is not None:
-                self.botan.track(user, payload, action)
-            with self.track_lock:
-                with open("track.txt", "a") as outf:
-                    print(
-                        datetime.datetime.now().strftime("%d/%m/%y_%H:%M"),
-                        user, action, payload, file=outf)
-        except:
-            traceback.print_exc()
+        self.store.track(user, action, payload)
 
-    def _restore_tracked(self):
-        earliest = datetime.datetime.now() - datetime.timedelta(days=1)
+    def _chatlist_updated(self, sender, payload):
+        _, removed, _ = payload
+        if removed and self.store is not None:
+            self.store.forget_chats(removed)
+
+    def restore_tracked(self):
+        """
+        Restore subscriptions saved in the store with one bulk load.
+        Call once the chat list is known, rows of chats that ended
+        while the bot was down are deleted.
+        """
+        if self.store is None:
+            return
         try:
-            with open("track.txt") as infile:
-                for line in infile:
-                    try:
-                        date, user, action, chat_id = line.split()
-                        if chat_id == "None":
-                            continue
-                        if chat_id not in self.listener.chats:
-                            print("chat {} ended".format(chat_id))
-                            continue
-                        user = int(user)
-                        print("so we proceed", action)
-                        is_sub = None
-                        if action == "sub":
-                            is_sub = True
-                        elif action == "unsub":
-                            is_sub = False
-                        if is_sub is None:
-                            continue
-                        print("so we proceed - 2", action)
-                        date = datetime.datetime.strptime(date, "%d/%m/%y_%H:%M")
-                        if date > earliest:
-                            print("date ok")
-                            try:
-                                if is_sub:
-                                    print("sub!")
-                                    self._sub(user, chat_id, False)
-                                else:
-                                    self._unsub(user, chat_id)
-                            except IndexError:
-                                print("No messages in chat")
-                    except:
-                        traceback.print_exc()
+            rows = self.store.load()
         except:
             traceback.print_exc()
+            return
+        ended = set()
+        for reader_id, chat_id, subscribed, unsub_time in rows:
+            if chat_id == HOT_CHAT_ID:
+                if subscribed:
+                    self.hot_readers.add(reader_id)
+                continue
+            if chat_id.startswith(FOLLOW_PREFIX):
+                if subscribed:
+                    self.follows.subscribe(
+                        reader_id, chat_id[len(FOLLOW_PREFIX):])
+                continue
+            if chat_id not in self.listener.chats:
+                ended.add(chat_id)
+                continue
+            if subscribed:
+                self.subscriptions.subscribe(reader_id, chat_id)
+            else:
+                self.readers[reader_id].unsub_time[chat_id] = unsub_time
+        self.store.forget_chats(ended)
 
     @staticmethod
     def escape_markdown(text):
-        return (text.replace("\\", "\\\\")
-                    .replace("*", "\\*")
-                    .replace("_", "\\_")
-                    .replace("[", "\\[")
-                    .replace("`", "\\`"))
+        return text.translate(MARKDOWN_ESCAPE)
 
     @staticmethod
-    def format_messages(messages):
+    def format_messages(messages, users=None):
         """
         Return a list of telegram messages
         representing given list of chat messages.
 
         Takes care of maximum telegram message length.
+        users maps user ids to names, to show whom a message replies to.
         """
         cur_msg = []
         cur_size = 0
         for message in messages:
             author = message["author"]
             text = message["text"]
-            text = ChatbotLogic.escape_markdown(text)
-            reply = message["reply_to"] or ""
-            if reply:
-                reply = self.listener.users.get(reply, "")
+            text = text.translate(MARKDOWN_ESCAPE)
+            reply = message["reply_to"]
+            if reply and users is not None:
+                reply = users.get(reply)
+            else:
+                reply = None
             if reply:
-                reply = " @_{}_".format(reply["name"])
+                reply = " @_{}_".format(reply)
+            else:
+                reply = ""
             formatted = "*{}*{} {}".format(author, reply, text)
             fmt_size = len(formatted)
-            if cur_size + fmt_size < MSG_LIMIT:
+            if not cur_msg or cur_size + fmt_size < MSG_LIMIT:
                 cur_msg.append(formatted)
                 cur_size += fmt_size
             else:
@@ -140,111 +233,233 @@ class ChatbotLogic(Connector):
         if cur_msg:
             yield "\n".join(cur_msg)
 
+    def _format(self, messages):
+        return ChatbotLogic.format_messages(
+            messages, getattr(self.listener, 'users', None))
+
     def _create_process_chat_update(self):
         def process_chat_update(sender, payload):
             """
             Publish new message to all subscriptors.
 
-            Called from meduzach thread.
+            Called from meduzach thread. With a delivery scheduler
+            attached it only queues messages.
             """
             chat_id, messages = payload
 
-            if not self.listener.is_initialized:
+            if (not self.listener.is_initialized or
+                    chat_id not in self.listener.chats):
+                return
+            self._follow_hot()
+            readers = self.subscriptions.readers(chat_id)
+            FANOUT.observe(len(readers))
+            self._send_followed(chat_id, messages, readers)
+            if not readers:
                 return
-            with self.lock:
-                short_title = self.listener.chats[chat_id]['title']
-                if len(short_title) > SHORT_TITLE_LENGTH + 3:
-                    short_title = short_title[:SHORT_TITLE_LENGTH] + "..."
-                header = ("Обновление чата /{} ({}):\n".format(
-                    chat_id, short_title))
-                formatted_messages = list(
-                    ChatbotLogic.format_messages(messages))
-                if len(formatted_messages) > 1 or len(
-                        formatted_messages[0]) + len(header) >= MSG_LIMIT:
-                    formatted_messages_h = [header] + formatted_messages
+            header = ("Обновление чата /{} ({}):\n".format(
+                chat_id, self._short_title(chat_id)))
+            rendered = self.renderer.render(chat_id, messages)
+            if not rendered.chunks:
+                return
+            formatted_messages = rendered.chunks
+            formatted_messages_h = rendered.with_header(header)
+            deliveries = []
+            for reader_id in readers:
+                reader = self.readers[reader_id]
+                if reader.latest == chat_id:
+                    deliveries.append((reader_id, formatted_messages))
                 else:
-                    formatted_messages_h = [header + formatted_messages[0]]
-                for reader_id in self.chats_to_readers[chat_id]:
-                    try:
-                        if self.readers[reader_id].latest == chat_id:
-                            for msg in formatted_messages:
-                                self.bot.sendMessage(
-                                    reader_id,
-                                    text=msg,
-                                    parse_mode=telegram.ParseMode.MARKDOWN)
-                        else:
-                            self.readers[reader_id].latest = chat_id
-                            for msg in formatted_messages_h:
-                                self.bot.sendMessage(
-                                    reader_id,
-                                    text=msg,
-                                    parse_mode=telegram.ParseMode.MARKDOWN)
-                    except Unauthorized:
-                        print("{} has revoked access, unsub him"
-                              " from everything".format(reader_id))
-                        chats = list(self.readers[reader_id].chats)
-                        for sechat_id_to_unsub in chats:
-                            self._unsub(reader_id, chat_id_to_unsub)
-                    except:
-                        print("Trying to send to {}".format(reader_id))
-                        traceback.print_exc()
+                    reader.latest = chat_id
+                    deliveries.append((reader_id, formatted_messages_h))
+            created_at = messages[0].get('inserted_at')
+            for reader_id, reader_messages in deliveries:
+                for msg in reader_messages:
+                    if not self._send_markdown(reader_id, msg, created_at):
+                        break
         return process_chat_update
 
+    def _short_title(self, chat_id):
+        short_title = self.listener.chats[chat_id]['title']
+        if len(short_title) > SHORT_TITLE_LENGTH + 3:
+            short_title = short_title[:SHORT_TITLE_LENGTH] + "..."
+        return short_title
+
+    def _send_followed(self, chat_id, messages, subscribed):
+        """
+        Send messages of followed authors to their followers
+        not subscribed to the chat anyway.
+        """
+        followed = collections.defaultdict(list)
+        for message in messages:
+            user_id = message.get('user_id')
+            if user_id is None or not self.follows.subscriber_count(user_id):
+                continue
+            for reader_id in self.follows.readers(user_id):
+                if reader_id not in subscribed:
+                    followed[reader_id].append(message)
+        if not followed:
+            return
+        header = "Из чата /{} ({}):\n".format(
+            chat_id, self._short_title(chat_id))
+        for reader_id, reader_messages in followed.items():
+            # Subsets differ per reader and may share their first and
+            # last messages, they must not go through the render cache.
+            rendered = RenderedUpdate(
+                reader_messages, tuple(self._format(reader_messages)),
+                MSG_LIMIT)
+            created_at = reader_messages[0].get('inserted_at')
+            for msg in rendered.with_header(header):
+                if not self._send_markdown(reader_id, msg, created_at):
+                    break
+            # The next update of the reader's own chat needs a header.
+            self.readers[reader_id].latest = None
+
+    def _find_user(self, name, user_ids=None):
+        """
+        Id of the most recently seen user called name
+        (case insensitive), among user_ids if given.
+        Users forgotten by the directory match by id.
+        """
+        name = name.casefold()
+        users = self.listener.users
+        found = None
+        for user_id in (users if user_ids is None else list(user_ids)):
+            user_name = users.get(user_id, user_id)
+            if user_name.casefold() == name:
+                found = user_id
+        return found
+
+    def _hot(self):
+        """
+        Ids of the hottest active chats.
+        """
+        return [chat_id for chat_id, _ in self.listener.hot.top(HOT_COUNT)
+                if chat_id in self.listener.chats]
+
+    def _follow_hot(self):
+        """
+        Subscribe /autohot readers to chats that became hot.
+        """
+        if not self.hot_readers:
+            return
+        hot = set(self._hot())
+        for chat_id in hot - self._hot_chats:
+            for reader_id in list(self.hot_readers):
+                self._auto_subscribe(reader_id, chat_id)
+        self._hot_chats = hot
+
+    def _auto_subscribe(self, reader_id, chat_id):
+        """
+        Subscribe to a hot chat unless the reader
+        has already unsubscribed from it.
+        """
+        with self.subscriptions.lock(chat_id):
+            if (self.subscriptions.is_subscribed(reader_id, chat_id) or
+                    chat_id in self.readers[reader_id].unsub_time or
+                    chat_id not in self.listener.chats):
+                return
+            self._send_markdown(
+                reader_id, ChatbotLogic.AUTOHOT_SUB_TEXT.format(
+                    chat_id, self.escape_markdown(
+                        self.listener.chats[chat_id]['title'])))
+            self._sub(reader_id, chat_id, send_messages=False)
+
+    def _send_markdown(self, reader_id, text, created_at=None):
+        """
+        Send (or queue, if there is a delivery scheduler) a message.
+
+        Returns False if sending failed right away.
+        """
+        if self.delivery is not None:
+            self.delivery.send(
+                reader_id, text, telegram.ParseMode.MARKDOWN, created_at)
+            return True
+        try:
+            self.bot.sendMessage(
+                reader_id,
+                text=text,
+                parse_mode=telegram.ParseMode.MARKDOWN)
+        except Exception as exc:
+            SEND_ERRORS.inc(type=type(exc).__name__)
+            self._on_send_error(reader_id, exc)
+            return False
+        if created_at is not None:
+            DELIVERY_LATENCY.observe(time.time() - created_at)
+        return True
+
+    def _on_send_error(self, reader_id, exc):
+        if isinstance(exc, Unauthorized):
+            print("{} has revoked access, unsub him"
+                  " from everything".format(reader_id))
+            if self.delivery is not None:
+                self.delivery.discard(reader_id)
+            for chat_id_to_unsub in list(self.readers[reader_id].chats):
+                with self.subscriptions.lock(chat_id_to_unsub):
+                    self._unsub(reader_id, chat_id_to_unsub)
+        else:
+            print("Trying to send to {}".format(reader_id))
+            traceback.print_exception(type(exc), exc, exc.__traceback__)
+
     def _sub(self, reader_id, chat_id, send_messages=True):
         """
         Add reader subscription to chat
         """
         if send_messages:
-            messages = [
-                m
-                for m in self.listener.messages[chat_id]
-                if
-                m['inserted_at'] >
-                self.readers[reader_id].unsub_time[chat_id]]
-            if messages:
-                for msg in ChatbotLogic.format_messages(messages):
-                    self.bot.sendMessage(
-                        reader_id,
-                        text=msg,
-                        parse_mode=telegram.ParseMode.MARKDOWN)
+            history = self.listener.messages[chat_id]
+            self._send_catchup(
+                reader_id, chat_id,
+                history.position_after(
+                    self.readers[reader_id].unsub_time[chat_id]),
+                history.end)
             self.readers[reader_id].latest = chat_id
-        self.chats_to_readers[chat_id].append(
-            reader_id)
-        self.readers[reader_id].chats.append(
-            chat_id)
+        self.subscriptions.subscribe(reader_id, chat_id)
+        if self.store is not None:
+            self.store.save(reader_id, chat_id, True)
+
+    def _send_catchup(self, reader_id, chat_id, position, end):
+        """
+        Send a page of chat history between positions,
+        offer /more for the rest.
+        """
+        history = self.listener.messages[chat_id]
+        messages, position = history.read(
+            position, min(self.catchup_page_size, end - position))
+        if messages:
+            for msg in self.renderer.render(chat_id, messages).chunks:
+                self._send_markdown(reader_id, msg)
+        reader = self.readers[reader_id]
+        if position < end:
+            reader.more = (chat_id, position, end)
+            self._send_markdown(
+                reader_id, ChatbotLogic.MORE_TEXT.format(end - position))
+        else:
+            reader.more = None
 
     def _unsub(self, reader_id, chat_id):
         """
         Remove subscription to chat from reader
         """
-        self.chats_to_readers[chat_id].remove(reader_id)
-        self.readers[reader_id].chats.remove(chat_id)
-        self.readers[reader_id].unsub_time[chat_id] = (
-            self.listener.messages[chat_id][-1]['inserted_at'])
+        if not self.subscriptions.unsubscribe(reader_id, chat_id):
+            return
+        history = self.listener.messages[chat_id]
+        if history:
+            self.readers[reader_id].unsub_time[chat_id] = (
+                history[-1]['inserted_at'])
+        if self.store is not None:
+            self.store.save(reader_id, chat_id, False,
+                            self.readers[reader_id].unsub_time[chat_id])
 
     def _create_show_chats(self):
         def show_chats(bot, update):
-            with self.lock:
-                try:
-                    reader_id = update.message.chat_id
-                    print(self.readers[reader_id])
-                    print(self.readers)
-                    sorted_chats = sorted(
-                        list(self.listener.chats.items()),
-                        key=lambda c: -c[1]['last_message_at'])
-                    chat_text = "\n".join(
-                        "/{} [{}] {} ({})".format(
-                            k,
-                            '+' if k in self.readers[reader_id].chats
-                                else '-',
-                            v['title'],
-                            v['messages_count'])
-                        for k, v in sorted_chats)
-                    if not chat_text:
-                        chat_text = "Список пуст."
-                    bot.sendMessage(reader_id, text=chat_text)
-                except:
-                    traceback.print_exc()
+            try:
+                reader_id = update.message.chat_id
+                chat_text = self.chat_list.render(
+                    self.subscriptions.chats(reader_id))
+                if not chat_text:
+                    chat_text = "Список пуст."
+                bot.sendMessage(reader_id, text=chat_text)
+            except:
+                traceback.print_exc()
             self._track(update.message.chat.id, 'chats')
         return show_chats
 
@@ -259,6 +474,150 @@ class ChatbotLogic(Connector):
             self._track(update.message.chat.id, 'help')
         return show_help
 
+    def _create_show_more(self):
+        def show_more(bot, update):
+            """
+            Continue catch-up of the last subscribed chat.
+
+            /more command
+            """
+            reader_id = update.message.chat_id
+            chat_id = None
+            try:
+                more = self.readers[reader_id].more
+                if more is None:
+                    bot.sendMessage(
+                        reader_id, text=ChatbotLogic.NO_MORE_TEXT)
+                else:
+                    chat_id, position, end = more
+                    self.readers[reader_id].latest = chat_id
+                    self._send_catchup(reader_id, chat_id, position, end)
+            except:
+                traceback.print_exc()
+            self._track(reader_id, 'more', chat_id)
+        return show_more
+
+    def _create_show_hot(self):
+        def show_hot(bot, update):
+            """
+            List the most active chats.
+
+            /hot command
+            """
+            reader_id = update.message.chat_id
+            try:
+                subscribed = self.subscriptions.chats(reader_id)
+                lines = []
+                for chat_id in self._hot():
+                    chat_info = self.listener.chats[chat_id]
+                    lines.append("/{} [{}] {} ({})".format(
+                        chat_id, "+" if chat_id in subscribed else "-",
+                        chat_info['title'], chat_info['messages_count']))
+                bot.sendMessage(
+                    reader_id, text="\n".join(lines) or "Список пуст.")
+            except:
+                traceback.print_exc()
+            self._track(reader_id, 'hot')
+        return show_hot
+
+    def _create_toggle_autohot(self):
+        def toggle_autohot(bot, update):
+            """
+            Turn automatic subscription to hot chats on or off.
+
+            /autohot command
+            """
+            reader_id = update.message.chat_id
+            enabled = reader_id not in self.hot_readers
+            try:
+                if enabled:
+                    self.hot_readers.add(reader_id)
+                    bot.sendMessage(
+                        reader_id, text=ChatbotLogic.AUTOHOT_ON_TEXT)
+                    for chat_id in self._hot():
+                        self._auto_subscribe(reader_id, chat_id)
+                else:
+                    self.hot_readers.discard(reader_id)
+                    bot.sendMessage(
+                        reader_id, text=ChatbotLogic.AUTOHOT_OFF_TEXT)
+                if self.store is not None:
+                    self.store.save(reader_id, HOT_CHAT_ID, enabled)
+            except:
+                traceback.print_exc()
+            self._track(reader_id, 'autohot', enabled)
+        return toggle_autohot
+
+    def _create_follow(self):
+        def follow(bot, update):
+            """
+            Follow an author across all chats, list followed
+            authors without a name.
+
+            /follow Name command
+            """
+            reader_id = update.message.chat_id
+            user_id = None
+            try:
+                parts = update.message.text.split(None, 1)
+                if len(parts) < 2:
+                    users = self.listener.users
+                    names = [users.get(user_id, user_id) for user_id
+                             in sorted(self.follows.chats(reader_id))]
+                    text = ChatbotLogic.FOLLOW_USAGE_TEXT
+                    if names:
+                        text = "Вы следите за: {}\n{}".format(
+                            ", ".join(names), text)
+                    bot.sendMessage(reader_id, text=text)
+                    return
+                name = parts[1].strip()
+                user_id = self._find_user(name)
+                if user_id is None:
+                    bot.sendMessage(
+                        reader_id,
+                        text="Нет недавних сообщений от {}.".format(name))
+                    return
+                self.follows.subscribe(reader_id, user_id)
+                if self.store is not None:
+                    self.store.save(reader_id, FOLLOW_PREFIX + user_id, True)
+                bot.sendMessage(
+                    reader_id, text="Вы следите за {}. "
+                    "Отписаться: /unfollow {}".format(name, name))
+            except:
+                traceback.print_exc()
+            finally:
+                self._track(reader_id, 'follow', user_id)
+        return follow
+
+    def _create_unfollow(self):
+        def unfollow(bot, update):
+            """
+            Stop following an author.
+
+            /unfollow Name command
+            """
+            reader_id = update.message.chat_id
+            user_id = None
+            try:
+                parts = update.message.text.split(None, 1)
+                name = parts[1].strip() if len(parts) > 1 else ""
+                user_id = self._find_user(
+                    name, self.follows.chats(reader_id))
+                if user_id is None:
+                    bot.sendMessage(
+                        reader_id,
+                        text="Вы не следите за {}.".format(name))
+                    return
+                self.follows.unsubscribe(reader_id, user_id)
+                if self.store is not None:
+                    self.store.save(reader_id, FOLLOW_PREFIX + user_id, False)
+                bot.sendMessage(
+                    reader_id, text="Вы больше не следите за {}.".format(name))
+            except:
+                traceback.print_exc()
+            finally:
+                self._track(reader_id, 'unfollow', user_id)
+        return unfollow
+
     def _create_toggle_subscription(self):
         def toggle_subscription(bot, update):
             """
@@ -269,15 +628,16 @@ class ChatbotLogic(Connector):
             action = "?"
             chat_id = None
             reader_id = update.message.chat_id
-            with self.lock:
-                try:
-                    match = TOGGLE_SUB_RE.match(update.message.text)
-                    if match is None:
-                        print('message text: "{}"'.format(update.message.text))
-                        return
-                    chat_id = match.group(1)
+            try:
+                match = TOGGLE_SUB_RE.match(update.message.text)
+                if match is None:
+                    print('message text: "{}"'.format(update.message.text))
+                    return
+                chat_id = match.group(1)
+                with self.subscriptions.lock(chat_id):
                     if chat_id in self.listener.chats:
-                        if reader_id in self.chats_to_readers[chat_id]:
+                        if self.subscriptions.is_subscribed(
+                                reader_id, chat_id):
                             bot.sendMessage(
                                 reader_id,
                                 text="Вы отписались от /{}".format(chat_id))
@@ -296,7 +656,7 @@ class ChatbotLogic(Connector):
                         bot.sendMessage(
                             reader_id,
                             text="Чата /{} уже не существует.".format(chat_id))
-                except:
-                    traceback.print_exc()
+            except:
+                traceback.print_exc()
             self._track(reader_id, action, chat_id)
         return toggle_subscription
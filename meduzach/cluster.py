@@ -0,0 +1,345 @@
+# coding utf-8
+"""
+Multiprocess deployment: one ingestion process and N bot workers.
+
+The ingestion process keeps the only websocket session to Meduza
+and the only getUpdates poll. Chat list changes and chat updates
+are pickled once and written to every worker's pipe; Telegram
+updates go to the one worker owning the reader, chosen by
+`partition(reader_id)`. Every worker runs its own ChatbotLogic,
+delivery scheduler and Bot API connection against a mirror
+of the listener state.
+
+python -m meduzach.cluster --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import pickle
+import threading
+import time
+import traceback
+import zlib
+
+import telegram
+from telegram.ext import Updater, MessageHandler, Filters
+
+from meduzach import metrics
+from meduzach.chat_index import ChatIndex
+from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.connections import Connector, QUEUED
+from meduzach.delivery import DeliveryScheduler, GLOBAL_RATE, GLOBAL_BURST
+from meduzach.history import MessageStore
+from meduzach.hot import HotRanking
+from meduzach.storage import SubscriptionStore
+from meduzach.users import UserDirectory
+from meduzach.webhook import start_webhook, wait_for_signal, WEBHOOK_PORT
+
+WORKERS = 4
+# Events waiting to be written to a worker's pipe
+PIPE_QUEUE_SIZE = 10000
+
+EV_CHATS = 'chats'
+EV_MESSAGES = 'messages'
+EV_INITIALIZED = 'initialized'
+EV_UPDATE = 'update'
+
+
+def partition(reader_id, workers):
+    """
+    Index of the worker serving reader_id, stable across processes.
+    """
+    return zlib.crc32(str(reader_id).encode()) % workers
+
+
+def _dumps(event):
+    return pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+
+
+class Publisher(Connector):
+    """
+    Ingestion side: turns listener signals into events
+    for worker pipes.
+
+    Each pipe is written by its own queued slot, so a slow
+    worker never blocks the listener or the other workers.
+    """
+    def __init__(self, listener, pipes, maxsize=PIPE_QUEUE_SIZE):
+        super().__init__()
+        self.listener = listener
+        self._slots = []
+        for pipe in pipes:
+            conn_id = self.connect(
+                'event', self._create_write(pipe),
+                mode=QUEUED, maxsize=maxsize)
+            self._slots.append(self.slot(conn_id))
+        listener.connect('chatlist_updated', self._chatlist_updated)
+        listener.connect('chat_updated', self._chat_updated)
+
+    @staticmethod
+    def _create_write(pipe):
+        def write(sender, data):
+            pipe.send_bytes(data)
+        return write
+
+    def _chatlist_updated(self, sender, payload):
+        added, removed, changed = payload
+        chats = {chat_id: self.listener.chats[chat_id]
+                 for chat_id in added | changed}
+        self.emit('event', _dumps((EV_CHATS, chats, list(removed))))
+
+    def _chat_updated(self, sender, payload):
+        chat_id, messages = payload
+        names = {}
+        for message in messages:
+            reply_to = message.get('reply_to')
+            if reply_to and reply_to in self.listener.users:
+                names[reply_to] = {'name': self.listener.users[reply_to]}
+        self.emit('event', _dumps((EV_MESSAGES, chat_id, messages, names)))
+
+    def initialized(self):
+        self.emit('event', _dumps((EV_INITIALIZED,)))
+
+    def forward(self, update):
+        """
+        Pass a Telegram update to the worker owning its reader.
+        """
+        slot = self._slots[partition(update.message.chat_id,
+                                     len(self._slots))]
+        slot(self, _dumps((EV_UPDATE, update.to_json())))
+
+
+class ListenerMirror(Connector):
+    """
+    Worker side copy of the listener state ChatbotLogic reads.
+
+    Emits chat_updated and chatlist_updated like Meduzach does.
+    """
+    def __init__(self):
+        super().__init__()
+        self.chats = {}
+        self.chat_index = ChatIndex()
+        self.messages = MessageStore()
+        self.hot = HotRanking()
+        self.users = UserDirectory()
+        self.is_initialized = False
+
+    def apply_chats(self, chats, removed):
+        added = {chat_id for chat_id in chats if chat_id not in self.chats}
+        for chat_id, chat_info in chats.items():
+            self.chats[chat_id] = chat_info
+            self.chat_index.update(chat_id, chat_info)
+        for chat_id in removed:
+            self.chats.pop(chat_id, None)
+            self.chat_index.remove(chat_id)
+            self.messages.evict(chat_id)
+            self.hot.remove(chat_id)
+        self.emit('chatlist_updated',
+                  (added, set(removed), set(chats) - added))
+
+    def apply_messages(self, chat_id, messages, names):
+        for user_id in names:
+            self.users.see(user_id, names)
+        # Authors are looked up by name to be followed.
+        for message in messages:
+            user_id = message.get('user_id')
+            if user_id is not None:
+                self.users.see(
+                    user_id, {user_id: {'name': message['author']}})
+        self.users.expire()
+        self.messages.extend(chat_id, messages)
+        self.hot.observe(chat_id, messages)
+        self.emit('chat_updated', (chat_id, messages))
+
+
+class PartitionedStore():
+    """
+    SubscriptionStore view loading only one worker's readers.
+    """
+    def __init__(self, store, index, workers):
+        self.store = store
+        self.index = index
+        self.workers = workers
+
+    def load(self):
+        return [row for row in self.store.load()
+                if partition(row[0], self.workers) == self.index]
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+class Worker():
+    """
+    ChatbotLogic fed by events from the ingestion process.
+    """
+    def __init__(self, bot, index=0, workers=1, store=None,
+                 coalesce_window=None):
+        self.index = index
+        self.workers = workers
+        self.bot = bot
+        self.listener = ListenerMirror()
+        if store is not None:
+            store = PartitionedStore(store, index, workers)
+        self.logic = ChatbotLogic(self.listener, bot, store, coalesce_window)
+        show_help = self.logic._create_show_help()
+        self.commands = {
+            'help': show_help,
+            'start': show_help,
+            'chats': self.logic._create_show_chats(),
+            'more': self.logic._create_show_more(),
+            'hot': self.logic._create_show_hot(),
+            'autohot': self.logic._create_toggle_autohot(),
+            'follow': self.logic._create_follow(),
+            'unfollow': self.logic._create_unfollow(),
+        }
+        self.toggle_subscription = self.logic._create_toggle_subscription()
+
+    def handle(self, event):
+        kind = event[0]
+        if kind == EV_MESSAGES:
+            self.listener.apply_messages(*event[1:])
+        elif kind == EV_CHATS:
+            self.listener.apply_chats(*event[1:])
+        elif kind == EV_UPDATE:
+            self.handle_update(telegram.Update.de_json(json.loads(event[1])))
+        elif kind == EV_INITIALIZED:
+            self.listener.is_initialized = True
+            self.logic.restore_tracked()
+
+    def handle_update(self, update):
+        """
+        Dispatch a command like the single process bot handlers do.
+        """
+        if update.message is None or not update.message.text:
+            return
+        command = update.message.text.split()[0][1:].split('@')[0]
+        handler = self.commands.get(command, self.toggle_subscription)
+        handler(self.bot, update)
+
+    def serve(self, pipe):
+        while True:
+            try:
+                event = pickle.loads(pipe.recv_bytes())
+            except EOFError:
+                return
+            try:
+                self.handle(event)
+            except:
+                traceback.print_exc()
+
+
+def _serve_metrics(port):
+    try:
+        metrics.MetricsServer(port=port).start()
+    except OSError as exc:
+        print("Metrics are not served: {}".format(exc))
+
+
+def run_worker(index, workers, pipe, token, base_url=None,
+               store_path=None, metrics_port=None, coalesce_window=None):
+    """
+    Worker process entry point.
+    """
+    bot = telegram.Bot(token, base_url=base_url)
+    store = SubscriptionStore(store_path) if store_path else None
+    worker = Worker(bot, index, workers, store, coalesce_window)
+    if metrics_port is not None:
+        metrics.watch_listener(worker.listener)
+        _serve_metrics(metrics_port)
+    # The Bot API limit is per token, share it between workers.
+    delivery = DeliveryScheduler(
+        bot, global_rate=GLOBAL_RATE / workers,
+        global_burst=max(1, GLOBAL_BURST // workers),
+        on_error=worker.logic._on_send_error)
+    worker.logic.delivery = delivery
+    delivery.start()
+    try:
+        worker.serve(pipe)
+    finally:
+        worker.logic.stop(5)
+        delivery.join(5)
+        delivery.stop()
+        if store is not None:
+            store.close()
+
+
+def main(workers=WORKERS, token=None, meduza_addr=None, base_url=None,
+         store_path="meduzach.sqlite3", idle=True,
+         metrics_port=metrics.METRICS_PORT, webhook_url=None,
+         webhook_port=WEBHOOK_PORT, coalesce_window=None):
+    """
+    Start the ingestion process and `workers` bot worker processes.
+
+    The ingestion process serves metrics on metrics_port,
+    worker i on metrics_port + 1 + i. Updates come through
+    webhook_url if it is given and works, they are polled otherwise.
+    Workers merge bursts of chat updates if coalesce_window is set.
+
+    Returns (updater, processes, webhook) if idle is False,
+    webhook is None if updates are polled.
+    """
+    from meduzach.async_meduzach import AsyncMeduzach
+
+    if token is None:
+        from meduzach import credentials
+        token = credentials.BOT_TOKEN
+        webhook_url = getattr(credentials, 'WEBHOOK_URL', None)
+        coalesce_window = getattr(
+            credentials, 'COALESCE_WINDOW', coalesce_window)
+
+    context = multiprocessing.get_context('spawn')
+    pipes = []
+    processes = []
+    for index in range(workers):
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(
+            target=run_worker, name="meduzach-worker-{}".format(index),
+            args=(index, workers, reader, token, base_url, store_path,
+                  None if metrics_port is None else metrics_port + 1 + index,
+                  coalesce_window),
+            daemon=True)
+        process.start()
+        reader.close()
+        pipes.append(writer)
+        processes.append(process)
+
+    listener = AsyncMeduzach()
+    if meduza_addr is not None:
+        listener.addr = meduza_addr
+    publisher = Publisher(listener, pipes)
+    if metrics_port is not None:
+        metrics.watch_listener(listener)
+        _serve_metrics(metrics_port)
+
+    listener_thread = threading.Thread(
+        target=listener.run, daemon=True)
+    listener_thread.start()
+    while not listener.is_initialized:
+        time.sleep(0.5)
+    publisher.initialized()
+
+    updater = Updater(token, base_url=base_url)
+    updater.dispatcher.add_handler(MessageHandler(
+        [Filters.command], lambda bot, update: publisher.forward(update)))
+    webhook = None
+    if webhook_url is not None:
+        webhook = start_webhook(updater, webhook_url, port=webhook_port)
+    if webhook is None:
+        updater.start_polling()
+    if not idle:
+        return updater, processes, webhook
+    try:
+        wait_for_signal()
+    finally:
+        if webhook is not None:
+            webhook.stop()
+        updater.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+    main(args.workers)
@@ -0,0 +1,112 @@
+# coding utf-8
+
+import datetime
+import threading
+import time
+
+from meduzach.connections import Connector
+
+# Flush a chat once it has been quiet that long...
+COALESCE_WINDOW = datetime.timedelta(seconds=3)
+# ...or that long after the first buffered message in a busy chat.
+COALESCE_MAX_DELAY = datetime.timedelta(seconds=15)
+
+
+class Coalescer(Connector):
+    """
+    Merges bursts of chat_updated emitted by `source`.
+
+    Messages of a chat are buffered until the chat has been quiet
+    for `window`, but no longer than `max_delay`, and re-emitted
+    as one chat_updated. Every subscriber of a chat receives the
+    same updates, so buffering per chat is the same as per
+    (reader, chat) while a burst is rendered only once.
+    """
+    def __init__(self, source, window=COALESCE_WINDOW,
+                 max_delay=COALESCE_MAX_DELAY, now=time.monotonic):
+        super().__init__()
+        self.window = window.total_seconds()
+        self.max_delay = max_delay.total_seconds()
+        self.merged = 0
+        self._now = now
+        # chat_id -> [first_at, last_at, messages]
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = None
+        source.connect('chat_updated', self._chat_updated)
+
+    def start(self):
+        """
+        Flush due chats on a daemon thread.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name="coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def _chat_updated(self, sender, payload):
+        chat_id, messages = payload
+        now = self._now()
+        with self._cond:
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                self._pending[chat_id] = [now, now, list(messages)]
+            else:
+                pending[1] = now
+                pending[2].extend(messages)
+                self.merged += 1
+            self._cond.notify()
+
+    def _due(self, pending):
+        first_at, last_at, _ = pending
+        return min(last_at + self.window, first_at + self.max_delay)
+
+    def flush(self, force=False):
+        """
+        Emit buffered chats that are due, all of them if force.
+
+        Returns seconds until the next chat is due,
+        None if nothing is buffered.
+        """
+        now = self._now()
+        ready = []
+        next_due = None
+        with self._cond:
+            for chat_id, pending in list(self._pending.items()):
+                due = self._due(pending)
+                if force or due <= now:
+                    ready.append((chat_id, pending[2]))
+                    del self._pending[chat_id]
+                elif next_due is None or due < next_due:
+                    next_due = due
+        for payload in ready:
+            self.emit('chat_updated', payload)
+        return None if next_due is None else next_due - now
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+            delay = self.flush()
+            if delay is not None:
+                with self._cond:
+                    if not self._stopped:
+                        self._cond.wait(delay)
+        self.flush(force=True)
+
+    def stop(self):
+        """
+        Emit everything buffered and stop the flush thread.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is None:
+            self.flush(force=True)
+        else:
+            self._thread.join()
+            self._thread = None
@@ -1,27 +1,224 @@
+# coding utf-8
+import asyncio
+import collections
+import threading
+import time
+import traceback
+
+from meduzach.metrics import (
+    HANDLER_TIME, SLOT_BLOCKED, SLOT_DROPPED, SLOT_QUEUE)
+
+# Delivery modes
+DIRECT = 'direct'
+QUEUED = 'queued'
+ASYNC = 'async'
+
+# Overflow policies of queued modes
+BLOCK = 'block'
+DROP_NEW = 'drop_new'
+DROP_OLDEST = 'drop_oldest'
+
+DEFAULT_MAXSIZE = 1000
+
+
+class _BoundedSlot():
+    """
+    Slot that puts emissions into a bounded queue
+    instead of calling the action right away.
+    """
+    mode = None
+
+    def __init__(self, action, maxsize, overflow, signal_id=None):
+        if overflow not in (BLOCK, DROP_NEW, DROP_OLDEST):
+            raise ValueError("Unknown overflow policy {}".format(overflow))
+        self.action = action
+        self.signal_id = str(signal_id)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+
+    def __call__(self, sender, payload):
+        blocked_at = None
+        with self._cond:
+            while (not self.closed and self.maxsize and
+                    len(self._queue) >= self.maxsize):
+                if self.overflow == DROP_NEW:
+                    self.dropped += 1
+                    SLOT_DROPPED.inc(signal=self.signal_id)
+                    return
+                if self.overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self.dropped += 1
+                    SLOT_DROPPED.inc(signal=self.signal_id)
+                    break
+                if blocked_at is None:
+                    blocked_at = time.perf_counter()
+                self._cond.wait()
+            if blocked_at is not None:
+                # The emitter stalled behind the handler, make it visible.
+                SLOT_BLOCKED.inc(time.perf_counter() - blocked_at,
+                                 signal=self.signal_id)
+            if self.closed:
+                return
+            self._queue.append((sender, payload))
+            SLOT_QUEUE.set(len(self._queue), signal=self.signal_id)
+            self._cond.notify_all()
+        self._wake()
+
+    def _wake(self):
+        pass
+
+    def _invoke(self, sender, payload):
+        start = time.perf_counter()
+        try:
+            self.action(sender, payload)
+        except Exception:
+            traceback.print_exc()
+        HANDLER_TIME.observe(time.perf_counter() - start,
+                             signal=self.signal_id, mode=self.mode)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class _QueuedSlot(_BoundedSlot):
+    """
+    Runs the action on a dedicated thread.
+    """
+    mode = QUEUED
+
+    def __init__(self, action, maxsize, overflow, signal_id=None):
+        super().__init__(action, maxsize, overflow, signal_id)
+        # Taken off the queue, handler not finished yet
+        self._in_flight = 0
+        self._thread = threading.Thread(
+            target=self._work, name="slot-{}".format(
+                getattr(action, '__name__', 'action')),
+            daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self.closed:
+                    self._cond.wait()
+                if self.closed:
+                    return
+                sender, payload = self._queue.popleft()
+                SLOT_QUEUE.set(len(self._queue), signal=self.signal_id)
+                self._in_flight += 1
+                self._cond.notify_all()
+            try:
+                self._invoke(sender, payload)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """
+        Wait until the queue is empty and the last
+        emission has been handled.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._in_flight, timeout)
+
+
+class _AsyncSlot(_BoundedSlot):
+    """
+    Runs the action on an asyncio event loop.
+
+    Coroutine functions are scheduled as tasks. Do not use
+    the BLOCK policy when emitting from the loop's own thread.
+    """
+    mode = ASYNC
+
+    def __init__(self, action, maxsize, overflow, loop, signal_id=None):
+        super().__init__(action, maxsize, overflow, signal_id)
+        self.loop = loop
+        self._scheduled = False
+
+    def _wake(self):
+        with self._cond:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.loop.call_soon_threadsafe(self._drain)
+
+    def _drain(self):
+        with self._cond:
+            items = list(self._queue)
+            self._queue.clear()
+            SLOT_QUEUE.set(0, signal=self.signal_id)
+            self._scheduled = False
+            self._cond.notify_all()
+        for sender, payload in items:
+            if asyncio.iscoroutinefunction(self.action):
+                asyncio.ensure_future(self.action(sender, payload))
+            else:
+                self._invoke(sender, payload)
+
+
 class Connector():
     """
     Simple signal-slot connector
+
+    Slots are called on the emitting thread by default.
+    QUEUED slots run on their own thread and ASYNC slots
+    on a given event loop, both behind a bounded queue.
     """
     def __init__(self):
         self.connections = {}
+        self._connection_signals = {}
         self._nextid = 0
 
     def emit(self, signal_id, payload):
         if signal_id in self.connections:
-            for action in self.connections[signal_id].values():
+            for action in list(self.connections[signal_id].values()):
+                if isinstance(action, _BoundedSlot):
+                    action(self, payload)
+                    continue
+                start = time.perf_counter()
                 action(self, payload)
+                HANDLER_TIME.observe(time.perf_counter() - start,
+                                     signal=str(signal_id), mode=DIRECT)
 
-    def connect(self, signal_id, action):
+    def connect(self, signal_id, action, mode=DIRECT, loop=None,
+                maxsize=DEFAULT_MAXSIZE, overflow=BLOCK):
+        if mode == QUEUED:
+            action = _QueuedSlot(action, maxsize, overflow, signal_id)
+        elif mode == ASYNC:
+            if loop is None:
+                raise ValueError("ASYNC connections need a loop")
+            action = _AsyncSlot(action, maxsize, overflow, loop, signal_id)
+        elif mode != DIRECT:
+            raise ValueError("Unknown delivery mode {}".format(mode))
         if signal_id not in self.connections:
             self.connections[signal_id] = {}
         connection_id = self._nextid
         self._nextid += 1
         self.connections[signal_id][connection_id] = action
+        self._connection_signals[connection_id] = signal_id
         return connection_id
 
     def disconnect(self, connection_id):
-        for action_dict in self.connections.values():
-            if connection_id in action_dict:
-                del action_dict[connection_id]
-                return True
-        return False
+        signal_id = self._connection_signals.pop(connection_id, None)
+        if signal_id is None:
+            return False
+        action = self.connections[signal_id].pop(connection_id)
+        if isinstance(action, _BoundedSlot):
+            action.close()
+        return True
+
+    def slot(self, connection_id):
+        """
+        Return what is called on emit for a connection.
+        """
+        signal_id = self._connection_signals[connection_id]
+        return self.connections[signal_id][connection_id]
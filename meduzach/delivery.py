@@ -0,0 +1,288 @@
+# coding utf-8
+
+import collections
+import heapq
+import itertools
+import re
+import threading
+import time
+import traceback
+
+from meduzach.metrics import DELIVERY_LATENCY, SEND_ERRORS
+
+# Telegram allows about 30 messages per second overall
+# and about one message per second to the same chat.
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+WORKERS = 4
+# Idle per-chat buckets are pruned once there are that many
+MIN_BUCKETS_TO_PRUNE = 1024
+
+RETRY_AFTER_RE = re.compile(r'retry after (\d+)', re.IGNORECASE)
+
+
+def retry_after(exc):
+    """
+    Return the delay requested by a 429 error, or None.
+    """
+    match = RETRY_AFTER_RE.search(str(exc))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+class TokenBucket():
+    """
+    Token bucket refilled at `rate` tokens per second up to `capacity`.
+
+    Not thread-safe, callers hold their own lock.
+    """
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.last:
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+
+    def delay(self, now):
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now):
+        """
+        True if the bucket is as good as a new one.
+        """
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def penalize(self, seconds, now):
+        """
+        Give out no tokens for the next `seconds`.
+        """
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class DeliveryScheduler():
+    """
+    Outbound message queue with a pool of sender threads.
+
+    Every reader has its own FIFO queue. Readers are served
+    in the order their per-chat token bucket allows them to,
+    which is round-robin among readers that are ready,
+    and all sends share a global token bucket.
+    Messages to the same reader are never sent concurrently,
+    so their order is kept.
+    """
+    def __init__(self, bot, workers=WORKERS,
+                 global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 per_chat_rate=PER_CHAT_RATE, per_chat_burst=PER_CHAT_BURST,
+                 on_error=None):
+        self.bot = bot
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.on_error = on_error
+
+        self._cond = threading.Condition()
+        self._global = TokenBucket(global_rate, global_burst)
+        self._buckets = {}
+        self._prune_at = MIN_BUCKETS_TO_PRUNE
+        self._queues = collections.defaultdict(collections.deque)
+        # (ready_at, seq, reader_id) for readers with queued messages
+        # that are not being sent to right now.
+        self._ready = []
+        self._scheduled = set()
+        self._seq = itertools.count()
+        self._threads = []
+        self._stopped = False
+        self._sending = set()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name="delivery-{}".format(i),
+                daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def send(self, reader_id, text, parse_mode=None, created_at=None):
+        """
+        Queue a message. Never blocks on the network.
+
+        created_at is the unix time the content appeared,
+        to measure delivery latency.
+        """
+        with self._cond:
+            self._queues[reader_id].append((text, parse_mode, created_at))
+            self._schedule(reader_id, time.monotonic())
+            self._cond.notify()
+
+    def discard(self, reader_id):
+        """
+        Drop everything still queued for reader.
+        """
+        with self._cond:
+            self._queues.pop(reader_id, None)
+            if reader_id not in self._sending:
+                self._buckets.pop(reader_id, None)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def join(self, timeout=None):
+        """
+        Wait until every queued message has been handled.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._sending or any(self._queues.values()):
+                remaining = (None if deadline is None
+                             else deadline - time.monotonic())
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _bucket(self, reader_id, now):
+        bucket = self._buckets.get(reader_id)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune_buckets(now)
+            bucket = self._buckets[reader_id] = TokenBucket(
+                self.per_chat_rate, self.per_chat_burst, now)
+        return bucket
+
+    def _prune_buckets(self, now):
+        """
+        Forget buckets of idle readers that have refilled,
+        a new bucket would be the same.
+        """
+        for reader_id, bucket in list(self._buckets.items()):
+            if reader_id in self._queues or reader_id in self._sending:
+                continue
+            if bucket.full(now):
+                del self._buckets[reader_id]
+        self._prune_at = max(MIN_BUCKETS_TO_PRUNE, 2 * len(self._buckets))
+
+    def _forget(self, reader_id, now):
+        """
+        Drop the state of a reader with nothing left to send.
+
+        The bucket goes too once it has refilled, dropping it
+        earlier would let the reader burst past the chat limit.
+        """
+        self._queues.pop(reader_id, None)
+        bucket = self._buckets.get(reader_id)
+        if bucket is not None and bucket.full(now):
+            del self._buckets[reader_id]
+
+    def _schedule(self, reader_id, now):
+        if (reader_id in self._scheduled or reader_id in self._sending or
+                not self._queues.get(reader_id)):
+            return
+        ready_at = now + self._bucket(reader_id, now).delay(now)
+        heapq.heappush(self._ready, (ready_at, next(self._seq), reader_id))
+        self._scheduled.add(reader_id)
+
+    def _next(self):
+        """
+        Wait for the next (reader_id, message) allowed to be sent.
+        """
+        while not self._stopped:
+            now = time.monotonic()
+            if not self._ready:
+                self._cond.wait()
+                continue
+            ready_at, _, reader_id = self._ready[0]
+            if ready_at > now:
+                self._cond.wait(ready_at - now)
+                continue
+            global_delay = self._global.delay(now)
+            if global_delay:
+                self._cond.wait(global_delay)
+                continue
+            heapq.heappop(self._ready)
+            self._scheduled.discard(reader_id)
+            queue = self._queues.get(reader_id)
+            if not queue:
+                self._forget(reader_id, now)
+                continue
+            self._global.consume(now)
+            self._bucket(reader_id, now).consume(now)
+            message = queue.popleft()
+            self._sending.add(reader_id)
+            return reader_id, message
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                item = self._next()
+            if item is None:
+                return
+            reader_id, message = item
+            text, parse_mode, created_at = message
+            error = None
+            try:
+                if parse_mode is None:
+                    self.bot.sendMessage(reader_id, text=text)
+                else:
+                    self.bot.sendMessage(
+                        reader_id, text=text, parse_mode=parse_mode)
+            except Exception as exc:
+                error = exc
+                SEND_ERRORS.inc(type=type(exc).__name__)
+            else:
+                if created_at is not None:
+                    DELIVERY_LATENCY.observe(time.time() - created_at)
+            with self._cond:
+                self._sending.discard(reader_id)
+                now = time.monotonic()
+                delay = None if error is None else retry_after(error)
+                if delay is not None:
+                    self._queues[reader_id].appendleft(message)
+                    self._bucket(reader_id, now).penalize(delay, now)
+                    error = None
+                if not self._queues.get(reader_id):
+                    self._forget(reader_id, now)
+                self._schedule(reader_id, now)
+                self._cond.notify_all()
+            if error is not None:
+                self._handle_error(reader_id, error)
+
+    def _handle_error(self, reader_id, error):
+        if self.on_error is None:
+            print("Trying to send to {}".format(reader_id))
+            traceback.print_exception(
+                type(error), error, error.__traceback__)
+            return
+        try:
+            self.on_error(reader_id, error)
+        except Exception:
+            traceback.print_exc()
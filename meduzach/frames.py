@@ -0,0 +1,125 @@
+# coding utf-8
+"""
+Decoding of Phoenix frames received from Meduza.
+
+Frames are dispatched on topic and event before the body is parsed.
+Frames we never act upon are not parsed at all, and large frames
+are reduced to the fields Meduzach uses.
+"""
+
+import json
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    loads = json.loads
+    JSON_BACKEND = 'json'
+
+# Lobby chat fields we show or act upon.
+CHAT_FIELDS = ('messages_count', 'last_message_at', 'title', 'key')
+MESSAGE_FIELDS = ('user_id', 'message', 'chat_id', 'inserted_at',
+                  'reply_to_user_id')
+
+CHAT_EVENTS = frozenset(('current_chats', 'new_msg', 'phx_reply',
+                         'phx_close', 'phx_error'))
+
+_TOPIC_MARK = '"topic":"'
+_EVENT_MARK = '"event":"'
+
+
+def _string_after(raw, mark, start):
+    if start < 0:
+        return None
+    start += len(mark)
+    end = raw.find('"', start)
+    if end < 0:
+        return None
+    return raw[start:end]
+
+
+def peek(raw):
+    """
+    Return (topic, event) of a raw frame without parsing it.
+
+    Either may be None if it could not be found cheaply.
+    """
+    topic = _string_after(raw, _TOPIC_MARK, raw.find(_TOPIC_MARK))
+    event = _string_after(raw, _EVENT_MARK, raw.rfind(_EVENT_MARK))
+    return topic, event
+
+
+def is_wanted(topic, event):
+    """
+    Whether Meduzach.route_response does anything with such a frame.
+    """
+    if topic is None or event is None:
+        return True
+    if topic == 'phoenix':
+        return True
+    if topic == 'topic:lobby':
+        return event == 'current_chats'
+    return event in CHAT_EVENTS
+
+
+def _project_lobby(payload):
+    chats = payload.get('chats', {})
+    chats_ids = payload.get('chats_ids', [])
+    return {
+        'chats_ids': chats_ids,
+        'chats': {
+            chat_id: {
+                field: chats[chat_id].get(field) for field in CHAT_FIELDS}
+            for chat_id in chats_ids
+        }
+    }
+
+
+def _project_chat(chat_info):
+    projected = {'messages_ids': chat_info['messages_ids']}
+    if 'chat_id' in chat_info:
+        projected['chat_id'] = chat_info['chat_id']
+    if 'messages' in chat_info:
+        projected['messages'] = {
+            msg_id: {
+                field: message[field]
+                for field in MESSAGE_FIELDS if field in message}
+            for msg_id, message in chat_info['messages'].items()
+        }
+    if 'users' in chat_info:
+        projected['users'] = {
+            user_id: {'name': user_info.get('name')}
+            for user_id, user_info in chat_info['users'].items()
+        }
+    return projected
+
+
+def project(frame):
+    """
+    Reduce a parsed frame to the fields Meduzach uses.
+    """
+    payload = frame.get('payload')
+    if not isinstance(payload, dict):
+        return frame
+    if frame.get('topic') == 'topic:lobby':
+        if 'chats_ids' in payload:
+            frame['payload'] = _project_lobby(payload)
+    elif 'messages_ids' in payload:
+        frame['payload'] = _project_chat(payload)
+    elif 'messages_ids' in (payload.get('response') or {}):
+        payload['response'] = _project_chat(payload['response'])
+    return frame
+
+
+def decode(raw):
+    """
+    Parse a raw frame. Returns None for frames nobody is interested in.
+    """
+    topic, event = peek(raw)
+    if not is_wanted(topic, event):
+        return None
+    return project(loads(raw))
@@ -0,0 +1,212 @@
+# coding utf-8
+
+import bisect
+import datetime
+import itertools
+import sys
+
+MAX_MESSAGES_PER_CHAT = 500
+MAX_MESSAGE_AGE = datetime.timedelta(hours=8)
+
+
+def message_size(message):
+    """
+    Approximate memory taken by a message dict, in bytes.
+    """
+    return sys.getsizeof(message) + sum(
+        sys.getsizeof(value) for value in message.values()
+        if isinstance(value, str))
+
+
+class ChatHistory():
+    """
+    Bounded message history of a single chat in arrival order,
+    which is by inserted_at unless messages come in late.
+
+    Keeps at most `max_count` messages, none of them older
+    than `max_age` relative to the newest one.
+    Supports iteration, len() and indexing like a list.
+
+    Every message has a position that stays valid while older
+    messages are trimmed, so readers can page through it.
+    """
+    def __init__(self, max_count=MAX_MESSAGES_PER_CHAT,
+                 max_age=MAX_MESSAGE_AGE):
+        self.max_count = max_count
+        self.max_age = max_age.total_seconds()
+        self.nbytes = 0
+        # Trimmed messages stay in the lists up to _start,
+        # position of _messages[i] is _base + i.
+        self._messages = []
+        self._times = []
+        self._start = 0
+        self._base = 0
+        self._ids = set()
+        # Older messages were dropped or never loaded.
+        self.truncated = False
+
+    def __iter__(self):
+        return itertools.islice(self._messages, self._start, None)
+
+    def __len__(self):
+        return len(self._messages) - self._start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+        return self._messages[self._start + index]
+
+    def extend(self, messages):
+        for message in messages:
+            inserted_at = message['inserted_at']
+            if self._times and inserted_at < self._times[-1]:
+                # Inserting would shift positions readers hold,
+                # a late message goes last with the newest time.
+                inserted_at = self._times[-1]
+            self._messages.append(message)
+            self._times.append(inserted_at)
+            self.nbytes += message_size(message)
+            self._ids.add(message.get('id'))
+        self._trim()
+
+    def _trim(self):
+        while len(self) > self.max_count:
+            self._pop_oldest()
+        if len(self):
+            oldest_allowed = self._times[-1] - self.max_age
+            while self._times[self._start] < oldest_allowed:
+                self._pop_oldest()
+        if self._start > len(self._messages) // 2:
+            del self._messages[:self._start]
+            del self._times[:self._start]
+            self._base += self._start
+            self._start = 0
+
+    def _pop_oldest(self):
+        message = self._messages[self._start]
+        self.nbytes -= message_size(message)
+        self._ids.discard(message.get('id'))
+        self._messages[self._start] = None
+        self._start += 1
+        self.truncated = True
+
+    def fresh(self, messages):
+        """
+        Return messages not seen before: neither kept
+        nor older than what was already trimmed.
+        """
+        oldest = self._times[self._start] if len(self) else None
+        return [
+            message for message in messages
+            if not (message.get('id') is not None and
+                    message['id'] in self._ids) and
+            not (self.truncated and oldest is not None and
+                 message['inserted_at'] < oldest)]
+
+    def position_after(self, inserted_at):
+        """
+        Position of the first message newer than inserted_at.
+        """
+        return self._base + bisect.bisect_right(
+            self._times, inserted_at, self._start)
+
+    def read(self, position, limit=None):
+        """
+        Return (messages, next position) for up to `limit` messages
+        starting at position. Trimmed positions are skipped.
+        """
+        start = max(position - self._base, self._start)
+        end = len(self._messages)
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._messages[start:end], self._base + end
+
+    @property
+    def end(self):
+        """
+        Position right after the newest message.
+        """
+        return self._base + len(self._messages)
+
+
+class MessageStore():
+    """
+    Chat id to ChatHistory mapping.
+
+    Looking up an unknown chat returns an empty history
+    without storing it.
+    """
+    def __init__(self, max_count=MAX_MESSAGES_PER_CHAT,
+                 max_age=MAX_MESSAGE_AGE):
+        self.max_count = max_count
+        self.max_age = max_age
+        self._chats = {}
+
+    def __getitem__(self, chat_id):
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = ChatHistory(self.max_count, self.max_age)
+        return history
+
+    def __contains__(self, chat_id):
+        return chat_id in self._chats
+
+    def __len__(self):
+        return len(self._chats)
+
+    def __iter__(self):
+        return iter(self._chats)
+
+    def items(self):
+        return self._chats.items()
+
+    def extend(self, chat_id, messages):
+        if chat_id not in self._chats:
+            self._chats[chat_id] = ChatHistory(self.max_count, self.max_age)
+        self._chats[chat_id].extend(messages)
+
+    def restore(self, chat_id, messages):
+        """
+        Load a saved tail of chat_id history. Older messages
+        resent by the server are not taken for new ones.
+        """
+        self.extend(chat_id, messages)
+        self._chats[chat_id].truncated = True
+
+    def tail(self, chat_id, count):
+        """
+        Up to `count` newest messages of chat_id.
+        """
+        history = self[chat_id]
+        return history.read(history.end - count)[0]
+
+    def fresh(self, chat_id, messages):
+        """
+        Drop messages of chat_id that were already stored,
+        e.g. history resent by a join after reconnect.
+        """
+        history = self._chats.get(chat_id)
+        if history is None:
+            return messages
+        return history.fresh(messages)
+
+    def evict(self, chat_id):
+        """
+        Free history of a chat that has ended.
+        """
+        self._chats.pop(chat_id, None)
+
+    def memory_usage(self):
+        """
+        Return approximate size of all stored messages, in bytes.
+        """
+        return sum(history.nbytes for history in self._chats.values())
+
+    def stats(self):
+        return {
+            "chats": len(self._chats),
+            "messages": sum(len(h) for h in self._chats.values()),
+            "bytes": self.memory_usage()
+        }
@@ -0,0 +1,136 @@
+# coding utf-8
+
+import bisect
+import datetime
+import threading
+import time
+
+HOT_HALF_LIFE = datetime.timedelta(minutes=30)
+MESSAGE_WEIGHT = 1
+# Extra weight of a message by an author not seen in the chat lately
+AUTHOR_WEIGHT = 3
+# Authors are told apart within that window
+AUTHOR_WINDOW = datetime.timedelta(hours=1)
+# Authors remembered per chat before those out of the window are dropped
+MAX_AUTHORS = 64
+# Rebase scores before 2 ** exponent gets anywhere near float limits
+MAX_EXPONENT = 64
+
+
+class _ChatActivity():
+    __slots__ = ('value', 'key', 'authors')
+
+    def __init__(self):
+        self.value = 0.0
+        # Entry in HotRanking._keys
+        self.key = None
+        # author user_id -> inserted_at of their latest message
+        self.authors = {}
+
+
+class HotRanking():
+    """
+    Chats ranked by exponentially decayed activity.
+
+    Every message adds MESSAGE_WEIGHT, plus AUTHOR_WEIGHT if its
+    author has not written in the chat for AUTHOR_WINDOW, so a
+    conversation outranks a monologue. Scores halve every
+    `half_life` without messages.
+
+    Scores are kept as values at a fixed epoch, where decay does
+    not change their order, so the sorted index is only touched
+    by new messages and top(k) is a slice.
+    """
+    def __init__(self, half_life=HOT_HALF_LIFE, now=time.time):
+        self.half_life = half_life.total_seconds()
+        self.author_window = AUTHOR_WINDOW.total_seconds()
+        self._now = now
+        self._epoch = now()
+        self._keys = []
+        self._activity = {}
+        self._lock = threading.Lock()
+
+    def _weight(self, inserted_at):
+        return 2 ** ((inserted_at - self._epoch) / self.half_life)
+
+    def observe(self, chat_id, messages):
+        """
+        Account new messages of chat_id.
+        """
+        with self._lock:
+            activity = self._activity.get(chat_id)
+            if activity is None:
+                activity = self._activity[chat_id] = _ChatActivity()
+            for message in messages:
+                inserted_at = message.get('inserted_at') or self._now()
+                if ((inserted_at - self._epoch) / self.half_life >
+                        MAX_EXPONENT):
+                    self._rebase(inserted_at)
+                weight = MESSAGE_WEIGHT
+                # Names are neither unique nor stable, ids are.
+                author = message.get('user_id')
+                last = activity.authors.get(author)
+                if last is None or inserted_at - last > self.author_window:
+                    weight += AUTHOR_WEIGHT
+                if last is None or inserted_at > last:
+                    activity.authors[author] = inserted_at
+                activity.value += weight * self._weight(inserted_at)
+            self._forget_authors(activity)
+            if activity.key is not None:
+                del self._keys[bisect.bisect_left(self._keys, activity.key)]
+            activity.key = (-activity.value, chat_id)
+            bisect.insort(self._keys, activity.key)
+
+    def _forget_authors(self, activity):
+        if len(activity.authors) < MAX_AUTHORS:
+            return
+        newest = max(activity.authors.values())
+        activity.authors = {
+            author: inserted_at
+            for author, inserted_at in activity.authors.items()
+            if newest - inserted_at <= self.author_window}
+
+    def _rebase(self, epoch):
+        """
+        Move the epoch, scaling every value.
+        """
+        scale = 2 ** ((self._epoch - epoch) / self.half_life)
+        self._epoch = epoch
+        for chat_id, activity in self._activity.items():
+            activity.value *= scale
+            if activity.key is not None:
+                activity.key = (-activity.value, chat_id)
+        self._keys = sorted(activity.key
+                            for activity in self._activity.values()
+                            if activity.key is not None)
+
+    def remove(self, chat_id):
+        with self._lock:
+            activity = self._activity.pop(chat_id, None)
+            if activity is None or activity.key is None:
+                return
+            del self._keys[bisect.bisect_left(self._keys, activity.key)]
+
+    def score(self, chat_id):
+        """
+        Decayed activity of chat_id now.
+        """
+        activity = self._activity.get(chat_id)
+        if activity is None:
+            return 0
+        return activity.value * self._weight(self._now()) ** -1
+
+    def top(self, count):
+        """
+        Return [(chat_id, score), ...] of the `count` hottest chats.
+        """
+        with self._lock:
+            decay = self._weight(self._now()) ** -1
+            return [(chat_id, -value * decay)
+                    for value, chat_id in self._keys[:count]]
+
+    def __contains__(self, chat_id):
+        return chat_id in self._activity
+
+    def __len__(self):
+        return len(self._activity)
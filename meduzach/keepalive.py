@@ -0,0 +1,78 @@
+# coding utf-8
+
+import collections
+import datetime
+import time
+
+from meduzach import metrics
+
+HEART_PERIOD = datetime.timedelta(seconds=25)
+# A heartbeat not answered in time means the connection is dead.
+HEARTBEAT_TIMEOUT = datetime.timedelta(seconds=20)
+# How often the watchdog wakes up to send and check heartbeats.
+KEEPALIVE_TICK = datetime.timedelta(seconds=1)
+RTT_HISTORY = 100
+
+
+class Keepalive():
+    """
+    Phoenix heartbeat bookkeeping, independent of the receive loop.
+
+    The watchdog asks `due()` whether to send a heartbeat, reports
+    it with `sent(ref)` and checks `dead()` on every tick. Replies
+    are matched by ref in `received`, their round trip times are
+    kept in `rtts` as (time, seconds) pairs.
+    """
+    def __init__(self, period=HEART_PERIOD, timeout=HEARTBEAT_TIMEOUT,
+                 history=RTT_HISTORY, now=time.monotonic):
+        self.period = period.total_seconds()
+        self.timeout = timeout.total_seconds()
+        self.rtts = collections.deque(maxlen=history)
+        self._now = now
+        self._pending = {}
+        self._last_sent = None
+
+    def reset(self):
+        """
+        Forget heartbeats of a previous connection.
+        """
+        self._pending.clear()
+        self._last_sent = None
+
+    def due(self):
+        return (self._last_sent is None or
+                self._now() - self._last_sent >= self.period)
+
+    def sent(self, ref):
+        self._last_sent = self._now()
+        self._pending[ref] = self._last_sent
+
+    def received(self, response):
+        """
+        Returns True if response is a reply to our heartbeat.
+        """
+        sent_at = self._pending.pop(response.get('ref'), None)
+        if sent_at is None:
+            return False
+        rtt = self._now() - sent_at
+        self.rtts.append((time.time(), rtt))
+        metrics.HEARTBEAT_RTT.observe(rtt)
+        return True
+
+    def dead(self):
+        """
+        True if some heartbeat was not answered within timeout.
+        """
+        now = self._now()
+        return any(now - sent_at > self.timeout
+                   for sent_at in list(self._pending.values()))
+
+    def stats(self):
+        """
+        Summary of the recorded round trip times, in seconds.
+        """
+        rtts = [rtt for _, rtt in self.rtts]
+        if not rtts:
+            return {'count': 0}
+        return {'count': len(rtts), 'last': rtts[-1], 'min': min(rtts),
+                'max': max(rtts), 'avg': sum(rtts) / len(rtts)}
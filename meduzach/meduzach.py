@@ -1,61 +1,120 @@
 # coding utf-8
 
+import itertools
 import json
+import threading
 import time
 import traceback
 import datetime
 import collections
 import queue
+import socket
 
 import websocket
 
+from meduzach import frames
+from meduzach import metrics
+from meduzach.frames import CHAT_FIELDS
 from meduzach.connections import Connector
+from meduzach.channels import ChannelRegistry
+from meduzach.chat_index import ChatIndex
+from meduzach.history import MessageStore
+from meduzach.hot import HotRanking
+from meduzach.keepalive import Keepalive, KEEPALIVE_TICK
+from meduzach.polling import AdaptivePoll, Backoff
+from meduzach.users import UserDirectory
 
-HEART_PERIOD = datetime.timedelta(seconds=25)
+JOIN_REPLY_TIMEOUT = datetime.timedelta(seconds=10)
 
 IGNORED_MESSAGES = [
     "Здесь 8 часов ничего не писали, поэтому чат закрылся. Всем спасибо!"]
 MEDUZA_BOT_NAME = "Meduza Bot"
 
 
+def abort(ws):
+    """
+    Drop the connection without the close handshake.
+
+    The handshake waits for the frame lock a thread blocked in
+    recv holds. Shutting the socket down wakes that thread up
+    with an error instead.
+    """
+    if ws.sock is not None:
+        try:
+            ws.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    ws.shutdown()
+
+
 class Meduzach(Connector):
     def __init__(self):
         super().__init__()
         self.addr = ('wss://meduza.io/pond/socket/websocket?token=no_token'
                      '&vsn=1.0.0')
         self._ws = None
-        self._ref = 1
-        self._heart_time = None
+        # next() on a count is atomic, refs are taken
+        # by the watchdog thread too.
+        self._refs = itertools.count(1)
         self._chats_to_be_updated = collections.defaultdict(int)
         self._chats_to_be_updated_queue = queue.Queue()
+        self.channels = ChannelRegistry()
+        self.lobby_poll = AdaptivePoll()
+        self.reconnect_backoff = Backoff()
+        self.keepalive = Keepalive()
+        self._last_lobby_frame = None
         self.chats = {}
-        self.messages = collections.defaultdict(list)
+        self.chat_index = ChatIndex()
+        self.messages = MessageStore()
+        self.hot = HotRanking()
         self.slowmode = True
-        self.users = {}
+        self.users = UserDirectory()
         self.is_initialized = False
+        self._stopped = False
 
     def _topic_request(self, topic, event='phx_join', payload=None):
         print('creating request for {}, {}'.format(
             topic, event))
         if payload is None:
             payload = {}
-        ref = self._ref
-        self._ref += 1
         return {
             "topic": topic,
             "event": event,
             "payload": payload,
-            "ref": str(ref)}
-
-    def _heartbeat(self):
-        if (self._heart_time is None or
-                (datetime.datetime.now() - self._heart_time) >
-                HEART_PERIOD):
-            self._heart_time = datetime.datetime.now()
-            self.send(self._topic_request('phoenix', 'heartbeat'))
+            "ref": str(next(self._refs))}
+
+    def _heartbeat_request(self):
+        request = self._topic_request('phoenix', 'heartbeat')
+        self.keepalive.sent(request['ref'])
+        return request
+
+    def _watchdog(self, ws, stop):
+        """
+        Send heartbeats on schedule while the receive loop blocks,
+        abort ws once one of them is not answered in time.
+        """
+        try:
+            while not stop.wait(KEEPALIVE_TICK.total_seconds()):
+                if self.keepalive.dead():
+                    print("No heartbeat reply, reconnecting")
+                    abort(ws)
+                    return
+                if self.keepalive.due():
+                    ws.send(json.dumps(self._heartbeat_request()))
+        except Exception:
+            traceback.print_exc()
+            abort(ws)
+
+    def _start_watchdog(self):
+        self.keepalive.reset()
+        stop = threading.Event()
+        threading.Thread(target=self._watchdog, args=(self._ws, stop),
+                         name="keepalive", daemon=True).start()
+        return stop
 
     def connect_to_server(self):
-        self._ws = websocket.WebSocket()
+        # Heartbeats and joins are sent from several threads.
+        self._ws = websocket.WebSocket(enable_multithread=True)
         self._ws.connect(self.addr)
 
     def send(self, data):
@@ -67,43 +126,131 @@ class Meduzach(Connector):
 
     def receive(self):
         response = self._ws.recv()
+        self.reconnect_backoff.reset()
         # with open("log.txt", "a") as f:
         #     print("<<<", datetime.datetime.now(), response, file=f)
-        return json.loads(response)
+        return self.decode(response)
+
+    def decode(self, raw):
+        """
+        Decode a raw frame, None if there is nothing to do with it.
+        """
+        topic, event = frames.peek(raw)
+        metrics.FRAMES.inc(topic=metrics.topic_kind(topic), event=event)
+        if topic == 'topic:lobby' and event == 'current_chats':
+            # Idle lobby polls return the very same snapshot.
+            if raw == self._last_lobby_frame:
+                self.lobby_poll.observe(False)
+                return None
+            self._last_lobby_frame = raw
+        if not frames.is_wanted(topic, event):
+            return None
+        return frames.project(frames.loads(raw))
 
     def update_chats(self, response):
-        chats = {
-            chat_id: response['payload']['chats'][chat_id]
-            for chat_id in response.get('payload', {}).get('chats_ids', [])
-            if response['payload']['chats'][chat_id]['messages_count'] > 0
-        }
-
-        if not chats:
+        """
+        Apply a lobby snapshot to self.chats in place.
+
+        Emits chatlist_updated with (added, removed, changed) chat ids
+        when anything we show has changed.
+        """
+        payload = response.get('payload', {})
+        lobby_chats = payload.get('chats', {})
+        live = [
+            chat_id for chat_id in payload.get('chats_ids', [])
+            if lobby_chats[chat_id]['messages_count'] > 0]
+
+        if not live:
             return
 
-        for chat_id, chat_info in chats.items():
-            previous = self.chats.get(chat_id, {'messages_count': 0})
-            msg_update = (chat_info['messages_count'] -
-                          previous['messages_count'])
+        added_chats = set()
+        changed_chats = set()
+        for chat_id in live:
+            chat_info = lobby_chats[chat_id]
+            previous = self.chats.get(chat_id)
+            if previous is None:
+                added_chats.add(chat_id)
+                msg_update = chat_info['messages_count']
+            else:
+                msg_update = (chat_info['messages_count'] -
+                              previous['messages_count'])
+                if not self._same_chat_info(previous, chat_info):
+                    changed_chats.add(chat_id)
+                else:
+                    continue
+            self.chats[chat_id] = chat_info
+            self.chat_index.update(chat_id, chat_info)
             if msg_update > 0:
                 if chat_id not in self._chats_to_be_updated:
-                    self._chats_to_be_updated_queue.put(chat_id)
+                    self._queue_chat_update(chat_id)
                 self._chats_to_be_updated[chat_id] += msg_update
 
-        old_chats = set(self.chats.keys())
-        new_chats = set(chats.keys())
-
-        removed_chats = old_chats - new_chats
-        added_chats = new_chats - old_chats
-
-        self.chats = chats
-        if added_chats or removed_chats:
-            self.emit('chatlist_updated', (added_chats, removed_chats))
+        removed_chats = set()
+        # Every live chat is in self.chats by now,
+        # anything beyond them has ended.
+        if len(self.chats) > len(live):
+            live_set = set(live)
+            removed_chats = {
+                chat_id for chat_id in self.chats if chat_id not in live_set}
+        for chat_id in removed_chats:
+            self._leave_chat(chat_id)
+            self.messages.evict(chat_id)
+            self.hot.remove(chat_id)
+            del self.chats[chat_id]
+            self.chat_index.remove(chat_id)
+
+        changed = bool(added_chats or removed_chats or changed_chats)
+        self.lobby_poll.observe(changed)
+        if changed:
+            self.emit('chatlist_updated',
+                      (added_chats, removed_chats, changed_chats))
+
+    @staticmethod
+    def _same_chat_info(previous, chat_info):
+        return all(previous.get(field) == chat_info.get(field)
+                   for field in CHAT_FIELDS)
+
+    def _queue_chat_update(self, chat_id):
+        self._chats_to_be_updated_queue.put(chat_id)
 
     def change_topic(self, topic):
         self.send(self._topic_request("topic:" + topic))
 
-    def update_messages(self, response):
+    def _join_request(self, chat_id):
+        """
+        Return phx_join request for chat topic.
+
+        Returns None if we are already joined to it (new messages
+        come as pushes then) or the join is still in flight.
+        """
+        if self.channels.is_joining(chat_id):
+            return None
+        if chat_id not in self.chats or self.channels.is_joined(chat_id):
+            self._chats_to_be_updated.pop(chat_id, None)
+            return None
+        topic = "topic:" + self.chats[chat_id]['key']
+        request = self._topic_request(topic)
+        self.channels.join(chat_id, topic, request['ref'])
+        return request
+
+    def _leave_request(self, chat_id):
+        topic = self.channels.leave(chat_id)
+        if topic is None:
+            return None
+        return self._topic_request(topic, 'phx_leave')
+
+    def _leave_chat(self, chat_id):
+        request = self._leave_request(chat_id)
+        if request is not None:
+            self.send(request)
+
+    def _expire_joins(self):
+        for chat_id in self.channels.expire(
+                JOIN_REPLY_TIMEOUT.total_seconds()):
+            print("No reply for chat {}".format(chat_id))
+            self._chats_to_be_updated.pop(chat_id, None)
+
+    def update_messages(self, response, chat_id=None):
         if 'messages_ids' in response.get(
                 'payload', {}).get('response', {}):
             chat_info = response['payload']['response']
@@ -113,31 +260,46 @@ class Meduzach(Connector):
             return
         if 'messages' not in chat_info:
             return
-        messages = chat_info['messages']
-        if 'users' in chat_info:
-            for user_id, user_info in chat_info['users'].items():
-                self.users[user_id] = user_info
-
-        messages = [
-            {
-                "author": self.users[messages[msg_id]['user_id']]['name'],
-                "text": messages[msg_id]['message'],
-                "chat_id": messages[msg_id].get('chat_id'),
-                "inserted_at": messages[msg_id].get('inserted_at', 1),  # ??
-                "reply_to": messages[msg_id].get('reply_to_user_id')
-            }
-            for msg_id in chat_info['messages_ids']
-        ]
-
-        chat_id = chat_info.get('chat_id') or messages[0]['chat_id']
+        raw_messages = chat_info['messages']
+        users = self.users
+        names = chat_info.get('users')
+
+        messages = []
+        for msg_id in chat_info['messages_ids']:
+            message = raw_messages[msg_id]
+            reply_to = message.get('reply_to_user_id')
+            if reply_to:
+                users.see(reply_to, names)
+            messages.append({
+                "id": msg_id,
+                "user_id": message['user_id'],
+                "author": users.see(message['user_id'], names),
+                "text": message['message'],
+                "chat_id": message.get('chat_id'),
+                "inserted_at": message.get('inserted_at', 1),  # ??
+                "reply_to": reply_to
+            })
+        users.expire()
+
+        if not messages:
+            return
+
+        if chat_id is None:
+            chat_id = chat_info.get('chat_id') or messages[0]['chat_id']
         chat_id = str(chat_id)
 
+        # Rejoining after a reconnect resends history we already have.
+        messages = self.messages.fresh(chat_id, messages)
+        if not messages:
+            return
+
         self._store_updated_messages(chat_id, messages)
         if not self._filter_out_chat_messages(messages):
+            self.hot.observe(chat_id, messages)
             self.emit('chat_updated', (chat_id, messages))
 
     def _store_updated_messages(self, chat_id, messages):
-        self.messages[chat_id] += messages
+        self.messages.extend(chat_id, messages)
 
     def _filter_out_chat_messages(self, messages):
         return (len(messages) == 1 and
@@ -146,57 +308,97 @@ class Meduzach(Connector):
 
     def close(self):
         if self._ws is not None:
-            self._ws.close()
+            abort(self._ws)
             self._ws = None
 
     def route_response(self, response):
+        with metrics.ROUTE_TIME.time():
+            return self._route_response(response)
+
+    def _route_response(self, response):
+        if response is None:
+            return False
         if response['topic'] == 'topic:lobby':
             self.update_chats(response)
             return False
         elif response['topic'] == 'phoenix':
+            self.keepalive.received(response)
             return False
         else:
             event = response.get('event')
+            if event == 'phx_close' or event == 'phx_error':
+                self.channels.closed(response['topic'])
+                return False
             if (event != 'current_chats' and
                     event != 'new_msg' and event != 'phx_reply'):
                 return False
-            self.update_messages(response)
+            chat_id, is_join_reply = self.channels.resolve(response)
+            if is_join_reply:
+                self._chats_to_be_updated.pop(chat_id, None)
+            self.update_messages(response, chat_id)
             return True
 
+    def stop(self):
+        """
+        Make run() return. Safe to call from any thread.
+        """
+        self._stopped = True
+        ws = self._ws
+        if ws is not None:
+            abort(ws)
+
     def run(self, recover=True):
-        while True:
+        while not self._stopped:
+            watchdog = None
             try:
                 self.connect_to_server()
+                if self._stopped:
+                    break
+                # Joins in flight died with the old connection,
+                # their chats are queued again by the next lobby poll.
+                self._chats_to_be_updated.clear()
+                self._chats_to_be_updated_queue = queue.Queue()
+                self.channels.clear()
+                watchdog = self._start_watchdog()
 
                 while True:
                     while self._chats_to_be_updated_queue.empty():
-                        self._heartbeat()
+                        if self.slowmode:
+                            time.sleep(self.lobby_poll.remaining())
+                        self.lobby_poll.polled()
                         self.send(self._topic_request("topic:lobby"))
                         self.route_response(self.receive())
                         self.route_response(self.receive())
                         if not self._chats_to_be_updated_queue.empty():
                             time.sleep(1)
 
-                    chat_id = self._chats_to_be_updated_queue.get_nowait()
-                    self.change_topic(
-                        self.chats[chat_id]['key'])
-                    chat_updated = False
+                    # Join every changed chat at once, then route
+                    # the replies by topic and ref as they come.
+                    while not self._chats_to_be_updated_queue.empty():
+                        request = self._join_request(
+                            self._chats_to_be_updated_queue.get_nowait())
+                        if request is not None:
+                            self.send(request)
 
-                    while not chat_updated:
-                        self._heartbeat()
-                        chat_updated = self.route_response(self.receive())
-                    del self._chats_to_be_updated[chat_id]
-                    if self._chats_to_be_updated_queue.empty():
+                    while self.channels.pending:
+                        self.route_response(self.receive())
+                        self._expire_joins()
+                    if not self.is_initialized:
                         print("Chat list initialized!")
                         self.is_initialized = True
             except Exception:
+                if self._stopped:
+                    break
                 if not recover:
                     raise
                 traceback.print_exc()
                 self.close()
-                time.sleep(5)
-                print("Reconnecting...")
+                delay = self.reconnect_backoff.next()
+                print("Reconnecting in {:.1f} s...".format(delay))
+                time.sleep(delay)
             finally:
+                if watchdog is not None:
+                    watchdog.set()
                 self.close()  # It's okay to call it twice
 
 
@@ -1,17 +1,27 @@
 # coding utf-8
 import logging
+import os
 import threading
 import time
 
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 
 
+from meduzach import metrics
+from meduzach.admin import AdminCommands
 from meduzach.connections import Connector
 from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.storage import SubscriptionStore
+from meduzach.delivery import DeliveryScheduler
 from meduzach.meduzach import Meduzach
-from meduzach.credentials import BOT_TOKEN
+from meduzach.async_meduzach import AsyncMeduzach
+from meduzach.snapshot import Snapshotter
+from meduzach.webhook import start_webhook, wait_for_signal, WEBHOOK_PORT
 
 
+# Run the listener on an asyncio loop instead of the blocking recv loop.
+USE_ASYNCIO = True
+
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.DEBUG)
@@ -25,7 +35,10 @@ class TelegramBot(Connector):
     def __init__(self):
         super().__init__()
         self.bot = None
-        self.connect('send_msg', self.create_send_msg())
+        self.connect('send_msg', self.create_send_text())
+
+    def sendMessage(self, *args, **kwargs):
+        return self.bot.sendMessage(*args, **kwargs)
 
     def create_send_text(self):
         def _send_text(sender, payload):
@@ -35,15 +48,48 @@ class TelegramBot(Connector):
         return _send_text
 
 
-listener = Meduzach()
+listener = AsyncMeduzach() if USE_ASYNCIO else Meduzach()
 telegram_bot = TelegramBot()
-bot_logic = ChatbotLogic(listener, telegram_bot)
+store = SubscriptionStore()
+bot_logic = ChatbotLogic(listener, telegram_bot, store)
+delivery = DeliveryScheduler(telegram_bot, on_error=bot_logic._on_send_error)
+bot_logic.delivery = delivery
+snapshotter = Snapshotter(listener, bot_logic)
+# Set by run() if updates come through the webhook
+webhook = None
+admin = AdminCommands(lambda: {
+    "messages": listener.messages,
+    "users": listener.users,
+    "chats": listener.chats,
+    "render_cache": bot_logic.renderer,
+    "chat_list_cache": bot_logic.chat_list,
+    "readers": bot_logic.readers,
+    "subscriptions": bot_logic.subscriptions,
+    "delivery": delivery,
+})
 
 _show_chats = bot_logic._create_show_chats()
 _show_help = bot_logic._create_show_help()
 _toggle_subscription = bot_logic._create_toggle_subscription()
+_show_more = bot_logic._create_show_more()
+_show_hot = bot_logic._create_show_hot()
+_toggle_autohot = bot_logic._create_toggle_autohot()
+_follow = bot_logic._create_follow()
+_unfollow = bot_logic._create_unfollow()
 _process_chat_update = bot_logic._create_process_chat_update()
 
+telegram_bot.connect('chats', _show_chats)
+telegram_bot.connect('help', _show_help)
+telegram_bot.connect('toggle_subscription', _toggle_subscription)
+telegram_bot.connect('more', _show_more)
+telegram_bot.connect('hot', _show_hot)
+telegram_bot.connect('autohot', _toggle_autohot)
+telegram_bot.connect('follow', _follow)
+telegram_bot.connect('unfollow', _unfollow)
+telegram_bot.connect('profile_start', admin._create_profile_start())
+telegram_bot.connect('profile_stop', admin._create_profile_stop())
+telegram_bot.connect('memory', admin._create_memory())
+
 
 def chats(bot, update):
     """
@@ -63,6 +109,51 @@ def show_help(bot, update):
     telegram_bot.emit('help', update)
 
 
+def more(bot, update):
+    """
+    Continue catch-up after subscribing.
+
+    /more command
+    """
+    telegram_bot.emit('more', update)
+
+
+def hot(bot, update):
+    """
+    List the most active chats.
+
+    /hot command
+    """
+    telegram_bot.emit('hot', update)
+
+
+def autohot(bot, update):
+    """
+    Toggle automatic subscription to the most active chats.
+
+    /autohot command
+    """
+    telegram_bot.emit('autohot', update)
+
+
+def follow(bot, update):
+    """
+    Follow an author across all chats.
+
+    /follow Name command
+    """
+    telegram_bot.emit('follow', update)
+
+
+def unfollow(bot, update):
+    """
+    Stop following an author.
+
+    /unfollow Name command
+    """
+    telegram_bot.emit('unfollow', update)
+
+
 def toggle_subscription(bot, update):
     """
     Add or remove subscription to chat.
@@ -72,39 +163,173 @@ def toggle_subscription(bot, update):
     telegram_bot.emit('toggle_subscription', update)
 
 
+def profile_start(bot, update):
+    """
+    Start the CPU profiler, admins only.
+
+    /profile_start command
+    """
+    telegram_bot.emit('profile_start', update)
+
+
+def profile_stop(bot, update):
+    """
+    Stop the CPU profiler and write the profile, admins only.
+
+    /profile_stop command
+    """
+    telegram_bot.emit('profile_stop', update)
+
+
+def memory(bot, update):
+    """
+    Write a memory report, admins only.
+
+    /memory command
+    """
+    telegram_bot.emit('memory', update)
+
+
 def error(bot, update, error):
     logging.warning('Update "%s" caused error "%s"' % (update, error))
 
 
-def run(token):
+def start_metrics(port=metrics.METRICS_PORT):
+    """
+    Serve metrics on localhost, None if the port is taken.
+    """
+    metrics.watch_listener(listener)
+    try:
+        return metrics.MetricsServer(port=port).start()
+    except OSError as exc:
+        print("Metrics are not served: {}".format(exc))
+        return None
+
+
+def run(token, base_url=None, idle=True, metrics_port=metrics.METRICS_PORT,
+        admin_ids=(), webhook_url=None, webhook_port=WEBHOOK_PORT):
     """
     Start telegram bot.
+
+    base_url overrides the Bot API address (e.g. a local stub).
+    metrics_port is the localhost port for /metrics, None to disable.
+    admin_ids are chat ids allowed to use profiling commands.
+    webhook_url is the public url of the webhook proxied to
+    localhost:webhook_port, updates are polled if it is None
+    or the webhook fails to start.
+    Returns the updater if idle is False, stop it with stop_updater().
     """
+    global webhook
+    admin.admin_ids = set(admin_ids)
+    if os.path.exists("track.txt") and store.is_empty():
+        print("Imported {} subscriptions from track.txt".format(
+            store.import_track_file("track.txt")))
     bot_logic.restore_tracked()
+    if metrics_port is not None:
+        start_metrics(metrics_port)
 
-    updater = Updater(token)
+    updater = Updater(token, base_url=base_url)
     telegram_bot.bot = updater.bot
+    delivery.start()
 
     updater.dispatcher.add_handler(CommandHandler('help', show_help), group=0)
     updater.dispatcher.add_handler(CommandHandler('start', show_help), group=0)
     updater.dispatcher.add_handler(CommandHandler('chats', chats), group=0)
+    updater.dispatcher.add_handler(CommandHandler('more', more), group=0)
+    updater.dispatcher.add_handler(CommandHandler('hot', hot), group=0)
+    updater.dispatcher.add_handler(
+        CommandHandler('autohot', autohot), group=0)
+    updater.dispatcher.add_handler(CommandHandler('follow', follow), group=0)
+    updater.dispatcher.add_handler(
+        CommandHandler('unfollow', unfollow), group=0)
+    updater.dispatcher.add_handler(
+        CommandHandler('profile_start', profile_start), group=0)
+    updater.dispatcher.add_handler(
+        CommandHandler('profile_stop', profile_stop), group=0)
+    updater.dispatcher.add_handler(CommandHandler('memory', memory), group=0)
     updater.dispatcher.add_handler(
         MessageHandler([Filters.command], toggle_subscription), group=1)
 
     updater.dispatcher.add_error_handler(error)
 
-    updater.start_polling()
-    updater.idle()
+    if webhook_url is not None:
+        webhook = start_webhook(updater, webhook_url, port=webhook_port)
+    if webhook is None:
+        updater.start_polling()
+    if not idle:
+        return updater
+    try:
+        wait_for_signal()
+    finally:
+        stop_updater(updater)
+
 
+def stop_updater(updater):
+    """
+    Stop receiving and dispatching updates.
+    """
+    global webhook
+    if webhook is not None:
+        webhook.stop()
+        webhook = None
+    updater.stop()
 
-def main():
+
+def main(token=None, meduza_addr=None, base_url=None, idle=True,
+         metrics_port=metrics.METRICS_PORT, coalesce_window=None):
+    """
+    coalesce_window (timedelta) merges bursts of chat updates,
+    they are sent right away if it is None.
+    """
+    admin_ids = ()
+    webhook_url = None
+    if token is None:
+        from meduzach import credentials
+        token = credentials.BOT_TOKEN
+        admin_ids = getattr(credentials, 'ADMIN_IDS', ())
+        webhook_url = getattr(credentials, 'WEBHOOK_URL', None)
+        coalesce_window = getattr(
+            credentials, 'COALESCE_WINDOW', coalesce_window)
+    if coalesce_window is not None:
+        bot_logic.coalesce(coalesce_window)
+    if meduza_addr is not None:
+        listener.addr = meduza_addr
+
+    # A recent snapshot makes the listener initialized right away,
+    # it catches up with the lobby while commands are served.
+    snapshotter.restore()
     listener_thread = threading.Thread(
-        target=lambda m: m.run(), args=(listener, ))
+        target=lambda m: m.run(), args=(listener, ), daemon=True)
     listener_thread.start()
     while not listener.is_initialized:
         time.sleep(3)
+    snapshotter.start()
+
+    updater = run(token, base_url, False, metrics_port, admin_ids,
+                  webhook_url)
+    if not idle:
+        return updater
+    try:
+        wait_for_signal()
+    finally:
+        shutdown(updater)
 
-    run(BOT_TOKEN)
+
+def shutdown(updater):
+    """
+    Stop the bot started by main(), writing the final snapshot
+    and committing subscription changes still waiting for the
+    next batch. Call it if main() was run with idle=False.
+    """
+    try:
+        stop_updater(updater)
+        listener.stop()
+        bot_logic.stop(5)
+        # Before the Bot API goes away, e.g. in the load test.
+        delivery.stop()
+    finally:
+        snapshotter.stop()
+        store.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,321 @@
+# coding utf-8
+"""
+Process metrics in the Prometheus text format.
+
+Metrics are module level, so any module can update them
+without passing a registry around. `MetricsServer` serves
+them on localhost at /metrics.
+"""
+
+import http.server
+import socketserver
+import threading
+import time
+import traceback
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1,
+                   .25, .5, 1, 2.5, 5, 10)
+DELIVERY_BUCKETS = (.1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric():
+    kind = None
+
+    def __init__(self, name, help, labels=(), registry=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return ["{}{} {}".format(
+            self.name, _labels(self.label_names, key), _number(value))]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Gauge set directly or read from a function at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), registry=None):
+        super().__init__(name, help, labels, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def render(self):
+        if self._function is not None:
+            try:
+                self.set(self._function())
+            except Exception:
+                traceback.print_exc()
+                # A stale value would look current, leave it out.
+                with self._lock:
+                    self._values.pop(self._key({}), None)
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS,
+                 registry=None):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return 0 if state is None else state[2]
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _render_value(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append("{}_bucket{} {}".format(
+                self.name,
+                _labels(self.label_names, key, [("le", _number(bound))]),
+                cumulative))
+        labels = _labels(self.label_names, key)
+        lines.append("{}_sum{} {}".format(self.name, labels, _number(total)))
+        lines.append("{}_count{} {}".format(self.name, labels, count))
+        return lines
+
+
+class _Timer():
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(
+            time.perf_counter() - self.start, **self.labels)
+
+
+class TimedLock():
+    """
+    Lock wrapper recording how long acquiring it waited.
+    """
+    def __init__(self, lock, histogram, **labels):
+        self._lock = lock
+        self.histogram = histogram
+        self.labels = labels
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self.histogram.observe(time.perf_counter() - start, **self.labels)
+        return acquired
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class Registry():
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+FRAMES = Counter(
+    "meduzach_frames_total", "Websocket frames received.",
+    ("topic", "event"))
+ROUTE_TIME = Histogram(
+    "meduzach_route_response_seconds", "Time spent in route_response.")
+DELIVERY_LATENCY = Histogram(
+    "meduzach_delivery_latency_seconds",
+    "Time from message inserted_at to sendMessage completion.",
+    buckets=DELIVERY_BUCKETS)
+FANOUT = Histogram(
+    "meduzach_fanout_readers", "Readers of a chat update.",
+    buckets=SIZE_BUCKETS)
+SEND_ERRORS = Counter(
+    "meduzach_send_errors_total", "Failed sendMessage calls.", ("type",))
+HANDLER_TIME = Histogram(
+    "meduzach_handler_seconds", "Time spent in signal handlers.",
+    ("signal", "mode"))
+SLOT_QUEUE = Gauge(
+    "meduzach_slot_queue_length", "Emissions waiting in queued slots.",
+    ("signal", ))
+SLOT_BLOCKED = Counter(
+    "meduzach_slot_blocked_seconds_total",
+    "Time emitters waited for room in full slot queues.", ("signal", ))
+SLOT_DROPPED = Counter(
+    "meduzach_slot_dropped_total",
+    "Emissions dropped by full slot queues.", ("signal", ))
+HEARTBEAT_RTT = Histogram(
+    "meduzach_heartbeat_rtt_seconds", "Phoenix heartbeat round trip time.")
+LOCK_WAIT = Histogram(
+    "meduzach_lock_wait_seconds", "Time waited for subscription locks.")
+MESSAGES = Gauge("meduzach_messages", "Chat messages kept in history.")
+USERS = Gauge("meduzach_users", "Users kept in the user directory.")
+CHATS = Gauge("meduzach_chats", "Active chats.")
+
+
+def topic_kind(topic):
+    """
+    Low cardinality label for a Phoenix topic.
+    """
+    if topic == 'topic:lobby':
+        return 'lobby'
+    if topic == 'phoenix':
+        return 'phoenix'
+    return 'chat'
+
+
+def watch_listener(listener):
+    """
+    Report history, user and chat counts of a listener.
+    """
+    MESSAGES.set_function(lambda: listener.messages.stats()['messages'])
+    USERS.set_function(lambda: len(listener.users))
+    CHATS.set_function(lambda: len(listener.chats))
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http.server.HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer():
+    """
+    Serves a registry at http://host:port/metrics on a daemon thread.
+    """
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST,
+                 port=METRICS_PORT):
+        self.registry = registry
+        self._server = _ThreadingHTTPServer(
+            (host, port), self._handler_class())
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def _handler_class(self):
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = registry.render().encode()
+                self.send_response(200)
+                self.send_header(
+                    "Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
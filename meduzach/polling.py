@@ -0,0 +1,85 @@
+# coding utf-8
+
+import datetime
+import random
+import time
+
+MIN_LOBBY_INTERVAL = datetime.timedelta(seconds=1)
+MAX_LOBBY_INTERVAL = datetime.timedelta(seconds=30)
+INITIAL_LOBBY_INTERVAL = datetime.timedelta(seconds=2)
+IDLE_BACKOFF = 1.5
+
+MIN_RECONNECT_DELAY = datetime.timedelta(seconds=1)
+MAX_RECONNECT_DELAY = datetime.timedelta(minutes=5)
+RECONNECT_BACKOFF = 2
+
+
+class AdaptivePoll():
+    """
+    Poll interval that drops to the minimum as soon as something
+    changes and grows geometrically while nothing does.
+    """
+    def __init__(self, min_interval=MIN_LOBBY_INTERVAL,
+                 max_interval=MAX_LOBBY_INTERVAL,
+                 initial=INITIAL_LOBBY_INTERVAL, backoff=IDLE_BACKOFF):
+        self.min_interval = min_interval.total_seconds()
+        self.max_interval = max_interval.total_seconds()
+        self.interval = initial.total_seconds()
+        self.backoff = backoff
+        self._last_poll = None
+
+    def observe(self, changed):
+        """
+        Adjust interval after a poll result.
+        """
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(
+                self.max_interval, self.interval * self.backoff)
+
+    def polled(self):
+        self._last_poll = time.monotonic()
+
+    def remaining(self):
+        """
+        Seconds until the next poll is due.
+        """
+        if self._last_poll is None:
+            return 0
+        return max(
+            0, self._last_poll + self.interval - time.monotonic())
+
+
+class Backoff():
+    """
+    Exponential backoff with jitter.
+
+    The n-th delay in a row is random in [c/2, c] where
+    c = min(max_delay, min_delay * factor**n), so clients
+    dropped together do not reconnect together.
+    """
+    def __init__(self, min_delay=MIN_RECONNECT_DELAY,
+                 max_delay=MAX_RECONNECT_DELAY, factor=RECONNECT_BACKOFF,
+                 random=random.random):
+        self.min_delay = min_delay.total_seconds()
+        self.max_delay = max_delay.total_seconds()
+        self.factor = factor
+        self.attempts = 0
+        self._random = random
+
+    def next(self):
+        """
+        Delay before the next attempt.
+        """
+        ceiling = min(self.max_delay,
+                      self.min_delay * self.factor ** self.attempts)
+        if ceiling < self.max_delay:
+            self.attempts += 1
+        return ceiling / 2 * (1 + self._random())
+
+    def reset(self):
+        """
+        Call once a connection works again.
+        """
+        self.attempts = 0
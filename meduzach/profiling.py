@@ -0,0 +1,150 @@
+# coding utf-8
+"""
+In-process CPU and memory profiling for a running bot.
+
+SamplingProfiler periodically records the stacks of every thread
+(listener, updater, delivery) without restarting the process.
+memory_report breaks memory down by the structures passed to it
+and by allocation site, using tracemalloc.
+"""
+
+import collections
+import datetime
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+SAMPLE_INTERVAL = 0.005
+PROFILES_DIR = "profiles"
+TOP_ENTRIES = 30
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "{} ({}:{})".format(
+        code.co_name, os.path.basename(code.co_filename), frame.f_lineno)
+
+
+class SamplingProfiler():
+    """
+    Statistical profiler sampling all threads every `interval` seconds.
+
+    Stacks are aggregated as "thread;outer;...;inner" -> samples,
+    the collapsed format flame graph tools read.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self.started_at = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            return False
+        self.samples = collections.Counter()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return True
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(skip=own)
+
+    def sample(self, skip=None):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[";".join(reversed(stack))] += 1
+
+    def top(self, count=TOP_ENTRIES):
+        """
+        Functions by samples they were on top of the stack.
+        """
+        leaves = collections.Counter()
+        for stack, samples in self.samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += samples
+        return leaves.most_common(count)
+
+    def write(self, path):
+        with open(path, "w") as outf:
+            for stack, samples in self.samples.most_common():
+                print("{} {}".format(stack, samples), file=outf)
+
+
+def deep_size(obj, seen=None):
+    """
+    Approximate memory held by obj and everything it references
+    that was not counted yet. Classes, modules and functions
+    are not followed.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, (
+                type, types.ModuleType, types.FunctionType,
+                types.MethodType, types.BuiltinFunctionType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def memory_report(structures, limit=TOP_ENTRIES):
+    """
+    Return report lines: sizes of `structures` ({name: object})
+    and the top allocation sites since tracing started.
+    """
+    lines = ["# structures"]
+    seen = set()
+    for name, obj in structures.items():
+        lines.append("{:<24} {:>12}".format(name, deep_size(obj, seen)))
+    lines.append("")
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        lines.append("# tracemalloc started, allocations are "
+                     "reported from the next snapshot on")
+        return lines
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__)])
+    stats = snapshot.statistics('lineno')
+    lines.append("# allocations, total {}".format(
+        sum(stat.size for stat in stats)))
+    lines.extend(str(stat) for stat in stats[:limit])
+    return lines
+
+
+def output_path(kind, directory=PROFILES_DIR):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, "{}-{}.txt".format(
+        kind, datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")))
@@ -0,0 +1,143 @@
+# coding utf-8
+
+import collections
+import threading
+import time
+
+CACHE_SIZE = 256
+
+
+def _message_key(message):
+    return message.get('id') or id(message)
+
+
+class RenderedUpdate():
+    """
+    Telegram chunks for a run of chat messages,
+    with header variants built on demand.
+    """
+    def __init__(self, messages, chunks, msg_limit):
+        # Keep the first and the last message alive,
+        # so their id() cannot be reused while cached.
+        self._ends = (messages[0], messages[-1]) if messages else ()
+        self.chunks = chunks
+        self.msg_limit = msg_limit
+        self._headed = {}
+
+    def with_header(self, header):
+        """
+        Return chunks with header prepended to the first one,
+        or sent separately if it does not fit.
+        """
+        headed = self._headed.get(header)
+        if headed is None:
+            if not self.chunks:
+                headed = (header,)
+            elif (len(self.chunks) > 1 or
+                    len(self.chunks[0]) + len(header) >= self.msg_limit):
+                headed = (header,) + self.chunks
+            else:
+                headed = (header + self.chunks[0],)
+            self._headed[header] = headed
+        return headed
+
+
+class RenderCache():
+    """
+    LRU cache of rendered message runs keyed by
+    (chat_id, first message, last message, count).
+
+    Every subscriber of an update, and every catch-up
+    of the same range, shares one RenderedUpdate.
+    """
+    def __init__(self, render, msg_limit, size=CACHE_SIZE):
+        self._render = render
+        self.msg_limit = msg_limit
+        self.size = size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, chat_id, messages):
+        if not isinstance(messages, (list, tuple)):
+            messages = list(messages)
+        if messages:
+            key = (chat_id, _message_key(messages[0]),
+                   _message_key(messages[-1]), len(messages))
+        else:
+            key = (chat_id, None, None, 0)
+        with self._lock:
+            rendered = self._cache.get(key)
+            if rendered is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return rendered
+            self.misses += 1
+        rendered = RenderedUpdate(
+            messages, tuple(self._render(messages)), self.msg_limit)
+        with self._lock:
+            self._cache[key] = rendered
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class ChatListCache():
+    """
+    Text of the chat list shared by every reader.
+
+    Rebuilt from a ChatIndex when the index has changed and the
+    cached text is older than expire_time. Only the [+]/[-]
+    markers are applied per reader.
+    """
+    def __init__(self, index, expire_time, now=time.monotonic):
+        self.index = index
+        self.expire_time = expire_time
+        self._now = now
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+        self._lines = ()
+        self._plain = None
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self):
+        with self._lock:
+            if self._lines and (
+                    self._version == self.index.version or
+                    self._now() - self._built_at < self.expire_time):
+                self.hits += 1
+                return self._lines, self._plain
+            self.misses += 1
+            version, chats = self.index.snapshot()
+            lines = tuple(
+                ("/{} [".format(chat_id), chat_id, "] {} ({})".format(
+                    chat_info['title'], chat_info['messages_count']))
+                for chat_id, chat_info in chats)
+            plain = "\n".join(head + "-" + tail for head, _, tail in lines)
+            # An empty list is not worth keeping stale.
+            if lines:
+                self._version = version
+                self._built_at = self._now()
+                self._lines = lines
+                self._plain = plain
+            return lines, plain
+
+    def render(self, subscribed=()):
+        """
+        Return the list for a reader subscribed to `subscribed`
+        chats, None if there are no chats.
+        """
+        lines, plain = self._current()
+        if not lines:
+            return None
+        if not subscribed:
+            return plain
+        return "\n".join(
+            head + ("+" if chat_id in subscribed else "-") + tail
+            for head, chat_id, tail in lines)
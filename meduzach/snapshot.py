@@ -0,0 +1,165 @@
+# coding utf-8
+"""
+Periodic snapshots of the listener and bot state for warm restarts.
+
+A snapshot holds the chat list, the newest messages of every chat,
+user names and reader state. Subscriptions are not part of it, the
+subscription store is always more recent. On start a recent snapshot is loaded
+before the listener connects, so commands are served right away;
+the first lobby polls then join only the chats that changed, and
+history dedup keeps messages already delivered from being resent.
+"""
+
+import datetime
+import os
+import pickle
+import threading
+import time
+import traceback
+import zlib
+
+SNAPSHOT_PATH = "meduzach.snapshot"
+SNAPSHOT_INTERVAL = datetime.timedelta(minutes=1)
+# Older snapshots describe chats that have mostly ended, start cold.
+SNAPSHOT_MAX_AGE = datetime.timedelta(hours=1)
+# Messages kept per chat
+SNAPSHOT_TAIL = 100
+SNAPSHOT_VERSION = 2
+
+
+def take(listener, logic=None, tail=SNAPSHOT_TAIL):
+    """
+    Collect the state to save. Safe to call while the
+    listener and the bot are running.
+    """
+    chats = dict(listener.chats)
+    state = {
+        'version': SNAPSHOT_VERSION,
+        'created_at': time.time(),
+        'chats': chats,
+        'messages': {chat_id: listener.messages.tail(chat_id, tail)
+                     for chat_id in chats},
+        # Least recently seen first, as the directory keeps them.
+        'users': [(user_id, listener.users.get(user_id))
+                  for user_id in listener.users],
+        'readers': {},
+    }
+    if logic is not None:
+        for reader_id, reader in list(logic.readers.items()):
+            state['readers'][reader_id] = (
+                reader.latest, dict(reader.unsub_time))
+    return state
+
+
+def restore(state, listener, logic=None):
+    """
+    Load a snapshot into a listener that has not started yet.
+    """
+    for chat_id, chat_info in state['chats'].items():
+        listener.chats[chat_id] = chat_info
+        listener.chat_index.update(chat_id, chat_info)
+    for chat_id, messages in state['messages'].items():
+        listener.messages.restore(chat_id, messages)
+        if messages:
+            listener.hot.observe(chat_id, messages)
+    for user_id, name in state['users']:
+        if name is not None:
+            listener.users.see(user_id, {user_id: {'name': name}})
+    if logic is not None:
+        for reader_id, (latest, unsub_time) in state['readers'].items():
+            reader = logic.readers[reader_id]
+            reader.latest = latest
+            reader.unsub_time.update(unsub_time)
+    listener.is_initialized = True
+
+
+def write(path, state):
+    """
+    Replace the snapshot at path atomically.
+    """
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as outf:
+        outf.write(data)
+        outf.flush()
+        os.fsync(outf.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+def load(path, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Read the snapshot at path, None if it is missing,
+    unreadable or older than max_age.
+    """
+    try:
+        with open(path, "rb") as inf:
+            state = pickle.loads(zlib.decompress(inf.read()))
+    except FileNotFoundError:
+        return None
+    except Exception:
+        traceback.print_exc()
+        return None
+    if state.get('version') != SNAPSHOT_VERSION:
+        print("Unknown snapshot version {}".format(state.get('version')))
+        return None
+    age = time.time() - state['created_at']
+    if age > max_age.total_seconds():
+        print("Snapshot is {:.0f} s old, starting cold".format(age))
+        return None
+    return state
+
+
+class Snapshotter():
+    """
+    Writes snapshots of listener and logic state every `interval`
+    on a daemon thread, and once more on stop.
+    """
+    def __init__(self, listener, logic=None, path=SNAPSHOT_PATH,
+                 interval=SNAPSHOT_INTERVAL):
+        self.listener = listener
+        self.logic = logic
+        self.path = path
+        self.interval = interval.total_seconds()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def restore(self, max_age=SNAPSHOT_MAX_AGE):
+        """
+        Warm start from the saved snapshot.
+        Returns False if there is none to start from.
+        """
+        state = load(self.path, max_age)
+        if state is None:
+            return False
+        restore(state, self.listener, self.logic)
+        print("Restored {} chats from {}".format(
+            len(state['chats']), self.path))
+        return True
+
+    def save(self):
+        if not self.listener.chats:
+            # Nothing worth replacing a previous snapshot with.
+            return 0
+        return write(self.path, take(self.listener, self.logic))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="snapshot", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.save()
@@ -0,0 +1,198 @@
+# coding utf-8
+
+import contextlib
+import datetime
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+
+FLUSH_INTERVAL = datetime.timedelta(seconds=1)
+MAX_BATCH_SIZE = 1000
+# Command log records older than that are deleted...
+EVENT_RETENTION = datetime.timedelta(days=30)
+# ...that often.
+TRIM_INTERVAL = datetime.timedelta(hours=1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    reader_id INTEGER NOT NULL,
+    chat_id TEXT NOT NULL,
+    subscribed INTEGER NOT NULL,
+    unsub_time INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (reader_id, chat_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS events (
+    created_at REAL NOT NULL,
+    user_id INTEGER,
+    action TEXT NOT NULL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS events_created_at ON events (created_at);
+"""
+
+_UPSERT = """
+INSERT OR REPLACE INTO subscriptions
+    (reader_id, chat_id, subscribed, unsub_time, updated_at)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+_INSERT_EVENT = """
+INSERT INTO events (created_at, user_id, action, payload) VALUES (?, ?, ?, ?)
+"""
+
+_FORGET_CHAT = "DELETE FROM subscriptions WHERE chat_id = ?"
+
+_TRIM_EVENTS = "DELETE FROM events WHERE created_at < ?"
+
+
+class SubscriptionStore():
+    """
+    SQLite (WAL mode) store of reader subscriptions, keyed by
+    (reader_id, chat_id), plus a log of tracked bot commands.
+
+    Writes are queued and committed in batches by a background thread,
+    so callers never wait for the disk. Subscriptions to ended chats
+    are deleted with forget_chats, log records after event_retention.
+    """
+    def __init__(self, path="meduzach.sqlite3",
+                 flush_interval=FLUSH_INTERVAL,
+                 event_retention=EVENT_RETENTION):
+        self.path = path
+        self.flush_interval = flush_interval.total_seconds()
+        self.event_retention = event_retention.total_seconds()
+        self._trimmed_at = None
+        self._queue = queue.Queue()
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executescript(_SCHEMA)
+        self._writer = threading.Thread(
+            target=self._write_loop, name="subscription-store", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def save(self, reader_id, chat_id, subscribed, unsub_time=0):
+        """
+        Queue the current subscription state of reader to chat.
+        """
+        self._queue.put((_UPSERT, (
+            reader_id, chat_id, int(subscribed), unsub_time, time.time())))
+
+    def track(self, user_id, action, payload=None):
+        """
+        Queue a record of a bot command.
+        """
+        self._queue.put((_INSERT_EVENT, (
+            time.time(), user_id, action,
+            None if payload is None else str(payload))))
+
+    def forget_chats(self, chat_ids):
+        """
+        Queue deletion of every subscription to chats that have ended.
+        """
+        for chat_id in chat_ids:
+            self._queue.put((_FORGET_CHAT, (chat_id, )))
+
+    def load(self):
+        """
+        Return all subscriptions as a list of
+        (reader_id, chat_id, subscribed, unsub_time) tuples.
+        """
+        with contextlib.closing(self._connect()) as conn, conn:
+            return [
+                (reader_id, chat_id, bool(subscribed), unsub_time)
+                for reader_id, chat_id, subscribed, unsub_time
+                in conn.execute(
+                    "SELECT reader_id, chat_id, subscribed, unsub_time "
+                    "FROM subscriptions")]
+
+    def is_empty(self):
+        with contextlib.closing(self._connect()) as conn, conn:
+            return conn.execute(
+                "SELECT 1 FROM subscriptions LIMIT 1").fetchone() is None
+
+    def flush(self):
+        """
+        Block until everything queued so far is committed.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Commit queued writes and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            if batch[0] is None:
+                conn.close()
+                self._queue.task_done()
+                return
+            # Let writes pile up a little, then commit them together.
+            time.sleep(self.flush_interval)
+            while len(batch) < MAX_BATCH_SIZE:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Put the stop request back for the next round.
+                    self._queue.task_done()
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            try:
+                with conn:
+                    for statement, params in batch:
+                        conn.execute(statement, params)
+                    self._trim_events(conn)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _trim_events(self, conn):
+        now = time.time()
+        if (self._trimmed_at is not None and
+                now - self._trimmed_at < TRIM_INTERVAL.total_seconds()):
+            return
+        self._trimmed_at = now
+        conn.execute(_TRIM_EVENTS, (now - self.event_retention, ))
+
+    def import_track_file(self, path="track.txt",
+                          max_age=datetime.timedelta(days=1)):
+        """
+        One-off migration of subscriptions from the old track.txt log.
+        """
+        earliest = datetime.datetime.now() - max_age
+        state = {}
+        with open(path) as infile:
+            for line in infile:
+                try:
+                    date, user, action, chat_id = line.split()
+                    date = datetime.datetime.strptime(
+                        date, "%d/%m/%y_%H:%M")
+                    reader_id = int(user)
+                except ValueError:
+                    continue
+                if action not in ("sub", "unsub") or chat_id == "None":
+                    continue
+                if date > earliest:
+                    state[(reader_id, chat_id)] = action == "sub"
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.executemany(_UPSERT, [
+                (reader_id, chat_id, int(subscribed), 0, now)
+                for (reader_id, chat_id), subscribed in state.items()])
+        return len(state)
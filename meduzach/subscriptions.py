@@ -0,0 +1,85 @@
+# coding utf-8
+
+import threading
+
+from meduzach.metrics import TimedLock, LOCK_WAIT
+
+SHARDS = 64
+
+
+class SubscriptionRegistry():
+    """
+    Reader <-> chat subscriptions.
+
+    Both directions are indexed by sets. Changes of a chat's
+    subscriptions are serialized by the lock of its shard,
+    so unrelated chats never wait for each other.
+    """
+    def __init__(self, shards=SHARDS):
+        self._locks = [TimedLock(threading.RLock(), LOCK_WAIT)
+                       for _ in range(shards)]
+        self._readers = {}
+        self._chats = {}
+
+    def lock(self, chat_id):
+        """
+        Lock guarding subscriptions of chat_id.
+
+        Hold it to make check-then-change sequences atomic.
+        """
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+    def subscribe(self, reader_id, chat_id):
+        """
+        Returns False if reader_id was already subscribed.
+        """
+        with self.lock(chat_id):
+            readers = self._readers.setdefault(chat_id, set())
+            if reader_id in readers:
+                return False
+            readers.add(reader_id)
+            self.chats(reader_id).add(chat_id)
+            return True
+
+    def unsubscribe(self, reader_id, chat_id):
+        """
+        Returns False if reader_id was not subscribed.
+        """
+        with self.lock(chat_id):
+            readers = self._readers.get(chat_id)
+            if not readers or reader_id not in readers:
+                return False
+            readers.discard(reader_id)
+            if not readers:
+                del self._readers[chat_id]
+            self.chats(reader_id).discard(chat_id)
+            return True
+
+    def is_subscribed(self, reader_id, chat_id):
+        return reader_id in self._readers.get(chat_id, ())
+
+    def readers(self, chat_id):
+        """
+        Snapshot of chat_id subscribers, safe to iterate
+        while subscriptions change.
+        """
+        with self.lock(chat_id):
+            return frozenset(self._readers.get(chat_id, ()))
+
+    def chats(self, reader_id):
+        """
+        Live set of chats reader_id is subscribed to.
+        """
+        chats = self._chats.get(reader_id)
+        if chats is None:
+            chats = self._chats.setdefault(reader_id, set())
+        return chats
+
+    def subscriber_count(self, chat_id):
+        return len(self._readers.get(chat_id, ()))
+
+    def __len__(self):
+        """
+        Number of chats with subscribers.
+        """
+        return len(self._readers)
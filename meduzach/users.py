@@ -0,0 +1,96 @@
+# coding utf-8
+
+import collections
+import datetime
+import sys
+import time
+
+MAX_USERS = 20000
+# Same as message history age, users outlive the messages they wrote
+USER_TTL = datetime.timedelta(hours=8)
+
+
+class UserEntry():
+    __slots__ = ('name', 'seen')
+
+    def __init__(self, name, seen):
+        self.name = name
+        self.seen = seen
+
+
+class UserDirectory():
+    """
+    Compact user id -> name table.
+
+    Only names are kept, interned, so every message of an author
+    shares one string. Users are refreshed when they write or are
+    replied to; those not seen for `ttl`, and the least recently
+    seen beyond `max_size`, are evicted.
+    """
+    def __init__(self, max_size=MAX_USERS, ttl=USER_TTL, now=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl.total_seconds()
+        self._now = now
+        self._entries = collections.OrderedDict()
+
+    def see(self, user_id, names=None):
+        """
+        Mark user_id as active and return its name.
+
+        `names` is the users mapping of a frame, {user_id: {'name': ...}}.
+        Unknown users are named by their id.
+        """
+        entry = self._entries.get(user_id)
+        info = names.get(user_id) if names else None
+        if info is not None and info.get('name') is not None:
+            name = info['name']
+            if entry is not None and entry.name == name:
+                name = entry.name
+            else:
+                name = sys.intern(name)
+        elif entry is not None:
+            name = entry.name
+        else:
+            name = str(user_id)
+        if entry is None:
+            self._entries[user_id] = UserEntry(name, self._now())
+        else:
+            entry.name = name
+            entry.seen = self._now()
+            self._entries.move_to_end(user_id)
+        return name
+
+    def expire(self):
+        """
+        Evict users over the size limit or not seen for too long.
+        Returns the number evicted.
+        """
+        evicted = 0
+        oldest_allowed = self._now() - self.ttl
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if (len(self._entries) <= self.max_size and
+                    entry.seen >= oldest_allowed):
+                break
+            del self._entries[user_id]
+            evicted += 1
+        return evicted
+
+    def get(self, user_id, default=None):
+        """
+        Name of user_id, without refreshing it.
+        """
+        entry = self._entries.get(user_id)
+        return default if entry is None else entry.name
+
+    def __getitem__(self, user_id):
+        return self._entries[user_id].name
+
+    def __contains__(self, user_id):
+        return user_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(list(self._entries))
@@ -0,0 +1,148 @@
+# coding utf-8
+"""
+Webhook endpoint for Telegram updates.
+
+Telegram POSTs every update to the webhook url as JSON. Requests
+are handled on their own threads, which parse the update and put
+it on the dispatcher's queue, so the dispatcher only runs handlers.
+The server speaks plain HTTP, TLS is left to a reverse proxy.
+"""
+
+import http.server
+import json
+import signal
+import socketserver
+import threading
+import traceback
+import urllib.parse
+
+import telegram
+from telegram.error import TelegramError
+
+WEBHOOK_HOST = "127.0.0.1"
+WEBHOOK_PORT = 8443
+# Telegram sends small JSON documents, anything bigger is not an update.
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http.server.HTTPServer):
+    daemon_threads = True
+
+
+class WebhookServer():
+    """
+    Puts updates POSTed to http://host:port/path on update_queue.
+
+    Keep path secret (e.g. derived from the token), anybody who
+    knows it can send the bot commands on behalf of any reader.
+    """
+    def __init__(self, update_queue, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                 path="/"):
+        self.update_queue = update_queue
+        self.path = path
+        self.dispatcher = None
+        self.received = 0
+        self._server = _ThreadingHTTPServer(
+            (host, port), self._handler_class())
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+        self._dispatcher_thread = None
+
+    def _handler_class(self):
+        webhook = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path.split("?")[0] != webhook.path:
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                if length > MAX_BODY_SIZE:
+                    self.send_error(413)
+                    return
+                try:
+                    update = telegram.Update.de_json(
+                        json.loads(self.rfile.read(length).decode()))
+                except Exception:
+                    traceback.print_exc()
+                    self.send_error(400)
+                    return
+                webhook.update_queue.put(update)
+                webhook.received += 1
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="webhook", daemon=True)
+        self._thread.start()
+        return self
+
+    def start_dispatcher(self, dispatcher):
+        """
+        Run dispatcher on the queued updates until the server stops.
+        """
+        self.dispatcher = dispatcher
+        self._dispatcher_thread = threading.Thread(
+            target=dispatcher.start, name="dispatcher", daemon=True)
+        self._dispatcher_thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        if self._dispatcher_thread is not None:
+            self.dispatcher.stop()
+            self._dispatcher_thread.join()
+            self._dispatcher_thread = None
+
+
+def start_webhook(updater, url, host=WEBHOOK_HOST, port=WEBHOOK_PORT):
+    """
+    Receive updater's updates at url instead of polling.
+
+    url is the public address Telegram posts to, a proxy
+    forwards it to host:port keeping the path. Returns the
+    server, None if it could not be started or registered,
+    so the caller can fall back to polling.
+
+    Updater.stop() does not know about the server,
+    stop it and its dispatcher with server.stop().
+    """
+    try:
+        server = WebhookServer(updater.update_queue, host, port,
+                               urllib.parse.urlsplit(url).path or "/")
+    except OSError as exc:
+        print("Webhook is not served: {}".format(exc))
+        return None
+    server.start()
+    try:
+        updater.bot.setWebhook(webhook_url=url)
+    except TelegramError:
+        traceback.print_exc()
+        server.stop()
+        return None
+    server.start_dispatcher(updater.dispatcher)
+    return server
+
+
+def wait_for_signal(stop_signals=(signal.SIGINT, signal.SIGTERM, signal.SIGABRT)):
+    """
+    Block until one of stop_signals is received.
+
+    Unlike Updater.idle() it stops nothing, and does not exit
+    right away when the updater is not polling.
+    """
+    stopped = threading.Event()
+    for sig in stop_signals:
+        signal.signal(sig, lambda signum, frame: stopped.set())
+    while not stopped.wait(1):
+        pass
@@ -0,0 +1,76 @@
+# coding utf-8
+
+import asyncio
+import datetime
+import threading
+import unittest
+import unittest.mock as mock
+from meduzach.async_meduzach import AsyncMeduzach, SendScheduler
+from tests.data_example import examples
+from tests.test_meduzach import FakeWs, FakeWsFinException, SilentWs
+
+
+class TestSendScheduler(unittest.TestCase):
+    def test_spacing(self):
+        loop = asyncio.new_event_loop()
+        scheduler = SendScheduler(0.05)
+        times = []
+
+        async def _send():
+            await scheduler.acquire()
+            times.append(loop.time())
+
+        async def _main():
+            await asyncio.gather(_send(), _send(), _send())
+
+        loop.run_until_complete(_main())
+        loop.close()
+
+        self.assertEqual(3, len(times))
+        self.assertGreaterEqual(times[1] - times[0], 0.04)
+        self.assertGreaterEqual(times[2] - times[1], 0.04)
+
+
+class TestAsyncMeduzach(unittest.TestCase):
+    def test_run(self):
+        m = AsyncMeduzach()
+        m.slowmode = False
+        updated = []
+        m.connect('chat_updated',
+                  lambda sender, payload: updated.append(payload[0]))
+        with mock.patch('websocket.WebSocket',
+                        lambda **kwargs: FakeWs(examples)):
+            with self.assertRaises(FakeWsFinException):
+                m.run(recover=False)
+        self.assertIn('328', updated)
+        self.assertEqual(18, len(m.chats))
+
+    def test_dead_connection(self):
+        m = AsyncMeduzach()
+        m.slowmode = False
+        m.keepalive.timeout = 0.05
+        sockets = []
+
+        def _connect():
+            sockets.append(SilentWs())
+            return sockets[-1]
+
+        errors = []
+
+        def _run():
+            try:
+                m.run(recover=False)
+            except Exception as exc:
+                errors.append(exc)
+
+        with mock.patch('websocket.WebSocket',
+                        lambda **kwargs: _connect()), \
+                mock.patch('meduzach.async_meduzach.KEEPALIVE_TICK',
+                           datetime.timedelta(seconds=0.01)):
+            thread = threading.Thread(target=_run, daemon=True)
+            thread.start()
+            thread.join(5)
+        # Cleanup must not wait for the reader blocked in recv.
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(errors[0], ConnectionError)
+        self.assertEqual('heartbeat', sockets[0].sent[0]['event'])
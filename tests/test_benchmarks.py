@@ -0,0 +1,28 @@
+# coding utf-8
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks import run
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_smoke(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output = os.path.join(tmpdir, 'bench.json')
+        args = ['--chats', '3', '--messages', '2', '--subscribers', '2',
+                '--number', '1', '--repeat', '1', '--output', output]
+        run.main(args)
+        run.main(args[:-2] + ['--compare', output])
+
+        with open(output) as infile:
+            results = json.load(infile)
+        self.assertEqual(
+            ['recorded_route', 'route_lobby', 'update_chats',
+             'update_messages', 'format_messages', 'fanout'],
+            [r['name'] for r in results['results']])
+        self.assertEqual({'subscribers': 2, 'messages': 2},
+                         results['results'][-1]['params'])
@@ -0,0 +1,58 @@
+# coding utf-8
+
+import unittest
+from meduzach.channels import ChannelRegistry
+
+
+class TestChannelRegistry(unittest.TestCase):
+    def test_join_reply(self):
+        r = ChannelRegistry()
+        r.join('1', 'topic:a', '5')
+        r.join('2', 'topic:b', '6')
+        self.assertEqual(2, r.pending)
+        self.assertTrue(r.is_joining('1'))
+
+        self.assertEqual(
+            ('2', True),
+            r.resolve({'topic': 'topic:b', 'ref': '6',
+                       'event': 'phx_reply'}))
+        self.assertEqual(1, r.pending)
+        self.assertTrue(r.is_joined('2'))
+        self.assertFalse(r.is_joined('1'))
+
+    def test_ref_of_other_topic(self):
+        r = ChannelRegistry()
+        r.join('1', 'topic:a', '5')
+        self.assertEqual(
+            (None, False),
+            r.resolve({'topic': 'topic:b', 'ref': '5',
+                       'event': 'phx_reply'}))
+        self.assertEqual(1, r.pending)
+
+    def test_push(self):
+        r = ChannelRegistry()
+        r.join('1', 'topic:a', '5')
+        self.assertEqual(
+            ('1', False),
+            r.resolve({'topic': 'topic:a', 'ref': None,
+                       'event': 'new_msg'}))
+
+    def test_close_and_leave(self):
+        r = ChannelRegistry()
+        r.join('1', 'topic:a', '5')
+        r.resolve({'topic': 'topic:a', 'ref': '5', 'event': 'phx_reply'})
+        self.assertEqual('1', r.closed('topic:a'))
+        self.assertFalse(r.is_joined('1'))
+        self.assertEqual('topic:a', r.leave('1'))
+        self.assertIsNone(r.leave('1'))
+        self.assertEqual(
+            (None, False),
+            r.resolve({'topic': 'topic:a', 'ref': None,
+                       'event': 'new_msg'}))
+
+    def test_expire(self):
+        r = ChannelRegistry()
+        r.join('1', 'topic:a', '5')
+        self.assertEqual([], r.expire(100))
+        self.assertEqual(['1'], r.expire(-1))
+        self.assertEqual(0, r.pending)
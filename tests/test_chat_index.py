@@ -0,0 +1,29 @@
+# coding utf-8
+
+import unittest
+from meduzach.chat_index import ChatIndex
+
+
+def _chat(last_message_at):
+    return {'title': 't', 'messages_count': 1,
+            'last_message_at': last_message_at}
+
+
+class TestChatIndex(unittest.TestCase):
+    def test_order(self):
+        index = ChatIndex()
+        index.update('1', _chat(10))
+        index.update('2', _chat(30))
+        index.update('3', _chat(20))
+        self.assertEqual(['2', '3', '1'],
+                         [c for c, _ in index.snapshot()[1]])
+
+        index.update('1', _chat(40))
+        index.remove('2')
+        index.remove('100')
+        version, chats = index.snapshot()
+        self.assertEqual(['1', '3'], [c for c, _ in chats])
+        self.assertEqual(5, version)
+        self.assertEqual(2, len(index))
+        self.assertIn('3', index)
+        self.assertNotIn('2', index)
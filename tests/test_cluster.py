@@ -0,0 +1,69 @@
+# coding utf-8
+
+import datetime
+import json
+import multiprocessing
+import pickle
+import unittest
+import unittest.mock as mock
+from telegram import Update, Message, Chat, User
+from benchmarks import synthetic
+from meduzach import frames
+from meduzach.cluster import partition, Publisher, Worker
+from meduzach.meduzach import Meduzach
+
+
+def _update(chat_id, text):
+    msg = Message(1, User(chat_id, 'reader'), datetime.datetime.now(),
+                  Chat(chat_id, 'private'), text=text)
+    return Update(1, message=msg)
+
+
+class TestCluster(unittest.TestCase):
+    def test_partition(self):
+        self.assertEqual(partition(123, 4), partition('123', 4))
+        self.assertEqual({0, 1, 2},
+                         {partition(i, 3) for i in range(100)})
+
+    def _receive(self, reader, count):
+        return [pickle.loads(reader.recv_bytes()) for _ in range(count)]
+
+    def test_publish_to_worker(self):
+        listener = Meduzach()
+        listener._queue_chat_update = lambda chat_id: None
+        readers, pipes = zip(*(multiprocessing.Pipe(duplex=False)
+                               for _ in range(2)))
+        publisher = Publisher(listener, pipes)
+
+        chat_id = str(synthetic.FIRST_CHAT_ID)
+        factory = synthetic.MessageFactory()
+        listener.update_chats(json.loads(synthetic.lobby_frame({
+            synthetic.FIRST_CHAT_ID: 3})))
+        listener.update_messages(frames.project(json.loads(
+            factory.new_msg(chat_id, 3))))
+        publisher.initialized()
+
+        # Every worker gets the same broadcast
+        events = [self._receive(reader, 3) for reader in readers]
+        self.assertEqual(events[0], events[1])
+
+        bot = mock.MagicMock()
+        worker = Worker(bot)
+        worker.logic.settings['track'] = False
+        for event in events[0]:
+            worker.handle(event)
+        self.assertEqual(3, len(worker.listener.messages[chat_id]))
+        self.assertTrue(worker.listener.is_initialized)
+
+        # Commands go to the owning worker only
+        reader_id = 42
+        publisher.forward(_update(reader_id, '/' + chat_id))
+        owner = readers[partition(reader_id, 2)]
+        other = readers[1 - partition(reader_id, 2)]
+        worker.handle(self._receive(owner, 1)[0])
+        self.assertFalse(other.poll(0.1))
+        self.assertIn(chat_id, worker.logic.readers[reader_id].chats)
+
+        worker.handle_update(_update(reader_id, '/chats'))
+        self.assertTrue(bot.sendMessage.call_args[1]['text'].startswith(
+            '/{} [+]'.format(chat_id)))
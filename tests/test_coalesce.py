@@ -0,0 +1,109 @@
+# coding utf-8
+
+import datetime
+import threading
+import unittest
+from meduzach.coalesce import Coalescer
+from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.chat_index import ChatIndex
+from meduzach.connections import Connector
+
+
+class FakeClock():
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def _messages(*ids):
+    return [{"id": i, "author": "a", "text": str(i), "reply_to": None}
+            for i in ids]
+
+
+class TestCoalescer(unittest.TestCase):
+    def setUp(self):
+        # The flush thread is not started, tests call flush().
+        self.clock = FakeClock()
+        self.source = Connector()
+        self.c = Coalescer(self.source,
+                           window=datetime.timedelta(seconds=3),
+                           max_delay=datetime.timedelta(seconds=10),
+                           now=self.clock)
+        self.updates = []
+        self.c.connect('chat_updated',
+                       lambda sender, payload: self.updates.append(payload))
+
+    def tearDown(self):
+        self.c.stop()
+
+    def test_burst_merged(self):
+        self.source.emit('chat_updated', ('1', _messages(1)))
+        self.clock.time = 2
+        self.source.emit('chat_updated', ('1', _messages(2, 3)))
+        self.source.emit('chat_updated', ('2', _messages(4)))
+        self.assertEqual(3, self.c.flush())
+        self.assertEqual([], self.updates)
+        self.clock.time = 5
+        self.assertIsNone(self.c.flush())
+        self.assertEqual(2, len(self.updates))
+        chat_id, messages = self.updates[0]
+        self.assertEqual('1', chat_id)
+        self.assertEqual([1, 2, 3], [m['id'] for m in messages])
+        self.assertEqual(1, self.c.merged)
+
+    def test_max_delay(self):
+        for t in range(0, 12, 2):
+            self.clock.time = t
+            self.source.emit('chat_updated', ('1', _messages(t)))
+            self.c.flush()
+        self.assertEqual(1, len(self.updates))
+        self.assertEqual([0, 2, 4, 6, 8, 10],
+                         [m['id'] for m in self.updates[0][1]])
+
+    def test_stop_flushes(self):
+        self.source.emit('chat_updated', ('1', _messages(1)))
+        self.c.stop()
+        self.assertEqual(1, len(self.updates))
+
+
+class TestCoalescerThread(unittest.TestCase):
+    def test_flushed_after_window(self):
+        source = Connector()
+        c = Coalescer(source, window=datetime.timedelta(seconds=0.05))
+        c.start()
+        flushed = threading.Event()
+        c.connect('chat_updated', lambda sender, payload: flushed.set())
+        source.emit('chat_updated', ('1', _messages(1)))
+        self.assertTrue(flushed.wait(5))
+        c.stop()
+
+
+class TestChatbotLogicCoalescing(unittest.TestCase):
+    def _listener(self):
+        listener = Connector()
+        listener.chat_index = ChatIndex()
+        return listener
+
+    def test_off_by_default(self):
+        listener = self._listener()
+        logic = ChatbotLogic(listener, None)
+        self.assertIsNone(logic.coalescer)
+        self.assertEqual(1, len(listener.connections['chat_updated']))
+
+    def test_coalesce(self):
+        listener = self._listener()
+        logic = ChatbotLogic(listener, None)
+        logic.coalesce(datetime.timedelta(seconds=1))
+        self.assertIsNotNone(logic.coalescer)
+        # Only the coalescer listens to the listener now
+        self.assertEqual(1, len(listener.connections['chat_updated']))
+        self.assertEqual(
+            1, len(logic.coalescer.connections['chat_updated']))
+        coalescer = logic.coalescer
+        logic.coalesce(datetime.timedelta(seconds=2))
+        self.assertIs(coalescer, logic.coalescer)
+        self.assertEqual(2, coalescer.window)
+        self.assertEqual(1, len(listener.connections['chat_updated']))
+        logic.stop(5)
@@ -1,4 +1,9 @@
+import asyncio
+import threading
+import time
 import unittest
+from meduzach import connections
+from meduzach import metrics
 from meduzach.connections import Connector
 
 
@@ -61,3 +66,124 @@ class TestConnector(unittest.TestCase):
         self.assertEqual(abc,
                          ['abc_data', 'abc_data2', 'abc_data32'],
                          c.connections)
+
+    def test_disconnect_unknown(self):
+        c = Connector()
+        conn_id = c.connect('abc', lambda sender, data: None)
+        self.assertTrue(c.disconnect(conn_id))
+        self.assertFalse(c.disconnect(conn_id))
+        self.assertFalse(c.disconnect(100))
+        self.assertEqual({}, c.connections['abc'])
+
+    def test_queued(self):
+        c = Connector()
+        received = []
+        threads = []
+
+        def handle(sender, data):
+            threads.append(threading.current_thread())
+            received.append(data)
+
+        conn_id = c.connect('abc', handle, mode=connections.QUEUED)
+        for i in range(100):
+            c.emit('abc', i)
+        self.assertTrue(c.slot(conn_id).join(5))
+        c.disconnect(conn_id)
+        self.assertEqual(list(range(100)), received)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_queued_join_waits_for_handler(self):
+        c = Connector()
+        received = []
+
+        def handle(sender, data):
+            time.sleep(0.05)
+            received.append(data)
+
+        conn_id = c.connect('abc', handle, mode=connections.QUEUED)
+        c.emit('abc', 1)
+        self.assertTrue(c.slot(conn_id).join(5))
+        self.assertEqual([1], received)
+        c.disconnect(conn_id)
+
+    def _blocked_slot(self, overflow):
+        c = Connector()
+        release = threading.Event()
+        received = []
+
+        def handle(sender, data):
+            release.wait(5)
+            received.append(data)
+
+        conn_id = c.connect('abc', handle, mode=connections.QUEUED,
+                            maxsize=2, overflow=overflow)
+        c.emit('abc', 0)
+        slot = c.slot(conn_id)
+        # Wait until the worker holds the first item
+        while slot._queue:
+            release.wait(0.01)
+        for i in range(1, 5):
+            c.emit('abc', i)
+        release.set()
+        slot.join(5)
+        while len(received) < 3:
+            release.wait(0.01)
+        self.assertEqual(2, slot.dropped)
+        return received
+
+    def test_drop_new(self):
+        self.assertEqual([0, 1, 2], self._blocked_slot(connections.DROP_NEW))
+
+    def test_drop_oldest(self):
+        self.assertEqual([0, 3, 4],
+                         self._blocked_slot(connections.DROP_OLDEST))
+
+    def test_block_measured(self):
+        c = Connector()
+        release = threading.Event()
+        c.connect('block-measured', lambda sender, data: release.wait(5),
+                  mode=connections.QUEUED, maxsize=1)
+        c.emit('block-measured', 0)
+        slot = c.slot(0)
+        while slot._queue:
+            release.wait(0.01)
+        c.emit('block-measured', 1)
+        emitter = threading.Thread(
+            target=c.emit, args=('block-measured', 2))
+        emitter.start()
+        time.sleep(0.05)
+        release.set()
+        emitter.join(5)
+        self.assertTrue(slot.join(5))
+        self.assertGreaterEqual(
+            metrics.SLOT_BLOCKED.value(signal='block-measured'), 0.04)
+        self.assertIn(
+            'meduzach_slot_queue_length{signal="block-measured"} 0',
+            metrics.SLOT_QUEUE.render())
+
+    def test_async(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        c = Connector()
+        received = []
+
+        async def handle(sender, data):
+            received.append(data)
+
+        c.connect('abc', handle, mode=connections.ASYNC, loop=loop)
+        c.connect('abc', lambda sender, data: received.append(data * 10),
+                  mode=connections.ASYNC, loop=loop)
+        emitter = threading.Thread(
+            target=lambda: [c.emit('abc', i) for i in range(1, 4)])
+        emitter.start()
+        emitter.join()
+        loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual([1, 2, 3], sorted(d for d in received if d < 10))
+        self.assertEqual([10, 20, 30], sorted(d for d in received if d >= 10))
+
+    def test_bad_mode(self):
+        c = Connector()
+        with self.assertRaises(ValueError):
+            c.connect('abc', print, mode='unknown')
+        with self.assertRaises(ValueError):
+            c.connect('abc', print, mode=connections.ASYNC)
@@ -0,0 +1,116 @@
+# coding utf-8
+
+import threading
+import time
+import unittest
+import unittest.mock as mock
+from telegram.error import TelegramError, Unauthorized
+from meduzach.delivery import DeliveryScheduler, TokenBucket, retry_after
+
+
+class FakeBot():
+    def __init__(self, failures=None):
+        self.sent = []
+        self.failures = failures or {}
+        self.lock = threading.Lock()
+
+    def sendMessage(self, chat_id, text, parse_mode=None):
+        with self.lock:
+            failure = self.failures.pop((chat_id, text), None)
+            if failure is not None:
+                raise failure
+            self.sent.append((chat_id, text))
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        b = TokenBucket(2, 2, now=0)
+        self.assertEqual(0, b.delay(0))
+        b.consume(0)
+        b.consume(0)
+        self.assertAlmostEqual(0.5, b.delay(0))
+        self.assertEqual(0, b.delay(0.5))
+        b.delay(10)
+        self.assertEqual(2, b.tokens)
+
+    def test_penalize(self):
+        b = TokenBucket(1, 3, now=0)
+        b.penalize(5, 0)
+        self.assertAlmostEqual(5, b.delay(0))
+
+    def test_retry_after(self):
+        self.assertEqual(
+            7, retry_after(TelegramError("Too Many Requests: retry after 7")))
+        self.assertIsNone(retry_after(TelegramError("Bad Request")))
+
+
+class TestDeliveryScheduler(unittest.TestCase):
+    def _scheduler(self, bot, **kwargs):
+        d = DeliveryScheduler(
+            bot, workers=3, global_rate=1000, global_burst=1000,
+            per_chat_rate=1000, per_chat_burst=1000, **kwargs)
+        d.start()
+        self.addCleanup(d.stop)
+        return d
+
+    def test_order_per_reader(self):
+        bot = FakeBot()
+        d = self._scheduler(bot)
+        for i in range(20):
+            for reader_id in (1, 2, 3):
+                d.send(reader_id, str(i))
+        self.assertTrue(d.join(5))
+        for reader_id in (1, 2, 3):
+            self.assertEqual(
+                [str(i) for i in range(20)],
+                [text for r, text in bot.sent if r == reader_id])
+
+    def test_fair(self):
+        bot = FakeBot()
+        d = DeliveryScheduler(
+            bot, workers=1, global_rate=1000, global_burst=1000,
+            per_chat_rate=1000, per_chat_burst=1000)
+        for i in range(5):
+            d.send(1, str(i))
+        d.send(2, 'x')
+        d.start()
+        self.addCleanup(d.stop)
+        self.assertTrue(d.join(5))
+        self.assertLess(bot.sent.index((2, 'x')), 2)
+
+    def test_unauthorized(self):
+        bot = FakeBot({(1, 'a'): Unauthorized()})
+        on_error = mock.MagicMock()
+        d = self._scheduler(bot, on_error=on_error)
+        d.send(1, 'a')
+        d.send(2, 'b')
+        self.assertTrue(d.join(5))
+        self.assertEqual([(2, 'b')], bot.sent)
+        on_error.assert_called_once()
+        self.assertEqual(1, on_error.call_args[0][0])
+
+    def test_retry(self):
+        bot = FakeBot({(1, 'a'): TelegramError("retry after 0")})
+        d = self._scheduler(bot)
+        d.send(1, 'a')
+        d.send(1, 'b')
+        self.assertTrue(d.join(5))
+        self.assertEqual([(1, 'a'), (1, 'b')], bot.sent)
+
+    def test_buckets_forgotten(self):
+        bot = FakeBot()
+        d = DeliveryScheduler(
+            bot, workers=1, global_rate=1000, global_burst=1000,
+            per_chat_rate=1000, per_chat_burst=10)
+        for reader_id in range(5):
+            d.send(reader_id, 'x')
+        d.discard(0)
+        self.assertNotIn(0, d._buckets)
+        d.start()
+        self.addCleanup(d.stop)
+        self.assertTrue(d.join(5))
+        self.assertEqual(4, len(bot.sent))
+        time.sleep(0.05)
+        with d._cond:
+            d._prune_buckets(time.monotonic())
+            self.assertEqual({}, d._buckets)
@@ -0,0 +1,50 @@
+# coding utf-8
+
+import json
+import unittest
+from meduzach import frames
+from meduzach.meduzach import Meduzach
+from tests.data_example import examples
+
+
+class TestFrames(unittest.TestCase):
+    def test_peek(self):
+        for raw in examples:
+            parsed = json.loads(raw)
+            self.assertEqual((parsed['topic'], parsed['event']),
+                             frames.peek(raw))
+        self.assertEqual((None, None), frames.peek('{"ref":1}'))
+
+    def test_skip_unwanted(self):
+        self.assertIsNone(frames.decode(examples[0]))
+        self.assertIsNone(frames.decode(
+            '{"topic":"topic:abc","ref":null,"payload":{},'
+            '"event":"presence_diff"}'))
+        self.assertIsNotNone(frames.decode(examples[9]))
+
+    def test_lobby_projection(self):
+        decoded = frames.decode(examples[1])
+        self.assertNotIn('users', decoded['payload'])
+        self.assertEqual(
+            set(frames.CHAT_FIELDS),
+            set(decoded['payload']['chats']['313'].keys()))
+
+    def test_same_as_full_parse(self):
+        def _updates(response):
+            m = Meduzach()
+            m.update_chats(json.loads(examples[1]))
+            calls = []
+            m.connect('chat_updated',
+                      lambda sender, payload: calls.append(payload))
+            m.update_messages(response)
+            return calls, m.chats
+
+        self.assertEqual(_updates(json.loads(examples[6])),
+                         _updates(frames.decode(examples[6])))
+
+    def test_repeated_lobby_skipped(self):
+        m = Meduzach()
+        self.assertIsNotNone(m.decode(examples[1]))
+        interval = m.lobby_poll.interval
+        self.assertIsNone(m.decode(examples[2]))
+        self.assertGreater(m.lobby_poll.interval, interval)
@@ -0,0 +1,101 @@
+# coding utf-8
+
+import datetime
+import unittest
+from meduzach.history import ChatHistory, MessageStore
+
+
+def _message(inserted_at, text='text', msg_id=None):
+    return {'id': msg_id, 'author': 'author', 'text': text, 'chat_id': '1',
+            'inserted_at': inserted_at, 'reply_to': ''}
+
+
+class TestChatHistory(unittest.TestCase):
+    def test_max_count(self):
+        h = ChatHistory(max_count=3)
+        h.extend([_message(i) for i in range(5)])
+        self.assertEqual([2, 3, 4], [m['inserted_at'] for m in h])
+        self.assertEqual(4, h[-1]['inserted_at'])
+
+    def test_max_age(self):
+        h = ChatHistory(max_age=datetime.timedelta(seconds=10))
+        h.extend([_message(100), _message(105)])
+        h.extend([_message(112)])
+        self.assertEqual([105, 112], [m['inserted_at'] for m in h])
+
+    def test_nbytes(self):
+        h = ChatHistory(max_count=1)
+        self.assertEqual(0, h.nbytes)
+        h.extend([_message(1, 'a' * 1000)])
+        big = h.nbytes
+        self.assertGreater(big, 1000)
+        h.extend([_message(2)])
+        self.assertLess(h.nbytes, big)
+
+
+    def test_out_of_order(self):
+        h = ChatHistory()
+        h.extend([_message(1), _message(5), _message(3)])
+        h.extend([_message(2)])
+        self.assertEqual([1, 5, 3, 2], [m['inserted_at'] for m in h])
+        self.assertEqual(2, h[-1]['inserted_at'])
+        self.assertEqual(1, h[0]['inserted_at'])
+        with self.assertRaises(IndexError):
+            h[4]
+
+    def test_late_message_keeps_positions(self):
+        h = ChatHistory()
+        h.extend([_message(i) for i in (1, 2, 5)])
+        position = h.position_after(2)
+        h.extend([_message(3)])
+        messages, position = h.read(position)
+        self.assertEqual([5, 3], [m['inserted_at'] for m in messages])
+        self.assertEqual(h.end, position)
+
+    def test_read_positions(self):
+        h = ChatHistory(max_count=4)
+        h.extend([_message(i) for i in range(4)])
+        position = h.position_after(1)
+        messages, position = h.read(position, 1)
+        self.assertEqual([2], [m['inserted_at'] for m in messages])
+
+        # Positions stay valid while old messages are trimmed
+        h.extend([_message(i) for i in range(4, 10)])
+        messages, position = h.read(position, 2)
+        self.assertEqual([6, 7], [m['inserted_at'] for m in messages])
+        messages, position = h.read(position)
+        self.assertEqual([8, 9], [m['inserted_at'] for m in messages])
+        self.assertEqual(h.end, position)
+        self.assertEqual(h.end, h.position_after(9))
+        self.assertEqual([], h.read(position)[0])
+
+
+    def test_fresh(self):
+        h = ChatHistory(max_count=3)
+        h.extend([_message(i, msg_id=str(i)) for i in range(1, 4)])
+        self.assertEqual(
+            ['4'], [m['id'] for m in h.fresh(
+                [_message(i, msg_id=str(i)) for i in range(1, 5)])])
+        h.extend([_message(4, msg_id='4')])
+        # Older than anything kept after trimming
+        self.assertEqual([], h.fresh([_message(1, msg_id='1')]))
+        self.assertEqual(1, len(h.fresh([_message(2, msg_id='2.5')])))
+
+
+class TestMessageStore(unittest.TestCase):
+    def test_missing_chat(self):
+        s = MessageStore()
+        self.assertEqual([], list(s['1']))
+        with self.assertRaises(IndexError):
+            s['1'][-1]
+        self.assertNotIn('1', s)
+
+    def test_evict(self):
+        s = MessageStore()
+        s.extend('1', [_message(1)])
+        s.extend('2', [_message(2), _message(3)])
+        self.assertEqual(3, s.stats()['messages'])
+        self.assertGreater(s.memory_usage(), 0)
+        s.evict('2')
+        self.assertEqual(['1'], list(s))
+        self.assertEqual(1, s.stats()['messages'])
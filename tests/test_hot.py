@@ -0,0 +1,77 @@
+# coding utf-8
+
+import datetime
+import unittest
+from meduzach.hot import HotRanking, MESSAGE_WEIGHT, AUTHOR_WEIGHT
+
+HOUR = 3600
+
+
+class FakeClock():
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+def _messages(authors, at):
+    return [{"user_id": author, "author": "Name", "text": "",
+             "inserted_at": at}
+            for author in authors]
+
+
+class TestHotRanking(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.hot = HotRanking(half_life=datetime.timedelta(hours=1),
+                              now=self.clock)
+
+    def test_distinct_authors_weigh_more(self):
+        self.hot.observe('monologue', _messages("aaaa", 0))
+        self.hot.observe('talk', _messages("abcd", 0))
+        self.assertEqual(['talk', 'monologue'],
+                         [chat_id for chat_id, _ in self.hot.top(10)])
+        self.assertEqual(4 * MESSAGE_WEIGHT + AUTHOR_WEIGHT,
+                         self.hot.score('monologue'))
+
+    def test_authors_by_id(self):
+        self.hot.observe('namesakes', _messages("ab", 0))
+        self.hot.observe('renamed', [
+            {"user_id": "a", "author": name, "inserted_at": 0}
+            for name in ("Old", "New")])
+        self.assertEqual(2 * (MESSAGE_WEIGHT + AUTHOR_WEIGHT),
+                         self.hot.score('namesakes'))
+        self.assertEqual(2 * MESSAGE_WEIGHT + AUTHOR_WEIGHT,
+                         self.hot.score('renamed'))
+
+    def test_decay(self):
+        self.hot.observe('old', _messages("abcd", 0))
+        self.clock.time = 2 * HOUR
+        self.hot.observe('new', _messages("ab", 2 * HOUR))
+        self.assertEqual(['new', 'old'],
+                         [chat_id for chat_id, _ in self.hot.top(10)])
+        self.assertAlmostEqual(4, self.hot.score('old'))
+        self.assertEqual([('new', 8)], self.hot.top(1))
+
+    def test_update_and_remove(self):
+        self.hot.observe('1', _messages("a", 0))
+        self.hot.observe('2', _messages("ab", 0))
+        self.hot.observe('1', _messages("bc", 0))
+        self.assertEqual(['1', '2'],
+                         [chat_id for chat_id, _ in self.hot.top(10)])
+        self.hot.remove('1')
+        self.assertEqual(['2'], [chat_id for chat_id, _ in self.hot.top(10)])
+        self.assertNotIn('1', self.hot)
+        self.assertEqual(1, len(self.hot))
+
+    def test_rebase(self):
+        self.hot.observe('1', _messages("ab", 0))
+        self.hot.observe('2', _messages("a", 0))
+        self.clock.time = 100 * HOUR
+        self.hot.observe('2', _messages("abc", 100 * HOUR))
+        self.assertEqual(['2', '1'],
+                         [chat_id for chat_id, _ in self.hot.top(10)])
+        self.assertAlmostEqual(12, self.hot.score('2'))
+        self.hot.remove('1')
+        self.assertEqual(1, len(self.hot.top(10)))
@@ -0,0 +1,100 @@
+# coding utf-8
+
+import datetime
+import threading
+import unittest
+import unittest.mock as mock
+from meduzach.keepalive import Keepalive
+from meduzach.meduzach import Meduzach
+from tests.test_meduzach import SilentWs
+
+
+class FakeClock():
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class TestKeepalive(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.k = Keepalive(period=datetime.timedelta(seconds=25),
+                           timeout=datetime.timedelta(seconds=10),
+                           now=self.clock)
+
+    def test_due(self):
+        self.assertTrue(self.k.due())
+        self.k.sent('1')
+        self.clock.time = 24
+        self.assertFalse(self.k.due())
+        self.clock.time = 25
+        self.assertTrue(self.k.due())
+
+    def test_rtt_by_ref(self):
+        self.k.sent('1')
+        self.clock.time = 0.5
+        self.assertFalse(self.k.received({'ref': '2'}))
+        self.assertTrue(self.k.received({'ref': '1'}))
+        self.assertFalse(self.k.received({'ref': '1'}))
+        self.assertEqual([0.5], [rtt for _, rtt in self.k.rtts])
+        self.assertEqual(1, self.k.stats()['count'])
+        self.assertEqual(0.5, self.k.stats()['avg'])
+
+    def test_dead(self):
+        self.k.sent('1')
+        self.clock.time = 10
+        self.assertFalse(self.k.dead())
+        self.clock.time = 11
+        self.assertTrue(self.k.dead())
+        self.k.reset()
+        self.assertFalse(self.k.dead())
+        self.assertTrue(self.k.due())
+
+
+class _Stop(BaseException):
+    pass
+
+
+class TestWatchdog(unittest.TestCase):
+    def test_reconnects_dead_connection(self):
+        m = Meduzach()
+        m.slowmode = False
+        m.keepalive.timeout = 0.05
+        m.reconnect_backoff.next = lambda: 0
+        sockets = []
+
+        def _connect():
+            if sockets:
+                raise _Stop()
+            sockets.append(SilentWs())
+            return sockets[-1]
+
+        def _run():
+            try:
+                m.run()
+            except _Stop:
+                pass
+
+        with mock.patch('websocket.WebSocket',
+                        lambda **kwargs: _connect()), \
+                mock.patch('meduzach.meduzach.KEEPALIVE_TICK',
+                           datetime.timedelta(seconds=0.01)):
+            thread = threading.Thread(target=_run, daemon=True)
+            thread.start()
+            thread.join(5)
+        # The receive loop was woken up and connected again.
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(sockets))
+        self.assertIn('heartbeat',
+                      [frame['event'] for frame in sockets[0].sent])
+
+    def test_reply_routed(self):
+        m = Meduzach()
+        request = m._heartbeat_request()
+        m.route_response({'topic': 'phoenix', 'event': 'phx_reply',
+                          'ref': request['ref'],
+                          'payload': {'status': 'ok', 'response': {}}})
+        self.assertEqual(1, len(m.keepalive.rtts))
+        self.assertFalse(m.keepalive.dead())
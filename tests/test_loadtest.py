@@ -0,0 +1,55 @@
+# coding utf-8
+
+import unittest
+import telegram
+from telegram.error import NetworkError
+from loadtest.fake_meduza import FakeMeduza
+from loadtest.fake_telegram import FakeTelegram
+from meduzach.delivery import retry_after
+from meduzach.meduzach import Meduzach
+
+
+class TestFakeMeduza(unittest.TestCase):
+    def test_lobby_and_join(self):
+        server = FakeMeduza(chats=2, rate=0).start()
+        self.addCleanup(server.stop)
+        m = Meduzach()
+        m.addr = server.url
+        m.slowmode = False
+        m.connect_to_server()
+        self.addCleanup(m.close)
+
+        m.send(m._topic_request("topic:lobby"))
+        m.route_response(m.receive())
+        m.route_response(m.receive())
+        self.assertEqual(set(server.chat_ids), set(m.chats))
+
+        updated = []
+        m.connect('chat_updated',
+                  lambda sender, payload: updated.append(payload))
+        m.send(m._join_request(server.chat_ids[0]))
+        m.route_response(m.receive())
+        self.assertEqual(server.chat_ids[0], updated[0][0])
+        self.assertTrue(updated[0][1][0]['text'].startswith('lt'))
+
+
+class TestFakeTelegram(unittest.TestCase):
+    def test_send_and_updates(self):
+        server = FakeTelegram().start()
+        self.addCleanup(server.stop)
+        bot = telegram.Bot("123:test", base_url=server.base_url)
+
+        server.send_command(42, "/100")
+        updates = bot.getUpdates()
+        self.assertEqual("/100", updates[0].message.text)
+        self.assertEqual(42, updates[0].message.chat_id)
+
+        bot.sendMessage(42, text="lt5 hello")
+        self.assertEqual([(42, 5)],
+                         [(c, m) for _, c, m in server.deliveries()])
+
+        server.error_rate = 1
+        with self.assertRaises(NetworkError) as context:
+            bot.sendMessage(42, text="lt6")
+        self.assertEqual(1, retry_after(context.exception))
+        self.assertEqual(1, server.rejected)
@@ -3,6 +3,11 @@
 import unittest
 import unittest.mock as mock
 import json
+import socket
+import threading
+import time
+from benchmarks import synthetic
+from meduzach import frames
 from meduzach.meduzach import Meduzach
 from tests.data_example import examples
 
@@ -12,6 +17,8 @@ class FakeWsFinException(Exception):
 
 
 class FakeWs():
+    sock = None
+
     def __init__(self, fake_results):
         self.fake_results = fake_results
 
@@ -31,6 +38,41 @@ class FakeWs():
     def close(*args, **kwargs):
         pass
 
+    def shutdown(*args, **kwargs):
+        pass
+
+
+class SilentWs():
+    """
+    Connection to a server that went silent after the handshake.
+
+    Like websocket-client, recv holds the frame lock while it waits
+    and close() takes it for the close handshake.
+    """
+    def __init__(self):
+        self.sock, self._peer = socket.socketpair()
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def connect(self, *args, **kwargs):
+        pass
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def recv(self):
+        with self._lock:
+            if not self.sock.recv(1):
+                raise ConnectionError("Connection is closed")
+
+    def close(self):
+        with self._lock:
+            self.shutdown()
+
+    def shutdown(self):
+        self.sock.close()
+        self._peer.close()
+
 
 class TestMeduzach(unittest.TestCase):
     def test_init(self):
@@ -41,7 +83,7 @@ class TestMeduzach(unittest.TestCase):
         m = Meduzach()
         m.slowmode = False
         with mock.patch('websocket.WebSocket',
-                        lambda: FakeWs(examples)):
+                        lambda **kwargs: FakeWs(examples)):
             with self.assertRaises(FakeWsFinException):
                 m.run(recover=False)
 
@@ -89,3 +131,122 @@ class TestMeduzach(unittest.TestCase):
         m.update_chats(json.loads(examples[1]))
         self.assertEqual(18, len(m.chats))
         self.assertIn('313', m.chats)
+
+    def test_route_by_topic(self):
+        m = Meduzach()
+        m.update_chats(json.loads(examples[1]))
+        calls = []
+        m.connect('chat_updated',
+                  lambda sender, payload: calls.append(payload[0]))
+
+        request = m._join_request('328')
+        self.assertIsNotNone(request)
+        self.assertIsNone(m._join_request('328'))
+
+        reply = json.loads(examples[6])
+        reply['ref'] = request['ref']
+        del reply['payload']['response']['messages']['1611482']['chat_id']
+        reply['payload']['response']['messages_ids'] = ['1611482']
+        self.assertTrue(m.route_response(reply))
+        self.assertTrue(m.channels.is_joined('328'))
+        self.assertEqual(['328'], calls)
+        self.assertIsNone(m._join_request('328'))
+
+    def test_ended_chat_evicted(self):
+        m = Meduzach()
+        m.update_chats(json.loads(examples[1]))
+        m.update_messages(json.loads(examples[6]))
+        self.assertEqual(3, len(m.messages['328']))
+
+        lobby = json.loads(examples[1])
+        lobby['payload']['chats_ids'].remove('328')
+        m.update_chats(lobby)
+        self.assertNotIn('328', m.messages)
+
+    def test_update_chats_delta(self):
+        m = Meduzach()
+        updates = []
+        m.connect('chatlist_updated',
+                  lambda sender, payload: updates.append(payload))
+        m.update_chats(json.loads(examples[1]))
+        self.assertEqual(1, len(updates))
+        self.assertEqual(18, len(updates[0][0]))
+        chat_313 = m.chats['313']
+
+        m.update_chats(json.loads(examples[2]))
+        self.assertEqual(1, len(updates))
+        self.assertIs(chat_313, m.chats['313'])
+        idle_interval = m.lobby_poll.interval
+        pending_313 = m._chats_to_be_updated['313']
+
+        lobby = json.loads(examples[1])
+        lobby['payload']['chats']['313']['messages_count'] += 2
+        lobby['payload']['chats_ids'].remove('328')
+        m.update_chats(lobby)
+        self.assertEqual((set(), {'328'}, {'313'}), updates[-1])
+        self.assertNotIn('328', m.chats)
+        self.assertEqual(
+            lobby['payload']['chats']['313'], m.chats['313'])
+        self.assertEqual(pending_313 + 2, m._chats_to_be_updated['313'])
+        self.assertLess(m.lobby_poll.interval, idle_interval)
+        self.assertEqual(len(m.chats), len(m.chat_index))
+        self.assertNotIn('328', m.chat_index)
+        self.assertEqual(
+            sorted(m.chats, key=lambda c: (-m.chats[c]['last_message_at'], c)),
+            [c for c, _ in m.chat_index.snapshot()[1]])
+
+
+class TestResume(unittest.TestCase):
+    def test_rejoin_not_redelivered(self):
+        m = Meduzach()
+        updates = []
+        m.connect('chat_updated',
+                  lambda sender, payload: updates.append(payload))
+        factory = synthetic.MessageFactory()
+        chat_id = str(synthetic.FIRST_CHAT_ID)
+        first = json.loads(factory.join_reply(chat_id, 3, 1))
+        m.update_messages(frames.project(json.loads(json.dumps(first))),
+                          chat_id)
+        # After a reconnect the join reply repeats the history
+        second = json.loads(json.dumps(first))
+        new_id, new_message = factory.message(chat_id)
+        second['payload']['response']['messages_ids'].append(new_id)
+        second['payload']['response']['messages'][new_id] = new_message
+        m.update_messages(frames.project(second), chat_id)
+        m.update_messages(frames.project(second), chat_id)
+
+        self.assertEqual([3, 1], [len(u[1]) for u in updates])
+        self.assertEqual(new_id, updates[1][1][0]['id'])
+        self.assertEqual(4, len(m.messages[chat_id]))
+
+    def test_pending_joins_dropped_on_reconnect(self):
+        m = Meduzach()
+        m.slowmode = False
+        # A join was in flight when the connection died
+        m._chats_to_be_updated['328'] = 1
+        m._chats_to_be_updated_queue.put('328')
+        with mock.patch('websocket.WebSocket', lambda **kwargs: FakeWs([])):
+            with self.assertRaises(FakeWsFinException):
+                m.run(recover=False)
+        self.assertEqual({}, dict(m._chats_to_be_updated))
+        self.assertTrue(m._chats_to_be_updated_queue.empty())
+
+    def test_stop(self):
+        m = Meduzach()
+        m.slowmode = False
+        ws = SilentWs()
+        with mock.patch('websocket.WebSocket', lambda **kwargs: ws):
+            thread = threading.Thread(target=m.run, daemon=True)
+            thread.start()
+            while not ws.sent:
+                time.sleep(0.01)
+            m.stop()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_backoff_reset_on_receive(self):
+        m = Meduzach()
+        m.reconnect_backoff.next()
+        m._ws = FakeWs([examples[1]])
+        m.receive()
+        self.assertEqual(0, m.reconnect_backoff.attempts)
@@ -1,8 +1,18 @@
 import datetime
+import os
+import shutil
+import tempfile
 import unittest
 import unittest.mock as mock
 from telegram import Update, Message, Chat
+from telegram.error import Unauthorized
 from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.chat_index import ChatIndex
+from meduzach.history import MessageStore
+from meduzach.hot import HotRanking
+from meduzach.meduzach import Meduzach
+from meduzach.storage import SubscriptionStore
+from meduzach.users import UserDirectory
 
 
 def _construct_update(chat_id, msg_text):
@@ -29,6 +39,7 @@ class TestMeduzachTelegramBot(unittest.TestCase):
     def test_chats(self):
         mock_sender = mock.MagicMock()
         mock_listener = mock.MagicMock()
+        mock_listener.chat_index = ChatIndex()
 
         l = ChatbotLogic(
             mock_listener,
@@ -52,12 +63,20 @@ class TestMeduzachTelegramBot(unittest.TestCase):
                 'last_message_at': 10
             },
         }
+        for chat_id, chat_info in mock_listener.chats.items():
+            mock_listener.chat_index.update(chat_id, chat_info)
 
         show_chats(mock_sender, _construct_update(312, '/chats'))
         mock_sender.sendMessage.assert_called_with(
             312, text="/444 [-] test chat (100500)\n"
                       "/512 [-] my chat (11)")
 
+        l._sub(312, '512', False)
+        show_chats(mock_sender, _construct_update(312, '/chats'))
+        mock_sender.sendMessage.assert_called_with(
+            312, text="/444 [-] test chat (100500)\n"
+                      "/512 [+] my chat (11)")
+
     def test_toggle_subscription(self):
         mock_sender = mock.MagicMock()
         mock_listener = mock.MagicMock()
@@ -75,16 +94,15 @@ class TestMeduzachTelegramBot(unittest.TestCase):
                 'key': 'some_key'
             }
         }
-        mock_listener.messages = {
-            '512': [
-                {
-                    'author': 'Такой-то чел',
-                    'text': 'hello world',
-                    'reply_to': '',
-                    'inserted_at': 123
-                }
-            ]
-        }
+        mock_listener.messages = MessageStore()
+        mock_listener.messages.extend('512', [
+            {
+                'author': 'Такой-то чел',
+                'text': 'hello world',
+                'reply_to': '',
+                'inserted_at': 123
+            }
+        ])
 
         toggle_subscription = l._create_toggle_subscription()
 
@@ -141,24 +159,23 @@ class TestMeduzachTelegramBot(unittest.TestCase):
                 'key': 'other_key'
             }
         }
-        mock_listener.messages = {
-            '512': [
-                {
-                    'author': 'Такой-то чел',
-                    'text': 'hello world',
-                    'reply_to': '',
-                    'inserted_at': 123
-                }
-            ],
-            '256': [
-                {
-                    'author': 'Кто-то',
-                    'text': 'Текст',
-                    'reply_to': '',
-                    'inserted_at': 11
-                }
-            ]
-        }
+        mock_listener.messages = MessageStore()
+        mock_listener.messages.extend('512', [
+            {
+                'author': 'Такой-то чел',
+                'text': 'hello world',
+                'reply_to': '',
+                'inserted_at': 123
+            }
+        ])
+        mock_listener.messages.extend('256', [
+            {
+                'author': 'Кто-то',
+                'text': 'Текст',
+                'reply_to': '',
+                'inserted_at': 11
+            }
+        ])
 
         toggle_subscription = l._create_toggle_subscription()
         process_chat_update = l._create_process_chat_update()
@@ -192,3 +209,247 @@ class TestMeduzachTelegramBot(unittest.TestCase):
             123,
             text="Обновление чата /256 (Лол):\n*Экий-то чел* Еще сообщение!",
             parse_mode='Markdown')
+
+    def test_restore_tracked(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        mock_store = mock.MagicMock()
+        mock_store.load.return_value = [
+            (123, '512', True, 0),
+            (123, '256', False, 11),
+            (124, '100', True, 0)]
+        mock_listener.chats = {'512': {}, '256': {}}
+
+        l = ChatbotLogic(mock_listener, mock_sender, mock_store)
+        l.restore_tracked()
+
+        self.assertEqual({'512'}, l.readers[123].chats)
+        self.assertEqual(11, l.readers[123].unsub_time['256'])
+        self.assertEqual({123}, l.subscriptions.readers('512'))
+        self.assertNotIn('100', l.readers[124].chats)
+        mock_store.forget_chats.assert_called_once_with({'100'})
+        mock_sender.sendMessage.assert_not_called()
+
+    def test_ended_chats_forgotten(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        store = SubscriptionStore(os.path.join(tmpdir, 'test.sqlite3'),
+                                  flush_interval=datetime.timedelta(0))
+        self.addCleanup(store.close)
+        listener = Meduzach()
+        listener.chats = {'512': {}, '256': {}}
+        store.save(123, '512', True)
+        store.save(123, '256', True)
+        store.save(123, 'hot', True)
+        ChatbotLogic(listener, mock.MagicMock(), store)
+        listener.emit('chatlist_updated', (set(), {'256'}, set()))
+        store.flush()
+        self.assertEqual(
+            sorted([(123, '512', True, 0), (123, 'hot', True, 0)]),
+            sorted(store.load()))
+
+    def test_process_chat_update_delivery(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender)
+        l.delivery = mock.MagicMock()
+        mock_listener.chats = {'512': {'title': 'my chat'}}
+        l._sub(123, '512', False)
+
+        process_chat_update = l._create_process_chat_update()
+        process_chat_update(None, ('512', [
+            {'author': 'Кто-то', 'text': 'Новое!', 'reply_to': '',
+             'inserted_at': 234}]))
+
+        mock_sender.sendMessage.assert_not_called()
+        l.delivery.send.assert_called_once_with(
+            123, "Обновление чата /512 (my chat):\n*Кто-то* Новое!",
+            'Markdown', 234)
+
+    def test_unauthorized_unsubscribes(self):
+        mock_sender = mock.MagicMock()
+        mock_sender.sendMessage.side_effect = Unauthorized()
+        mock_listener = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender)
+        mock_listener.chats = {'512': {'title': 'my chat'}}
+        mock_listener.messages = {'512': []}
+        l._sub(123, '512', False)
+
+        process_chat_update = l._create_process_chat_update()
+        process_chat_update(None, ('512', [
+            {'author': 'Кто-то', 'text': 'Новое!', 'reply_to': '',
+             'inserted_at': 234}]))
+
+        self.assertEqual(set(), l.readers[123].chats)
+        self.assertEqual(set(), l.subscriptions.readers('512'))
+
+    def test_catchup_pages(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender)
+        l.settings['track'] = False
+        l.catchup_page_size = 2
+        mock_listener.chats = {'512': {'title': 'my chat', 'key': 'k'}}
+        mock_listener.messages = MessageStore()
+        mock_listener.messages.extend('512', [
+            {'id': str(i), 'author': 'a', 'text': str(i), 'reply_to': '',
+             'inserted_at': i} for i in range(1, 6)])
+        l.readers[123].unsub_time['512'] = 1
+
+        l._sub(123, '512')
+        self.assertEqual(
+            [mock.call(123, text="*a* 2\n*a* 3", parse_mode='Markdown'),
+             mock.call(123, text=ChatbotLogic.MORE_TEXT.format(2),
+                       parse_mode='Markdown')],
+            mock_sender.sendMessage.call_args_list)
+
+        # Messages arriving after subscribe come as live updates
+        mock_listener.messages.extend('512', [
+            {'id': '6', 'author': 'a', 'text': '6', 'reply_to': '',
+             'inserted_at': 6}])
+        mock_sender.reset_mock()
+        show_more = l._create_show_more()
+        show_more(mock_sender, _construct_update(123, '/more'))
+        mock_sender.sendMessage.assert_called_once_with(
+            123, text="*a* 4\n*a* 5", parse_mode='Markdown')
+
+        mock_sender.reset_mock()
+        show_more(mock_sender, _construct_update(123, '/more'))
+        mock_sender.sendMessage.assert_called_once_with(
+            123, text=ChatbotLogic.NO_MORE_TEXT)
+
+    def test_hot(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender)
+        l.settings['track'] = False
+        mock_listener.chats = {
+            '512': {'title': 'my chat', 'messages_count': 11},
+            '256': {'title': 'Лол', 'messages_count': 3}}
+        mock_listener.messages = MessageStore()
+        mock_listener.hot = HotRanking()
+        mock_listener.hot.observe('256', [
+            {'user_id': a, 'author': a, 'inserted_at': 10} for a in "abc"])
+        mock_listener.hot.observe('512', [
+            {'user_id': 'a', 'author': 'a', 'inserted_at': 10}])
+        # Ended chats are not listed
+        mock_listener.hot.observe('100', [
+            {'user_id': a, 'author': a, 'inserted_at': 10} for a in "abcd"])
+        l._sub(123, '512', False)
+
+        show_hot = l._create_show_hot()
+        show_hot(mock_sender, _construct_update(123, '/hot'))
+        mock_sender.sendMessage.assert_called_once_with(
+            123, text="/256 [-] Лол (3)\n/512 [+] my chat (11)")
+
+    def test_autohot(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        mock_store = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender, mock_store)
+        l.settings['track'] = False
+        mock_listener.chats = {
+            '512': {'title': 'my chat'}, '256': {'title': 'Лол'}}
+        mock_listener.messages = MessageStore()
+        mock_listener.hot = HotRanking()
+        mock_listener.hot.observe('512', [
+            {'user_id': 'a', 'author': 'a', 'inserted_at': 10}])
+        l.readers[123].unsub_time['256'] = 5
+
+        toggle_autohot = l._create_toggle_autohot()
+        toggle_autohot(mock_sender, _construct_update(123, '/autohot'))
+        self.assertEqual({'512'}, l.readers[123].chats)
+        mock_store.save.assert_any_call(123, 'hot', True)
+
+        # Chats unsubscribed from by hand are not followed
+        process_chat_update = l._create_process_chat_update()
+        message = {'user_id': 'b', 'author': 'b', 'text': 'Новое!',
+                   'reply_to': '',
+                   'inserted_at': 20}
+        mock_listener.hot.observe('256', [message])
+        process_chat_update(None, ('256', [message]))
+        self.assertEqual({'512'}, l.readers[123].chats)
+
+        toggle_autohot(mock_sender, _construct_update(123, '/autohot'))
+        self.assertEqual(set(), l.hot_readers)
+        mock_sender.sendMessage.assert_called_with(
+            123, text=ChatbotLogic.AUTOHOT_OFF_TEXT)
+
+    def test_follow(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        mock_store = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender, mock_store)
+        l.settings['track'] = False
+        mock_listener.chats = {
+            '512': {'title': 'my chat'}, '256': {'title': 'Лол'}}
+        mock_listener.messages = MessageStore()
+        mock_listener.users = UserDirectory()
+        mock_listener.users.see('7', {'7': {'name': 'Вася'}})
+        mock_listener.users.see('8', {'8': {'name': 'Петя'}})
+
+        follow = l._create_follow()
+        follow(mock_sender, _construct_update(123, '/follow вася'))
+        self.assertEqual({123}, l.follows.readers('7'))
+        mock_store.save.assert_called_once_with(123, '@7', True)
+        follow(mock_sender, _construct_update(124, '/follow Маша'))
+        self.assertEqual(set(), l.follows.chats(124))
+
+        # Subscribers of the chat get the message once
+        l._sub(124, '256', False)
+        l.follows.subscribe(124, '7')
+        mock_sender.reset_mock()
+        process_chat_update = l._create_process_chat_update()
+        process_chat_update(None, ('256', [
+            {'user_id': '8', 'author': 'Петя', 'text': 'Привет',
+             'reply_to': '', 'inserted_at': 20},
+            {'user_id': '7', 'author': 'Вася', 'text': 'Пока',
+             'reply_to': '', 'inserted_at': 21}]))
+        self.assertEqual(
+            [mock.call(123, text="Из чата /256 (Лол):\n*Вася* Пока",
+                       parse_mode='Markdown'),
+             mock.call(124, text="Обновление чата /256 (Лол):\n"
+                                 "*Петя* Привет\n*Вася* Пока",
+                       parse_mode='Markdown')],
+            sorted(mock_sender.sendMessage.call_args_list,
+                   key=lambda call: call[0]))
+
+        unfollow = l._create_unfollow()
+        unfollow(mock_sender, _construct_update(123, '/unfollow Вася'))
+        self.assertEqual({124}, l.follows.readers('7'))
+        mock_store.save.assert_called_with(123, '@7', False)
+
+    def test_restore_follows(self):
+        mock_listener = mock.MagicMock()
+        mock_store = mock.MagicMock()
+        mock_store.load.return_value = [
+            (123, '@7', True, 0), (124, '@7', False, 0)]
+        mock_listener.chats = {}
+        l = ChatbotLogic(mock_listener, mock.MagicMock(), mock_store)
+        l.restore_tracked()
+        self.assertEqual({123}, l.follows.readers('7'))
+
+    def test_follow_subsets(self):
+        mock_sender = mock.MagicMock()
+        mock_listener = mock.MagicMock()
+        l = ChatbotLogic(mock_listener, mock_sender)
+        l.settings['track'] = False
+        mock_listener.chats = {'256': {'title': 'Лол'}}
+        mock_listener.users = UserDirectory()
+        for user_id in ('0', '1', '2'):
+            l.follows.subscribe(int(user_id) + 100, user_id)
+            l.follows.subscribe(int(user_id) + 200, user_id)
+        l.follows.subscribe(101, '0')
+        l.follows.subscribe(102, '0')
+
+        process_chat_update = l._create_process_chat_update()
+        process_chat_update(None, ('256', [
+            {'id': str(i), 'user_id': user_id, 'author': 'u' + user_id,
+             'text': 't' + str(i), 'reply_to': '', 'inserted_at': i}
+            for i, user_id in enumerate(['0', '1', '2', '0'])]))
+        sent = {call[0][0]: call[1]['text']
+                for call in mock_sender.sendMessage.call_args_list}
+        self.assertEqual(
+            "Из чата /256 (Лол):\n*u0* t0\n*u1* t1\n*u0* t3", sent[101])
+        self.assertEqual(
+            "Из чата /256 (Лол):\n*u0* t0\n*u2* t2\n*u0* t3", sent[102])
@@ -0,0 +1,92 @@
+# coding utf-8
+
+import unittest
+import unittest.mock as mock
+import urllib.request
+from meduzach import metrics
+from meduzach.delivery import DeliveryScheduler
+from meduzach.meduzach import Meduzach
+from tests.data_example import examples
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = metrics.Registry()
+        counter = metrics.Counter('c_total', 'Counter.', ('kind',),
+                                  registry=registry)
+        histogram = metrics.Histogram('h_seconds', 'Histogram.',
+                                      buckets=(1, 5), registry=registry)
+        gauge = metrics.Gauge('g', 'Gauge.', registry=registry)
+        counter.inc(kind='a"b')
+        counter.inc(2, kind='x')
+        histogram.observe(0.5)
+        histogram.observe(3)
+        gauge.set_function(lambda: 7)
+        self.assertEqual(
+            "# HELP c_total Counter.\n"
+            "# TYPE c_total counter\n"
+            'c_total{kind="a\\"b"} 1\n'
+            'c_total{kind="x"} 2\n'
+            "# HELP h_seconds Histogram.\n"
+            "# TYPE h_seconds histogram\n"
+            'h_seconds_bucket{le="1"} 1\n'
+            'h_seconds_bucket{le="5"} 2\n'
+            'h_seconds_bucket{le="+Inf"} 2\n'
+            "h_seconds_sum 3.5\n"
+            "h_seconds_count 2\n"
+            "# HELP g Gauge.\n"
+            "# TYPE g gauge\n"
+            "g 7\n",
+            registry.render())
+
+    @mock.patch('traceback.print_exc')
+    def test_failing_gauge(self, print_exc):
+        registry = metrics.Registry()
+        gauge = metrics.Gauge('g', 'Gauge.', registry=registry)
+        gauge.set(1)
+        gauge.set_function(lambda: 1 / 0)
+        self.assertEqual(["# HELP g Gauge.", "# TYPE g gauge"],
+                         gauge.render())
+        print_exc.assert_called_once()
+
+    def test_server(self):
+        registry = metrics.Registry()
+        metrics.Counter('c_total', 'Counter.', registry=registry).inc()
+        server = metrics.MetricsServer(registry, port=0).start()
+        self.addCleanup(server.stop)
+        with urllib.request.urlopen("http://{}:{}/metrics".format(
+                server.host, server.port)) as response:
+            self.assertIn("c_total 1", response.read().decode())
+
+    def test_listener(self):
+        frames = metrics.FRAMES.value(topic='lobby', event='current_chats')
+        routed = metrics.ROUTE_TIME.count()
+        handled = metrics.HANDLER_TIME.count(
+            signal='chatlist_updated', mode='direct')
+        m = Meduzach()
+        m._queue_chat_update = lambda chat_id: None
+        m.connect('chatlist_updated', lambda sender, payload: None)
+        m.route_response(m.decode(examples[1]))
+        self.assertEqual(frames + 1, metrics.FRAMES.value(
+            topic='lobby', event='current_chats'))
+        self.assertEqual(routed + 1, metrics.ROUTE_TIME.count())
+        self.assertEqual(handled + 1, metrics.HANDLER_TIME.count(
+            signal='chatlist_updated', mode='direct'))
+
+        metrics.watch_listener(m)
+        self.assertIn("meduzach_chats 18", metrics.REGISTRY.render())
+
+    def test_delivery(self):
+        bot = mock.MagicMock()
+        bot.sendMessage.side_effect = [ValueError(), None]
+        delivered = metrics.DELIVERY_LATENCY.count()
+        errors = metrics.SEND_ERRORS.value(type='ValueError')
+        d = DeliveryScheduler(bot, on_error=lambda reader_id, exc: None)
+        d.start()
+        self.addCleanup(d.stop)
+        d.send(1, 'a', created_at=1)
+        d.send(1, 'b', created_at=1)
+        self.assertTrue(d.join(5))
+        self.assertEqual(delivered + 1, metrics.DELIVERY_LATENCY.count())
+        self.assertEqual(errors + 1,
+                         metrics.SEND_ERRORS.value(type='ValueError'))
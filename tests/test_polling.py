@@ -0,0 +1,41 @@
+# coding utf-8
+
+import datetime
+import unittest
+from meduzach.polling import AdaptivePoll, Backoff
+
+
+class TestAdaptivePoll(unittest.TestCase):
+    def test_observe(self):
+        p = AdaptivePoll(min_interval=datetime.timedelta(seconds=1),
+                         max_interval=datetime.timedelta(seconds=4),
+                         initial=datetime.timedelta(seconds=2),
+                         backoff=2)
+        self.assertEqual(0, p.remaining())
+        p.observe(False)
+        self.assertEqual(4, p.interval)
+        p.observe(False)
+        self.assertEqual(4, p.interval)
+        p.observe(True)
+        self.assertEqual(1, p.interval)
+
+    def test_remaining(self):
+        p = AdaptivePoll(initial=datetime.timedelta(seconds=10))
+        p.polled()
+        self.assertGreater(p.remaining(), 9)
+        self.assertLessEqual(p.remaining(), 10)
+
+
+class TestBackoff(unittest.TestCase):
+    def test_next(self):
+        b = Backoff(min_delay=datetime.timedelta(seconds=1),
+                    max_delay=datetime.timedelta(seconds=5),
+                    factor=2, random=lambda: 1)
+        self.assertEqual([1, 2, 4, 5, 5], [b.next() for _ in range(5)])
+        b.reset()
+        self.assertEqual(1, b.next())
+
+    def test_jitter(self):
+        b = Backoff(min_delay=datetime.timedelta(seconds=4),
+                    random=lambda: 0)
+        self.assertEqual(2, b.next())
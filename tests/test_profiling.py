@@ -0,0 +1,90 @@
+# coding utf-8
+
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import unittest.mock as mock
+from telegram import Update, Message, Chat
+from meduzach import profiling
+from meduzach.admin import AdminCommands
+
+
+def _busy(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def _update(chat_id, text):
+    msg = Message(1, 1, datetime.datetime.now(), Chat(chat_id, 'private'),
+                  text=text)
+    return Update(1, message=msg)
+
+
+class TestProfiling(unittest.TestCase):
+    def test_sampling(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=_busy, args=(stop,), name="busy")
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+
+        profiler = profiling.SamplingProfiler(interval=0.001)
+        self.assertTrue(profiler.start())
+        self.assertFalse(profiler.start())
+        while not any(s.startswith("busy;") for s in profiler.samples):
+            stop.wait(0.01)
+        self.assertTrue(profiler.stop())
+        self.assertFalse(profiler.stop())
+        self.assertTrue(any(name.startswith("_busy ")
+                            for stack in profiler.samples
+                            for name in stack.split(";")))
+        self.assertFalse(any(s.startswith("profiler;")
+                             for s in profiler.samples))
+
+    def test_deep_size(self):
+        shared = ["x" * 1000]
+        seen = set()
+        first = profiling.deep_size({"a": shared}, seen)
+        second = profiling.deep_size({"b": shared}, seen)
+        self.assertGreater(first, 1000)
+        self.assertLess(second, 1000)
+
+
+class TestAdminCommands(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.admin = AdminCommands(lambda: {"data": list(range(100))},
+                                   admin_ids=[1], directory=self.directory)
+
+    def test_not_admin(self):
+        bot = mock.MagicMock()
+        self.admin._create_profile_start()(bot, _update(2, '/profile_start'))
+        bot.sendMessage.assert_not_called()
+        self.assertFalse(self.admin.profiler.running)
+
+    def test_profile(self):
+        bot = mock.MagicMock()
+        self.admin._create_profile_start()(bot, _update(1, '/profile_start'))
+        self.assertTrue(self.admin.profiler.running)
+        self.admin.profiler.sample()
+        self.admin._create_profile_stop()(bot, _update(1, '/profile_stop'))
+        path = bot.sendMessage.call_args[1]['text'].split("\n")[0]
+        self.assertTrue(path.startswith(self.directory))
+        with open(path) as inf:
+            self.assertIn("MainThread;", inf.read())
+
+    def test_memory(self):
+        bot = mock.MagicMock()
+        memory = self.admin._create_memory()
+        memory(bot, _update(1, '/memory'))
+        memory(bot, _update(1, '/memory'))
+        self.addCleanup(profiling.tracemalloc.stop)
+        text = bot.sendMessage.call_args[1]['text']
+        self.assertIn("data", text)
+        self.assertEqual(2, len(os.listdir(self.directory)))
+        with open(text.split("\n")[0]) as inf:
+            self.assertIn("# allocations", inf.read())
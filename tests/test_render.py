@@ -0,0 +1,89 @@
+# coding utf-8
+
+import unittest
+from meduzach.chatbot_logic import ChatbotLogic, MSG_LIMIT
+from meduzach.chat_index import ChatIndex
+from meduzach.render import RenderCache, ChatListCache
+
+
+def _message(msg_id, text='hello', reply_to=''):
+    return {'id': msg_id, 'author': 'Кто-то', 'text': text,
+            'reply_to': reply_to, 'inserted_at': 1}
+
+
+class TestFormat(unittest.TestCase):
+    def test_escape(self):
+        self.assertEqual("a\\*b\\_c\\[d\\`e\\\\f]",
+                         ChatbotLogic.escape_markdown("a*b_c[d`e\\f]"))
+
+    def test_reply(self):
+        users = {'1': 'Имя'}
+        self.assertEqual(
+            ["*Кто-то* @_Имя_ hello\n*Кто-то* hello"],
+            list(ChatbotLogic.format_messages(
+                [_message('a', reply_to='1'),
+                 _message('b', reply_to='2')], users)))
+
+    def test_split(self):
+        chunks = list(ChatbotLogic.format_messages(
+            [_message(str(i), 'x' * 1500) for i in range(3)]))
+        self.assertEqual(3, len(chunks))
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_shared(self):
+        calls = []
+
+        def _render(messages):
+            calls.append(len(messages))
+            return ChatbotLogic.format_messages(messages)
+
+        cache = RenderCache(_render, MSG_LIMIT)
+        messages = [_message('1'), _message('2')]
+        first = cache.render('512', messages)
+        second = cache.render('512', list(messages))
+        self.assertIs(first, second)
+        self.assertEqual([2], calls)
+        self.assertIsNot(first, cache.render('256', messages))
+        self.assertIsNot(first, cache.render('512', messages[:1]))
+
+    def test_header(self):
+        cache = RenderCache(ChatbotLogic.format_messages, MSG_LIMIT)
+        rendered = cache.render('512', [_message('1')])
+        self.assertEqual(("header\n*Кто-то* hello",),
+                         rendered.with_header("header\n"))
+        self.assertIs(rendered.with_header("header\n"),
+                      rendered.with_header("header\n"))
+
+        long_rendered = cache.render('512', [_message('2', 'x' * 2040)])
+        self.assertEqual(2, len(long_rendered.with_header("header\n")))
+
+    def test_lru(self):
+        cache = RenderCache(ChatbotLogic.format_messages, MSG_LIMIT, size=2)
+        for i in range(5):
+            cache.render('512', [_message(str(i))])
+        self.assertEqual(2, len(cache))
+
+
+class TestChatListCache(unittest.TestCase):
+    def test_cache(self):
+        now = [0]
+        index = ChatIndex()
+        cache = ChatListCache(index, 10, now=lambda: now[0])
+        self.assertIsNone(cache.render())
+
+        index.update('1', {'title': 'a', 'messages_count': 3,
+                           'last_message_at': 5})
+        index.update('2', {'title': 'b', 'messages_count': 4,
+                           'last_message_at': 7})
+        self.assertEqual("/2 [-] b (4)\n/1 [-] a (3)", cache.render())
+        self.assertEqual("/2 [-] b (4)\n/1 [+] a (3)", cache.render({'1'}))
+        self.assertEqual(2, cache.misses)
+
+        # Stale for up to expire_time after a change
+        index.update('1', {'title': 'a', 'messages_count': 5,
+                           'last_message_at': 9})
+        self.assertEqual("/2 [-] b (4)\n/1 [-] a (3)", cache.render())
+        now[0] = 11
+        self.assertEqual("/1 [-] a (5)\n/2 [-] b (4)", cache.render())
+        self.assertEqual(3, cache.misses)
@@ -0,0 +1,97 @@
+# coding utf-8
+
+import datetime
+import os
+import tempfile
+import unittest
+import unittest.mock as mock
+from meduzach import snapshot
+from meduzach.chatbot_logic import ChatbotLogic
+from meduzach.meduzach import Meduzach
+from meduzach.snapshot import Snapshotter
+
+
+def _lobby(chats):
+    return {
+        'topic': 'topic:lobby',
+        'event': 'current_chats',
+        'payload': {
+            'chats_ids': list(chats),
+            'chats': {chat_id: {
+                'id': chat_id, 'key': 'key' + chat_id, 'title': 'Chat',
+                'messages_count': count, 'last_message_at': count}
+                for chat_id, count in chats.items()}}}
+
+
+def _messages(chat_id, ids):
+    return {
+        'topic': 'topic:key' + chat_id,
+        'event': 'new_msg',
+        'payload': {
+            'chat_id': chat_id,
+            'messages_ids': [str(i) for i in ids],
+            'messages': {str(i): {
+                'user_id': 'u1', 'message': 'text {}'.format(i),
+                'chat_id': chat_id, 'inserted_at': i} for i in ids},
+            'users': {'u1': {'name': 'Author'}}}}
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state.snapshot")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _running(self):
+        listener = Meduzach()
+        logic = ChatbotLogic(listener, mock.MagicMock())
+        listener.update_chats(_lobby({'1': 3, '2': 1}))
+        listener.update_messages(_messages('1', [1, 2, 3]), '1')
+        logic.subscriptions.subscribe(123, '1')
+        logic.readers[123].latest = '1'
+        logic.readers[123].unsub_time['2'] = 7
+        return listener, logic
+
+    def test_roundtrip(self):
+        listener, logic = self._running()
+        self.assertGreater(Snapshotter(listener, logic, self.path).save(), 0)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+        warm = Meduzach()
+        warm_logic = ChatbotLogic(warm, mock.MagicMock())
+        self.assertTrue(Snapshotter(warm, warm_logic, self.path).restore())
+        self.assertTrue(warm.is_initialized)
+        self.assertEqual({'1', '2'}, set(warm.chats))
+        self.assertEqual(2, len(warm.chat_index))
+        self.assertEqual(['1', '2', '3'],
+                         [m['id'] for m in warm.messages['1']])
+        self.assertEqual('Author', warm.users['u1'])
+        # Subscriptions come from the store
+        self.assertFalse(warm_logic.subscriptions.is_subscribed(123, '1'))
+        self.assertEqual('1', warm_logic.readers[123].latest)
+        self.assertEqual(7, warm_logic.readers[123].unsub_time['2'])
+
+    def test_reconcile_without_redelivery(self):
+        listener, logic = self._running()
+        snapshot.write(self.path, snapshot.take(listener, logic, tail=2))
+        warm = Meduzach()
+        snapshot.restore(snapshot.load(self.path), warm)
+        updated = []
+        warm.connect('chat_updated',
+                     lambda sender, payload: updated.append(payload))
+        # Join reply resends history older and newer than the snapshot.
+        warm.update_messages(_messages('1', [1, 2, 3, 4]), '1')
+        self.assertEqual([['4']], [[m['id'] for m in messages]
+                                   for _, messages in updated])
+
+    def test_stale_or_missing(self):
+        self.assertIsNone(snapshot.load(self.path))
+        listener, logic = self._running()
+        snapshot.write(self.path, snapshot.take(listener))
+        self.assertIsNone(snapshot.load(
+            self.path, max_age=datetime.timedelta(seconds=-1)))
+        with open(self.path, "wb") as outf:
+            outf.write(b"garbage")
+        self.assertIsNone(snapshot.load(self.path))
@@ -0,0 +1,74 @@
+# coding utf-8
+
+import datetime
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from meduzach.storage import SubscriptionStore
+
+
+class TestSubscriptionStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'test.sqlite3')
+
+    def _store(self):
+        s = SubscriptionStore(
+            self.path, flush_interval=datetime.timedelta(0))
+        self.addCleanup(s.close)
+        return s
+
+    def test_save_load(self):
+        s = self._store()
+        self.assertTrue(s.is_empty())
+        s.save(123, '512', True)
+        s.save(123, '256', True)
+        s.save(123, '256', False, 345)
+        s.track(123, 'sub', '512')
+        s.flush()
+
+        self.assertEqual(
+            sorted([(123, '512', True, 0), (123, '256', False, 345)]),
+            sorted(self._store().load()))
+
+    def test_forget_chats(self):
+        s = self._store()
+        s.save(123, '512', True)
+        s.save(124, '512', False, 345)
+        s.save(123, '256', True)
+        s.forget_chats(['512'])
+        s.flush()
+        self.assertEqual([(123, '256', True, 0)], s.load())
+
+    def test_trim_events(self):
+        s = SubscriptionStore(
+            self.path, flush_interval=datetime.timedelta(0),
+            event_retention=datetime.timedelta(0))
+        s.track(123, 'sub', '512')
+        s.close()
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        self.assertEqual(
+            0, conn.execute("SELECT COUNT(*) FROM events").fetchone()[0])
+
+    def test_import_track_file(self):
+        now = datetime.datetime.now().strftime("%d/%m/%y_%H:%M")
+        track = os.path.join(self.dir, 'track.txt')
+        with open(track, 'w') as outf:
+            print("01/01/16_10:00 1 sub 100", file=outf)
+            print(now, 123, "sub", "512", file=outf)
+            print(now, 123, "chats", "None", file=outf)
+            print(now, 124, "sub", "512", file=outf)
+            print(now, 124, "unsub", "512", file=outf)
+            # Malformed lines are skipped
+            print("yesterday", 125, "sub", "512", file=outf)
+            print(now, "someone", "sub", "512", file=outf)
+
+        s = self._store()
+        self.assertEqual(2, s.import_track_file(track))
+        self.assertEqual(
+            sorted([(123, '512', True, 0), (124, '512', False, 0)]),
+            sorted(s.load()))
@@ -0,0 +1,58 @@
+# coding utf-8
+
+import threading
+import unittest
+from meduzach.subscriptions import SubscriptionRegistry
+
+
+class TestSubscriptionRegistry(unittest.TestCase):
+    def test_subscribe(self):
+        r = SubscriptionRegistry()
+        self.assertTrue(r.subscribe(1, '512'))
+        self.assertFalse(r.subscribe(1, '512'))
+        r.subscribe(2, '512')
+        r.subscribe(1, '256')
+
+        self.assertTrue(r.is_subscribed(1, '512'))
+        self.assertFalse(r.is_subscribed(3, '512'))
+        self.assertEqual({1, 2}, r.readers('512'))
+        self.assertEqual({'512', '256'}, r.chats(1))
+        self.assertEqual(2, r.subscriber_count('512'))
+        self.assertEqual(2, len(r))
+
+    def test_unsubscribe(self):
+        r = SubscriptionRegistry()
+        r.subscribe(1, '512')
+        chats = r.chats(1)
+        self.assertTrue(r.unsubscribe(1, '512'))
+        self.assertFalse(r.unsubscribe(1, '512'))
+        self.assertFalse(r.unsubscribe(1, '100'))
+        self.assertEqual(frozenset(), r.readers('512'))
+        self.assertEqual(set(), chats)
+        self.assertEqual(0, len(r))
+
+    def test_readers_snapshot(self):
+        r = SubscriptionRegistry()
+        r.subscribe(1, '512')
+        readers = r.readers('512')
+        r.subscribe(2, '512')
+        self.assertEqual({1}, readers)
+
+    def test_concurrent(self):
+        r = SubscriptionRegistry(shards=4)
+
+        def work(reader_id):
+            for chat_id in range(50):
+                r.subscribe(reader_id, str(chat_id))
+            for chat_id in range(0, 50, 2):
+                r.unsubscribe(reader_id, str(chat_id))
+
+        threads = [threading.Thread(target=work, args=(i,))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(set(range(8)), r.readers('1'))
+        self.assertEqual(frozenset(), r.readers('2'))
+        self.assertEqual(25, len(r.chats(3)))
@@ -0,0 +1,36 @@
+# coding utf-8
+
+import datetime
+import unittest
+from meduzach.users import UserDirectory
+
+
+class TestUserDirectory(unittest.TestCase):
+    def test_see(self):
+        users = UserDirectory()
+        names = {'1': {'name': ''.join(['Им', 'я'])}}
+        self.assertEqual('Имя', users.see('1', names))
+        self.assertEqual('Имя', users.see('1'))
+        self.assertIs(users['1'], users.see(
+            '1', {'1': {'name': ''.join(['Им', 'я'])}}))
+        self.assertEqual('2', users.see('2'))
+        self.assertEqual('Другое', users.see('2', {'2': {'name': 'Другое'}}))
+        self.assertEqual('Имя', users.get('1'))
+        self.assertIsNone(users.get('3'))
+        self.assertEqual(2, len(users))
+
+    def test_expire(self):
+        now = [0]
+        users = UserDirectory(max_size=2, ttl=datetime.timedelta(seconds=10),
+                              now=lambda: now[0])
+        users.see('1')
+        users.see('2')
+        users.see('3')
+        self.assertEqual(1, users.expire())
+        self.assertNotIn('1', users)
+
+        now[0] = 5
+        users.see('2')
+        now[0] = 12
+        self.assertEqual(1, users.expire())
+        self.assertEqual(['2'], list(users))
@@ -0,0 +1,84 @@
+# coding utf-8
+
+import json
+import queue
+import unittest
+import unittest.mock as mock
+import urllib.error
+import urllib.request
+from telegram.error import TelegramError
+from meduzach.webhook import WebhookServer, start_webhook
+
+UPDATE = {
+    "update_id": 100,
+    "message": {
+        "message_id": 312,
+        "date": 1476000000,
+        "from": {"id": 123, "first_name": "Reader"},
+        "chat": {"id": 123, "type": "private"},
+        "text": "/chats"
+    }
+}
+
+
+def _post(server, path, data):
+    request = urllib.request.Request(
+        "http://{}:{}{}".format(server.host, server.port, path), data=data,
+        headers={"Content-Type": "application/json"})
+    return urllib.request.urlopen(request, timeout=5).status
+
+
+class TestWebhookServer(unittest.TestCase):
+    def setUp(self):
+        self.updates = queue.Queue()
+        self.server = WebhookServer(self.updates, port=0,
+                                    path="/secret").start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_update_queued(self):
+        self.assertEqual(
+            200, _post(self.server, "/secret", json.dumps(UPDATE).encode()))
+        update = self.updates.get(timeout=5)
+        self.assertEqual(100, update.update_id)
+        self.assertEqual("/chats", update.message.text)
+        self.assertEqual(123, update.message.chat_id)
+        self.assertEqual(1, self.server.received)
+
+    def test_wrong_path(self):
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            _post(self.server, "/", json.dumps(UPDATE).encode())
+        self.assertEqual(404, ctx.exception.code)
+        self.assertTrue(self.updates.empty())
+
+    def test_bad_payload(self):
+        with self.assertRaises(urllib.error.HTTPError) as ctx:
+            _post(self.server, "/secret", b"{not json")
+        self.assertEqual(400, ctx.exception.code)
+        self.assertTrue(self.updates.empty())
+
+
+class TestStartWebhook(unittest.TestCase):
+    def test_fallback_when_not_registered(self):
+        updater = mock.MagicMock()
+        updater.update_queue = queue.Queue()
+        updater.bot.setWebhook.side_effect = TelegramError("no")
+        self.assertIsNone(start_webhook(
+            updater, "https://example.com/secret", port=0))
+        updater.dispatcher.start.assert_not_called()
+
+    def test_started(self):
+        updater = mock.MagicMock()
+        updater.update_queue = queue.Queue()
+        server = start_webhook(updater, "https://example.com/secret", port=0)
+        try:
+            updater.bot.setWebhook.assert_called_once_with(
+                webhook_url="https://example.com/secret")
+            self.assertEqual("/secret", server.path)
+            self.assertIs(updater.dispatcher, server.dispatcher)
+        finally:
+            server.stop()
+        # Stopped along with the server, the updater is left alone.
+        updater.dispatcher.stop.assert_called_once_with()
+        updater.stop.assert_not_called()